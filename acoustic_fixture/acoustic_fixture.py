@@ -13,34 +13,67 @@ __author__ = "Andrew Miyaguchi"
 __copyright__ = "Copyright 2021, Andrew Miyaguchi"
 __license__ = "Apache 2.0"
 
-import pyaudio, serial, time
-from scipy.interpolate import interp1d
-from numpy import cos, pi, zeros, frombuffer, float32, roll, average
-from acoustic_trilateration import get_time_shift, trilateration, butter_bandpass_filter
-from trilateration_linear_regression_model import predict
-
-from serial_comms import waitFor, sendCommand
+import serial, time
+from numpy import cos, pi, zeros, float32, array
+from audio_capture import CaptureEngine, PyAudioSource
+from acoustic_trilateration import TimeDelayEstimator, StreamingBandpass
+from rolling_stats import RollingWindow
+from laser_worker import LaserCommandWorker
+from localization_backends import create_backend
+from session_recorder import SessionRecorder
+from latency_trace import LatencyTracer
+from target_tracker import TargetTracker
+from wingbeat_tracker import WingbeatTracker
+from fixture_geometry import FixtureGeometry
+
+from serial_comms import transport
 
 # Configuration
 COM_PORT = "COM3"   # Laser com port
 
 OFFLINE_MODE = False
+BINARY_PROTOCOL = True  # Aim with galvo_protocol frames instead of G1 text commands
 
 USE_MACHINE_LEARNING = 0
+BACKEND = "ml" if USE_MACHINE_LEARNING else "trilateration"  # trilateration, ml or lookup, see localization_backends.py
 RATE = 44100
 BUFFER = 882    # RATE must be evenly divisible by BUFFER
+CAPTURE_BLOCKS = 16 # Blocks of audio held by the capture engine before samples are dropped
+RECORD_SESSION = None   # Directory to record the raw microphone blocks to, see session_recorder.py
+TRACE_FILE = None   # JSON file to dump latency histograms to every TRACE_INTERVAL seconds, see latency_trace.py
+TRACE_PORT = None   # Serve latency histograms at http://127.0.0.1:TRACE_PORT/metrics
+TRACE_INTERVAL = 5
 
 LPF = 400
 HPF = 480
 
+# Move the bandpass to follow the wingbeat tone, see wingbeat_tracker.py. Only
+# for backends that set retunable, see localization_backends.py, the built in
+# ones are calibrated on amplitudes in the LPF to HPF band
+WINGBEAT_TRACKING = True
+WINGBEAT_SEARCH = (300, 900)    # Hz, range the tone is looked for in
+WINGBEAT_STEP = 10              # Hz between the frequencies checked
+WINGBEAT_HYSTERESIS = 20        # Hz the tone must move from the band center
+WINGBEAT_HOLD = 5               # blocks the tone must stay moved before retuning
+WINGBEAT_SNR = 4                # peak over median power that counts as a tone
+
 AMPLITUDE_MS = 500
 AMPLITUDE_SIZE = int(AMPLITUDE_MS/RATE*BUFFER)
 
-# Microphone calibrations in mm
+# Track the localized positions and aim ahead of them, see target_tracker.py
+TRACKING = True
+TRACK_PROCESS_NOISE = 500       # mm/s^2, how hard the target can accelerate
+TRACK_MEASUREMENT_NOISE = 10    # mm, localization noise after averaging
+
+# Microphone calibrations in mm, peak amplitude of each mic at CAL_DISTANCE. The
+# trilateration backend fits curves to these unless MIC_CALIBRATION exists,
+# see mic_calibration.py
+MIC_CALIBRATION = "mic_calibration.json"
+MIC_CAL_MODEL = "inverse_square"
 CAL_DISTANCE = [0, 25, 50, 100, 150, 200]
-M1_CAL = interp1d([1.3250, 0.0990, 0.0300, 0.0098, 0.0048, 0.0030], CAL_DISTANCE, kind='linear', fill_value="extrapolate")
-M2_CAL = interp1d([1.3200, 0.0810, 0.0260, 0.0094, 0.0058, 0.0045], CAL_DISTANCE, kind='linear', fill_value="extrapolate")
-M3_CAL = interp1d([1.3020, 0.0700, 0.0230, 0.0084, 0.0054, 0.0045], CAL_DISTANCE, kind='linear', fill_value="extrapolate")
+M1_CAL = [1.3250, 0.0990, 0.0300, 0.0098, 0.0048, 0.0030]
+M2_CAL = [1.3200, 0.0810, 0.0260, 0.0094, 0.0058, 0.0045]
+M3_CAL = [1.3020, 0.0700, 0.0230, 0.0084, 0.0054, 0.0045]
 MIC_CAL = [M1_CAL, M2_CAL, M3_CAL]
 #RADIAL_CAL = interp1d(CAL_DISTANCE, [1.0, 0.892857143, 0.714285714, 0.571428571, 0.5])
 
@@ -51,135 +84,238 @@ FIXT_E = FIXT_D/2
 FIXT_F = FIXT_MIC_RADIUS + FIXT_MIC_RADIUS/2
 #print([FIXT_D, FIXT_E, FIXT_F])
 
-ser = None
+# Microphone positions with the origin at the center of the fixture
+FIXT_MIC_POSITIONS = array([
+    [-FIXT_E, -FIXT_MIC_RADIUS/2, 0],   # Mosquito 1
+    [0, FIXT_MIC_RADIUS, 0],            # Mosquito 2
+    [FIXT_E, -FIXT_MIC_RADIUS/2, 0]])   # Mosquito 3
+
+# Test fixture is 342.9 mm + 80.7 mm + 24 mm = X0 Y447.6 Z56
+FIXT_LASER_ORIGIN = (0, 447.6, 56)
+
+# The three mic bench fixture, GEOMETRY replaces it with a fixture_geometry.py JSON file
+GEOMETRY = None
+DEFAULT_GEOMETRY = FixtureGeometry(["Mosquito 1", "Mosquito 2", "Mosquito 3"], FIXT_MIC_POSITIONS, FIXT_LASER_ORIGIN, name="bench")
+
+# Sound can't arrive at two mics further apart than their spacing allows
+SPEED_OF_SOUND = 343000 # mm/s
+MAX_LAG_MS = FIXT_D / SPEED_OF_SOUND * 1000
+
+# Everything a localization backend may need
+BACKEND_CONFIG = {
+    "mic_positions": FIXT_MIC_POSITIONS,
+    "cal_distance": CAL_DISTANCE,
+    "cal_amplitudes": MIC_CAL,
+    "cal_model": MIC_CAL_MODEL,
+    "mic_calibration": MIC_CALIBRATION,
+    "model_path": "model.obj",
+    "lookup_path": "lookup.npz",
+}
+
+## connect_laser
+# Open the laser galvo, turn the laser on and start the aim worker
+#
+# @param  tracer optional LatencyTracer for the write and ack checkpoints
+# @return (serial port, LaserCommandWorker)
+def connect_laser(tracer=None):
+    print("Connecting to Laser...")
+    ser = serial.Serial(COM_PORT, 115200)
+    port = transport(ser)
+    port.wait_for("\rsh$ ")    # Wait for the system to initialize
+    port.send("M3", "\rsh$ ")
+
+    # Aim updates are sent from a background thread
+    laser = LaserCommandWorker(ser, "\rsh$ ", binary=BINARY_PROTOCOL)
+    laser.tracer = tracer
+    laser.start()
+    return ser, laser
 
 class AcousticFixture:
-    mic_dict = {"Mosquito 1":[-1, ""], "Mosquito 2":[-1, ""], "Mosquito 3":[-1, ""]}
-
-    # Pre-allocate buffers
-    buf = [zeros(BUFFER) for y in range(len(mic_dict))]
-    buf_copy = buf.copy()
-    buf_filtered = buf.copy()
-    voltage_data = buf.copy()
-    amplitude_buffer = [zeros(AMPLITUDE_SIZE) for i in range(len(mic_dict))]
-    amplitude_avg = zeros(len(mic_dict) + 1)
-    delay_buffer = [zeros(AMPLITUDE_SIZE) for i in range(len(mic_dict))]
-    delay_avg = zeros(len(mic_dict) + 1)
-    calibration_mode = False
-
-    streams = []
-    x = 0
-    y = 0
-    z = 0
-
-    # Custom callback which inserts the index of the microphone into the local scope
-    def portaudio_callback(this, idx):
-        def callback(in_data, frame_count, time_info, status):
-            this.buf[idx] = frombuffer(in_data,dtype=float32)
-            return (this.buf[idx], pyaudio.paComplete)
-        return callback
-
-    def active(this):
-        for s in this.streams:
-            if s.is_active():
-                return True
-        return False
-
-    def __init__(this, cal_mode = False):
-        global ser
+    ## __init__
+    # @param cal_mode calibration mode, skips localization
+    # @param source   capture source, the USB microphones if None. Pass a
+    #                 FileSource or SyntheticSource to run without hardware
+    # @param backend  localization backend name, BACKEND if None
+    # @param record   session directory to record every block to, RECORD_SESSION if None
+    # @param geometry FixtureGeometry or JSON file, GEOMETRY or the bench fixture if None
+    # @param offline  don't connect to the laser, OFFLINE_MODE if None
+    # @param verbose  print a line for every frame
+    # @param capture  start a capture engine, False when blocks are handed to feed()
+    def __init__(this, cal_mode = False, source = None, backend = None, record = None, geometry = None, offline = None, verbose = True, capture = True):
         this.calibration_mode = cal_mode
+        this.offline = OFFLINE_MODE if offline is None else offline
+        this.verbose = verbose
+
+        geometry = geometry or GEOMETRY
+        if isinstance(geometry, str):
+            geometry = FixtureGeometry.load(geometry)
+        this.geometry = geometry or DEFAULT_GEOMETRY
+        mics = len(this.geometry)
+
+        # Device index and name of each microphone, filled in by PyAudioSource
+        this.mic_dict = {name: [-1, ""] for name in this.geometry.names}
+
+        # Pre-allocate buffers
+        this.buf_copy = zeros((mics, BUFFER), dtype=float32)
+        this.buf_filtered = zeros((mics, BUFFER))
+        this.voltage_data = zeros((mics, BUFFER))
+        this.amplitude_avg = zeros(mics)
+        this.delay_avg = zeros(mics)
+
+        this.backend = None
+        this.recorder = None
+        this.tracer = None
+        this.tracker = None
+        this.wingbeat = None
+        this.laser = None
+        this.ser = None
+        this.engine = None
+        this.block_time = None
+        this.x = 0
+        this.y = 0
+        this.z = 0
+
+        # The backend is only imported when we actually localize
+        if not cal_mode:
+            this.backend = create_backend(backend or BACKEND, this.geometry.backend_config(BACKEND_CONFIG))
 
         # Print config
-        print("Sample Rate: %d Hz\nBuffer Size: %d frames\nSample Length: %d ms\n" % (RATE, BUFFER, 1/RATE*BUFFER*1000))
-
-        p = pyaudio.PyAudio()
-
-        # Search for our microphones
-        print("Searching for microphones by name")
-        info = p.get_host_api_info_by_index(0)
-        numdevices = info.get('deviceCount')
-        for i in range(numdevices):
-                if (p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
-                    dev_name = p.get_device_info_by_host_api_device_index(0, i).get('name')
-                    #print("Input Device id %d - %s" % (i, dev_name))
-
-                    # Check if this is the correct microphone and set the index
-                    for key in this.mic_dict:
-                        if key in dev_name:
-                            this.mic_dict[key][0] = i
-                            this.mic_dict[key][1] = dev_name
-
-        # Verify that all microphones are attached
-        for key in this.mic_dict:
-            if this.mic_dict[key][0] == -1:
-                print("%s not found. Please make sure the device is plugged in." % (key))
-                exit()
-
-        # Print all microphone id
-        for key in this.mic_dict:
-            print("Input Device id %d - %s" % (this.mic_dict[key][0], this.mic_dict[key][1]))
-
-        # Open microphone streams
-        for key in this.mic_dict:
-            this.streams.append(p.open(
-                format = pyaudio.paFloat32,
-                channels = 1,
-                rate = RATE,
-                input = True,
-                output = False,
-                frames_per_buffer = BUFFER,
-                input_device_index = this.mic_dict[key][0],
-                stream_callback = this.portaudio_callback(list(this.mic_dict.keys()).index(key))
-            ))
-
-        # Aquire the first samples
-        for s in this.streams:
-            s.start_stream()
-
-        print("Connecting to Laser...")
-        if not OFFLINE_MODE:
-            ser = serial.Serial(COM_PORT, 115200)
-            waitFor(ser, "\rsh$ ")    # Wait for the system to initialize
-            sendCommand(ser, "M3", "\rsh$ ")
-        print("Offline mode. Laser module disconnected.")
-
+        if verbose:
+            print("Sample Rate: %d Hz\nBuffer Size: %d frames\nSample Length: %d ms\n" % (RATE, BUFFER, 1/RATE*BUFFER*1000))
+
+        # Design the filter once, its state carries over between blocks
+        this.max_lag_ms = this.geometry.max_spacing() / SPEED_OF_SOUND * 1000
+        this.band = (LPF, HPF)
+        this.bandpass = StreamingBandpass(LPF, HPF, RATE, 3, mics)
+        this.tdoa = TimeDelayEstimator(BUFFER, RATE, this.max_lag_ms, this.band)
+
+        # The calibration tone is fixed, only follow live targets. Backends
+        # calibrated on amplitudes in the LPF to HPF band would compare
+        # amplitudes from the new band against the old tables, they keep it
+        if WINGBEAT_TRACKING and not cal_mode:
+            if getattr(this.backend, "retunable", False):
+                this.wingbeat = WingbeatTracker(BUFFER, RATE, this.band, WINGBEAT_SEARCH, WINGBEAT_STEP, WINGBEAT_HYSTERESIS, WINGBEAT_HOLD, WINGBEAT_SNR)
+            elif verbose:
+                print("Wingbeat tracking off, the %s backend is calibrated for %d Hz to %d Hz" % (backend or BACKEND, LPF, HPF))
+
+        if TRACKING and not cal_mode:
+            this.tracker = TargetTracker(TRACK_PROCESS_NOISE, TRACK_MEASUREMENT_NOISE)
+
+        # Rolling averages of the amplitudes and delays
+        this.amplitude_buffer = RollingWindow(mics, AMPLITUDE_SIZE)
+        this.delay_buffer = RollingWindow(mics, AMPLITUDE_SIZE)
+
+        if source is None and capture:
+            source = PyAudioSource(this.mic_dict, RATE, BUFFER)
+
+        record = record or RECORD_SESSION
+        if record is not None:
+            this.recorder = SessionRecorder(record, mics, BUFFER, RATE)
+
+        # Latency tracing costs nothing unless it is enabled
+        if TRACE_FILE is not None or TRACE_PORT is not None:
+            this.tracer = LatencyTracer()
+            if TRACE_FILE is not None:
+                this.tracer.start_dump(TRACE_FILE, TRACE_INTERVAL)
+            if TRACE_PORT is not None:
+                print("Serving latency metrics at http://127.0.0.1:%d/metrics" % (this.tracer.serve(TRACE_PORT)))
+
+        # Start the continuous capture, samples keep accumulating while we process
+        if capture:
+            this.engine = CaptureEngine(mics, BUFFER, RATE, CAPTURE_BLOCKS)
+            this.engine.start(source)
+
+        if this.offline:
+            if verbose:
+                print("Offline mode. Laser module disconnected.")
+        else:
+            this.ser, this.laser = connect_laser(this.tracer)
+
+    def close(this):
+        if this.engine is not None:
+            this.engine.stop()
+        if this.laser is not None:
+            this.laser.stop()
+        if this.recorder is not None:
+            this.recorder.close()
+        if this.tracer is not None:
+            this.tracer.close()
+
+    ## update
+    # Wait for the next synchronized block from the capture engine and process it
+    #
+    # @param  corr_lines optional correlation plot lines
+    # @return False when the capture source has no more data
     def update(this, corr_lines=None):
-        global ser
-        # Wait until all streams stop
-        while this.active():
-            pass
+        if this.engine.read_block(this.buf_copy) is None:
+            return False
+
+        this.feed(this.buf_copy, this.engine.block_time, corr_lines)
+        return True
+
+    ## feed
+    # Process a block captured somewhere else, see process_pipeline.py. The
+    # block is used in place, it is not copied.
+    #
+    # @param block      (mics x BUFFER) float32 samples
+    # @param block_time monotonic capture time of the first sample
+    # @param corr_lines optional correlation plot lines
+    def feed(this, block, block_time, corr_lines=None):
+        this.buf_copy = block
+        this.block_time = block_time
+
+        if this.tracer is not None:
+            this.tracer.mark("capture", block_time)
+
+        if this.recorder is not None:
+            this.recorder.write(block, block_time)
+
+        this.process(corr_lines)
+
+    ## retune
+    # Move the bandpass and the delay estimator's band
+    def retune(this, lowcut, highcut):
+        this.band = (lowcut, highcut)
+        this.bandpass.retune(lowcut, highcut)
+        this.tdoa.set_band(this.band)
+        if this.verbose:
+            print("Bandpass retuned to %.0f Hz to %.0f Hz" % this.band)
+
+    def process(this, corr_lines=None):
+        # Follow the wingbeat tone on the raw samples, the filter would hide it
+        if this.wingbeat is not None:
+            band = this.wingbeat.update(this.buf_copy)
+            if band is not None:
+                this.retune(*band)
+
+        # Apply the bandpass filter to all microphones at once
+        this.buf_filtered = this.bandpass.filter(this.buf_copy)
+        tracer = this.tracer
+        origin = this.block_time
+        if tracer is not None:
+            tracer.mark("filter", origin)
+
+        # Get the delays relative to the first microphone
+        delays = this.tdoa.estimate(this.buf_filtered, [lines[0] for lines in corr_lines] if corr_lines != None else None)
+
+        this.delay_avg = this.delay_buffer.push(delays)
+        if tracer is not None:
+            tracer.mark("tdoa", origin)
+
+        # Write voltage chart data
+        this.voltage_data = (this.buf_filtered * 2.25) + 2.25
+
+        # DEBUG print the buffer for use in offline mode
+        #print("signal[%d] = %s" % (i, repr(buf_filtered[i]).replace("array(", "").replace(")", "")))
+
+        # Extrapolate rolling average distance to be fed into trilateration
+        peaks = this.buf_filtered.max(axis=1)
+        if this.calibration_mode:
+            amplitudes = peaks # Also enable the mic cal line below
+        else:
+            amplitudes = this.backend.features(peaks)
 
-        # Copy the data to a new buffer
-        this.buf_copy = this.buf.copy()
-        
-        # Start the data aquisition for the next cycle before running the routine
-        for s in this.streams:
-            s.stop_stream()
-            s.start_stream()
-
-        for i in range(len(this.streams)):
-            # Apply the bandpass filter and write to global var
-            this.buf_filtered[i] = butter_bandpass_filter(this.buf_copy[i], LPF, HPF, RATE, 3)
-
-            # Get the delay relative to the first microphone
-            this.delay_buffer[i][0] = get_time_shift(this.buf_filtered[0], this.buf_filtered[i], BUFFER, RATE, corr_lines[i][0] if corr_lines != None else None)
-            this.delay_buffer[i] = roll(this.delay_buffer[i], 1)
-            this.delay_avg[i] = average(this.delay_buffer[i])
-
-            # Write voltage chart data
-            this.voltage_data[i] = (this.buf_filtered[i] * 2.25) + 2.25
-
-            # DEBUG print the buffer for use in offline mode
-            #print("signal[%d] = %s" % (i, repr(buf_filtered[i]).replace("array(", "").replace(")", "")))
-
-            # Extrapolate rolling average distance to be fed into trilateration
-            if this.calibration_mode or USE_MACHINE_LEARNING:
-                this.amplitude_buffer[i][0] = max(this.buf_filtered[i]) # Also enable the mic cal line below
-            else:
-                this.amplitude_buffer[i][0] = MIC_CAL[i](max(this.buf_filtered[i]))
-            
-            this.amplitude_buffer[i] = roll(this.amplitude_buffer[i], 1)
-            this.amplitude_avg[i] = average(this.amplitude_buffer[i])
+        this.amplitude_avg = this.amplitude_buffer.push(amplitudes)
 
         # print average amplitudes
         #amplitude_avg[-1] = average(amplitude_avg[0:-1])    # Calculate overall average
@@ -192,22 +328,63 @@ class AcousticFixture:
 
         # Print info line
         else:
-            if USE_MACHINE_LEARNING:
-                # Predict using machine learning
-                this.x, this.y, this.z = predict([this.amplitude_avg[0], this.amplitude_avg[1], this.amplitude_avg[2]])[0]
-            else:
-                # Calcuate using trilateration
-                (this.x, this.y, this.z) = trilateration(this.amplitude_avg[0], this.amplitude_avg[2], this.amplitude_avg[1], FIXT_D, FIXT_E, FIXT_F)
-
-                # Move the origin to the center of the fixture
-                this.x -= FIXT_E
-                this.y -= FIXT_MIC_RADIUS/2
-
-
-            if not OFFLINE_MODE:
-                # Test fixture is 342.9 mm + 80.7 mm + 24 mm = X0 Y447.6 Z56
-                sendCommand(ser, "G1 X%.2f Y%.2f Z%.2f" % (this.x, this.y + 447.6, this.z + 56), "\rsh$ ")
-
-            print("x: %4.0f, y: %4.0f, z: %4.0f, (r1: %3.0f, r2: %3.0f, r3: %3.0f), d1: %5.2f, d2: %5.2f, d3: %5.2f" % (this.x, this.y, this.z, this.amplitude_avg[0], this.amplitude_avg[1], this.amplitude_avg[2], this.delay_avg[0], this.delay_avg[1], this.delay_avg[2]))
-        
-
+            # Calculate the position, warm started from the last position
+            positions = this.backend.locate(this.amplitude_avg, (this.x, this.y, this.z))
+            (this.x, this.y, this.z) = positions[0]
+
+            # Aim where the target will be when the laser gets there
+            target = (this.x, this.y, this.z)
+            if this.tracker is not None:
+                this.tracker.update(positions, origin if origin is not None else time.monotonic())
+                predicted = this.tracker.target(this.lead_time(origin))
+                if predicted is not None:
+                    target = predicted
+
+            if tracer is not None:
+                tracer.mark("localize", origin)
+
+            if this.laser is not None:
+                this.laser.submit(this.geometry.to_laser(target), origin)
+                if tracer is not None:
+                    tracer.mark("enqueue", origin)
+
+            if this.verbose:
+                ranges = ", ".join("r%d: %3.0f" % (i + 1, r) for i, r in enumerate(this.amplitude_avg))
+                delays = ", ".join("d%d: %5.2f" % (i + 1, d) for i, d in enumerate(this.delay_avg))
+                print("x: %4.0f, y: %4.0f, z: %4.0f, (%s), %s" % (this.x, this.y, this.z, ranges, delays))
+
+    ## lead_time
+    # Seconds between the middle of the averaged audio and the laser moving:
+    # half the amplitude window, the time spent in the pipeline so far and
+    # the galvo command round trip, measured when latency tracing is enabled
+    #
+    # @param  origin capture time of the current frame
+    # @return lead time in seconds
+    def lead_time(this, origin):
+        lead = (AMPLITUDE_SIZE - 1) / 2 * BUFFER / RATE
+
+        measured = this.tracer.latency("ack") if this.tracer is not None else None
+        if measured is not None:
+            return lead + measured
+
+        if origin is not None:
+            lead += time.monotonic() - origin
+        if this.laser is not None:
+            lead += this.laser.last_latency
+        return lead
+
+## create_fixture
+# Build a fixture with the given backend and capture source. Importing this
+# module has no side effects, the hardware is only opened here.
+#
+# @param  backend  localization backend name, BACKEND if None
+# @param  source   capture source, the USB microphones if None
+# @param  cal_mode calibration mode, no backend is loaded
+# @param  record   session directory to record to, see session_recorder.py
+# @param  geometry FixtureGeometry or JSON file, see fixture_geometry.py
+# @param  offline  don't connect to the laser, OFFLINE_MODE if None
+# @param  verbose  print a line for every frame
+# @param  capture  start a capture engine, False to feed() blocks instead
+# @return AcousticFixture
+def create_fixture(backend=None, source=None, cal_mode=False, record=None, geometry=None, offline=None, verbose=True, capture=True):
+    return AcousticFixture(cal_mode=cal_mode, source=source, backend=backend, record=record, geometry=geometry, offline=offline, verbose=verbose, capture=capture)
@@ -10,35 +10,114 @@ __copyright__ = "Copyright 2021, Andrew Miyaguchi"
 __license__ = "Apache 2.0"
 
 import numpy
-from scipy.signal import butter, lfilter
-from scipy import signal
+from functools import lru_cache
+from scipy.fft import rfft, irfft, next_fast_len
+
+# scipy.signal is slow to import, the filter functions import it when first used
+
+## TimeDelayEstimator
+# Batched GCC-PHAT time delay estimation. Every channel is cross correlated
+# with the reference channel in the frequency domain in a single pass. The
+# phase transform whitens the cross spectrum so the peak stays sharp for a
+# narrowband tone, and the peak search is limited to the lags that the mic
+# spacing allows. Parabolic interpolation around the peak gives sub-sample
+# resolution.
+# https://www.researchgate.net/publication/224712638_The_Generalized_Correlation_Method_for_Estimation_of_Time_Delay
+#
+# @param n          buffer size
+# @param sr         sampling rate
+# @param max_lag_ms largest physically possible delay, n/2 samples if None
+# @param band       optional (lowcut, highcut), bins outside are ignored
+# @param ref        index of the reference channel
+# @param phat       apply the phase transform, otherwise return the plain
+#                   normalized cross correlation coefficient
+class TimeDelayEstimator:
+	def __init__(this, n, sr, max_lag_ms=None, band=None, ref=0, phat=True):
+		this.n = n
+		this.sr = sr
+		this.ref = ref
+		this.phat = phat
+		this.nfft = next_fast_len(2 * n, real=True)
+
+		# Lag window, with one extra sample on each side for the interpolation
+		max_lag = n // 2 if max_lag_ms is None else int(numpy.ceil(max_lag_ms * sr / 1000)) + 1
+		max_lag = min(max_lag, n - 1)
+		this.lags = numpy.arange(-max_lag, max_lag + 1)
+		this.lag_ms = this.lags / sr * 1000
+		this.lag_idx = this.lags % this.nfft
+		this.corr = numpy.zeros((0, len(this.lags)))
+
+		this.set_band(band)
+
+	## set_band
+	# Frequency weighting, scaled so a perfectly coherent PHAT pair peaks at 1
+	#
+	# @param band (lowcut, highcut), every bin is used if None
+	def set_band(this, band):
+		this.weights = numpy.ones(this.nfft // 2 + 1)
+		if band is not None:
+			freqs = numpy.fft.rfftfreq(this.nfft, 1 / this.sr)
+			this.weights = ((freqs >= band[0]) & (freqs <= band[1])).astype(float)
+		if this.phat:
+			this.weights *= this.nfft / max(2 * this.weights.sum(), 1)
+
+	## estimate
+	# @param  block (channels x n) signals
+	# @param  lines optional plot line per channel, set to the correlation
+	# @return delay of each channel relative to the reference in ms
+	def estimate(this, block, lines=None):
+		spectrum = rfft(block, this.nfft, axis=-1)
+		cross = spectrum * numpy.conj(spectrum[this.ref])
+		if this.phat:
+			cross *= this.weights / numpy.maximum(numpy.abs(cross), 1e-20)
+		else:
+			cross *= this.weights
+		corr = irfft(cross, this.nfft, axis=-1)[:, this.lag_idx]
+
+		# Scale to the ratio of s2/s1 like a correlation coefficient
+		if not this.phat:
+			energy = numpy.einsum('ij,ij->i', block, block)
+			corr /= numpy.sqrt(numpy.maximum(energy * energy[this.ref], 1e-30))[:, None]
+
+		# Find the peak and fit a parabola through its neighbours
+		rows = numpy.arange(len(corr))
+		peak = numpy.clip(numpy.argmax(corr, axis=-1), 1, len(this.lags) - 2)
+		y0 = corr[rows, peak - 1]
+		y1 = corr[rows, peak]
+		y2 = corr[rows, peak + 1]
+		denom = y0 - 2 * y1 + y2
+		offset = numpy.where(denom < 0, 0.5 * (y0 - y2) / numpy.where(denom < 0, denom, -1), 0)
+
+		# Keep the last correlation for plotting from another thread
+		this.corr = corr
+
+		if lines is not None:
+			for line, c in zip(lines, corr):
+				if line is not None:
+					line.set_data(this.lag_ms, c)
+
+		return (this.lags[peak] + offset) / this.sr * 1000
+
+@lru_cache(maxsize=None)
+def time_delay_estimator(n, sr):
+	return TimeDelayEstimator(n, sr, phat=False)
 
 ## get_time_shift
 # Find the time delay between two signals using correlation. The lag with the
 # highest coefficient is when the two signals best overlap.
-# https://stackoverflow.com/questions/41492882/find-time-shift-of-two-signals-using-cross-correlation/56432463
 #
 # @param  s1 signal 1
 # @param  s2 signal 2
 # @param  n  buffer size
 # @param  sr sampling rate
-# @return s2 delay
+# @return s2 delay in ms
 def get_time_shift(s1, s2, n, sr, line=None):
-	# Get the correlation of s2 to s1, to the ratio of s2/s1
-	corr = signal.correlate(s2, s1, mode='same') / numpy.sqrt(signal.correlate(s1, s1, mode='same')[int(n/2)] * signal.correlate(s2, s2, mode='same')[int(n/2)])
-
-	# Find the delay
-	delay_arr = numpy.linspace(-0.5*n/sr*1000, 0.5*n/sr*1000, n)
-	delay = delay_arr[numpy.argmax(corr)]
-	#print("Delay: %.2f ms" % (delay))
-
-	if line != None:
-		line.set_data(delay_arr, corr)
-	
-	return delay
+	return time_delay_estimator(n, sr).estimate(numpy.vstack((s1, s2)), [None, line])[1]
 
-# Butter bandpass filters
+# Butter bandpass filters, the design only depends on the arguments so cache it
+@lru_cache(maxsize=None)
 def butter_bandpass(lowcut, highcut, fs, order=5):
+	from scipy.signal import butter
 	nyq = 0.5 * fs
 	low = lowcut / nyq
 	high = highcut / nyq
@@ -47,10 +126,48 @@ def butter_bandpass(lowcut, highcut, fs, order=5):
 
 # use lfilter instead of filtfilt. shifted by one phase, but requires less processessing
 def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
+	from scipy.signal import lfilter
 	b, a = butter_bandpass(lowcut, highcut, fs, order=order)
 	y = lfilter(b, a, data) 
 	return y
 
+## StreamingBandpass
+# Butterworth bandpass for a continuous multichannel stream. The filter is
+# designed once as second order sections and the filter state is carried from
+# one block to the next, so consecutive blocks join without the startup
+# transient of a fresh lfilter call.
+#
+# @param lowcut   low cutoff frequency
+# @param highcut  high cutoff frequency
+# @param fs       sampling rate
+# @param order    filter order
+# @param channels number of rows in each block
+class StreamingBandpass:
+	def __init__(this, lowcut, highcut, fs, order=5, channels=1):
+		from scipy.signal import sosfilt
+		this.sosfilt = sosfilt
+		this.fs = fs
+		this.order = order
+		this.retune(lowcut, highcut)
+		this.zi = numpy.zeros((this.sos.shape[0], channels, 2))
+
+	# Move the passband without dropping the filter state. The order stays the
+	# same so the state still fits, the stream just rings briefly at the change.
+	def retune(this, lowcut, highcut):
+		from scipy.signal import butter
+		nyq = 0.5 * this.fs
+		this.sos = butter(this.order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+		this.band = (lowcut, highcut)
+
+	# Filter a (channels x samples) block, continuing from the previous block
+	def filter(this, data):
+		y, this.zi = this.sosfilt(this.sos, data, axis=-1, zi=this.zi)
+		return y
+
+	# Forget the filter history, e.g. after a gap in the stream
+	def reset(this):
+		this.zi[:] = 0
+
 # Intersection of three spheres
 # https://demonstrations.wolfram.com/TrilaterationAndTheIntersectionOfThreeSpheres/
 # http://wiki.gis.com/wiki/index.php/Trilateration
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" array_store.py: appendable on-disk arrays
+    Rows of a fixed shape are appended to a raw binary file and described by
+    a small JSON header next to it. Writers never hold more than the rows
+    they are appending, readers np.memmap the file and only page in the rows
+    they slice.
+
+    <name>.json  {"dtype": "float32", "shape": [row shape], "meta": {...}}
+    <name>.bin   rows in C order, the row count is the file size / row size
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import json, os
+import numpy as np
+
+def read_header(path):
+    with open(path + ".json", "r") as f:
+        return json.load(f)
+
+## open_array
+# Memory map an array written by AppendableArray
+#
+# @param  path base path without the extension
+# @param  mode np.memmap mode, "r" or "r+"
+# @return (rows x shape) array, a partially written last row is ignored
+def open_array(path, mode="r"):
+    header = read_header(path)
+    dtype = np.dtype(header["dtype"])
+    shape = tuple(header["shape"])
+    row_bytes = dtype.itemsize * int(np.prod(shape))
+    rows = os.path.getsize(path + ".bin") // row_bytes
+
+    # np.memmap can't map an empty file
+    if rows == 0:
+        return np.zeros((0,) + shape, dtype)
+    return np.memmap(path + ".bin", dtype, mode, shape=(rows,) + shape)
+
+class AppendableArray:
+    ## __init__
+    # Creates the array, or reopens it to append if it exists
+    #
+    # @param path  base path without the extension
+    # @param shape shape of one row, only needed to create the array
+    # @param dtype row data type
+    # @param meta  extra JSON values to keep in the header
+    def __init__(this, path, shape=None, dtype="float32", meta=None):
+        this.path = path
+
+        if os.path.exists(path + ".json"):
+            header = read_header(path)
+            if shape is not None and tuple(shape) != tuple(header["shape"]):
+                raise ValueError("%s holds rows of %s, not %s" % (path, tuple(header["shape"]), tuple(shape)))
+        else:
+            if shape is None:
+                raise ValueError("%s doesn't exist and no row shape was given" % (path))
+            header = {"dtype": np.dtype(dtype).str, "shape": [int(n) for n in shape], "meta": meta or {}}
+            with open(path + ".json", "w") as f:
+                json.dump(header, f, indent=2)
+
+        this.meta = header["meta"]
+        this.dtype = np.dtype(header["dtype"])
+        this.shape = tuple(header["shape"])
+        this.row_bytes = this.dtype.itemsize * int(np.prod(this.shape))
+
+        this.file = open(path + ".bin", "ab")
+        this.truncate()
+
+    ## truncate
+    # Drop rows past the given count, by default only a partially written
+    # row left behind by a crash
+    #
+    # @param  rows number of rows to keep
+    # @return number of rows
+    def truncate(this, rows=None):
+        this.file.flush()
+        size = os.path.getsize(this.path + ".bin")
+        if rows is None:
+            rows = size // this.row_bytes
+        if size != rows * this.row_bytes:
+            this.file.truncate(rows * this.row_bytes)
+        this.rows = rows
+        return rows
+
+    ## append
+    # @param  rows one row or a stack of rows
+    # @return index of the first appended row
+    def append(this, rows):
+        rows = np.ascontiguousarray(rows, this.dtype).reshape((-1,) + this.shape)
+        index = this.rows
+        this.file.write(rows.tobytes())
+        this.rows += len(rows)
+        return index
+
+    def flush(this):
+        this.file.flush()
+        os.fsync(this.file.fileno())
+
+    def close(this):
+        if not this.file.closed:
+            this.flush()
+            this.file.close()
+
+    def __len__(this):
+        return this.rows
+
+    def __enter__(this):
+        return this
+
+    def __exit__(this, *args):
+        this.close()
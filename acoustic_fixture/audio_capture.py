@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" audio_capture.py: continuous multichannel capture engine
+    Every microphone writes into its own ring buffer straight from the audio
+    callback, and the streams are never stopped between frames. The consumer
+    blocks until each channel holds a full block, so the samples that arrive
+    while the DSP is running are kept for the next frame instead of dropped.
+
+    Sources are pluggable so the fixture can be driven without microphones:
+    PyAudioSource (USB microphones), FileSource (WAV or NumPy recordings) and
+    SyntheticSource (generated tones with per channel delay and gain).
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import threading, time, wave
+from collections import deque
+from numpy import zeros, float32, frombuffer, arange, sin, pi, int16, int32, uint8, asarray, load
+from numpy.random import default_rng
+
+class RingBuffer:
+    """ Single producer, single consumer sample buffer
+        The producer only moves write_idx and the consumer only moves read_idx,
+        so the audio callback never has to take a lock to store samples.
+    """
+
+    def __init__(this, capacity):
+        this.data = zeros(capacity, dtype=float32)
+        this.capacity = capacity
+        this.write_idx = 0      # Total frames written
+        this.read_idx = 0       # Total frames read
+        this.dropped = 0        # Frames discarded because the consumer fell behind
+        this.marks = deque()    # (write_idx, capture time of the sample there) at each unread chunk
+
+    def available(this):
+        return this.write_idx - this.read_idx
+
+    def space(this):
+        return this.capacity - this.available()
+
+    def write(this, samples, start_time):
+        n = len(samples)
+
+        # Never overwrite unread data, drop the whole chunk so the channels stay aligned
+        if n > this.space():
+            this.dropped += n
+            return False
+
+        start = this.write_idx % this.capacity
+        first = min(n, this.capacity - start)
+        this.data[start:start + first] = samples[:first]
+        this.data[:n - first] = samples[first:]
+
+        # Publish the samples only after they and their time are in place
+        this.marks.append((this.write_idx, start_time))
+        this.write_idx += n
+        return True
+
+    ## mark
+    # Consumer side, forgets the chunks before index
+    # @return (write_idx, capture time) of the chunk holding sample index, None before any write
+    def mark(this, index):
+        while len(this.marks) > 1 and this.marks[1][0] <= index:
+            this.marks.popleft()
+        return this.marks[0] if this.marks else None
+
+    def read(this, out):
+        n = len(out)
+        start = this.read_idx % this.capacity
+        first = min(n, this.capacity - start)
+        out[:first] = this.data[start:start + first]
+        out[first:] = this.data[:n - first]
+        this.read_idx += n
+        return out
+
+class CaptureEngine:
+    """ Collects samples from a source into synchronized (channels x block) frames"""
+
+    def __init__(this, channels, block_size, rate, capacity_blocks=16):
+        this.channels = channels
+        this.block_size = block_size
+        this.rate = rate
+        this.rings = [RingBuffer(block_size * capacity_blocks) for i in range(channels)]
+
+        # Chunks each channel delivered, and whether chunk k is kept on every
+        # channel: {k: [stored, channels still to deliver it]}
+        this.chunks = [0] * channels
+        this.verdicts = {}
+        this.chunk_lock = threading.Lock()
+        this.ready = threading.Condition()
+        this.finished = False
+        this.block_time = None  # Capture time of the first sample of the last block read
+        this.blocks_read = 0
+        this.source = None
+
+    def start(this, source):
+        this.source = source
+        this.finished = False
+        source.start(this)
+
+    def stop(this):
+        # Wake up a source waiting for space before joining it
+        this.finish()
+        if this.source is not None:
+            this.source.stop()
+
+    # Called by the source when there is no more data to deliver
+    def finish(this):
+        with this.ready:
+            this.finished = True
+            this.ready.notify_all()
+
+    # Throw away the samples captured so far, the next block starts with fresh samples.
+    # Every channel skips the same number of frames so they stay aligned.
+    def discard(this):
+        n = min(ring.available() for ring in this.rings)
+        for ring in this.rings:
+            ring.read_idx += n
+
+        with this.ready:
+            this.ready.notify_all()
+
+    def dropped(this):
+        return sum(ring.dropped for ring in this.rings)
+
+    def block_ready(this):
+        return min(ring.available() for ring in this.rings) >= this.block_size
+
+    ## write
+    # Store samples for one channel. Audio callbacks must use block=False so
+    # they never wait on the consumer; file sources use block=True to apply
+    # backpressure when replaying faster than the DSP can keep up.
+    #
+    # Channels drop in lockstep: the first channel to deliver its k-th chunk
+    # decides whether chunk k fits, and every other channel keeps or drops its
+    # own k-th chunk the same way. Deciding per ring would let one channel
+    # drop a chunk that another still had room for, and every block after
+    # would pair chunks from different times. The later channels always have
+    # room for a kept chunk since they hold no more chunks than the first one
+    # did and the consumer only frees space.
+    #
+    # @param  channel   channel index
+    # @param  samples   float32 samples
+    # @param  timestamp time.monotonic() of the first sample, now if None
+    # @param  block     wait for free space instead of dropping the samples
+    # @return True if the samples were stored
+    def write(this, channel, samples, timestamp=None, block=False):
+        ring = this.rings[channel]
+        n = len(samples)
+        if timestamp is None:
+            timestamp = time.monotonic() - n / this.rate
+
+        if block and ring.space() < n:
+            with this.ready:
+                this.ready.wait_for(lambda: ring.space() >= n or this.finished)
+
+        with this.chunk_lock:
+            k = this.chunks[channel]
+            this.chunks[channel] += 1
+            verdict = this.verdicts.get(k)
+            if verdict is None:
+                verdict = this.verdicts[k] = [ring.space() >= n, this.channels]
+            verdict[1] -= 1
+            if not verdict[1]:
+                del this.verdicts[k]
+
+        if verdict[0]:
+            stored = ring.write(samples, timestamp)
+        else:
+            ring.dropped += n
+            stored = False
+
+        if stored and ring.available() >= this.block_size:
+            with this.ready:
+                this.ready.notify_all()
+
+        return stored
+
+    ## read_block
+    # Block until every channel has a full block and copy it out
+    #
+    # @param  out     optional (channels x block_size) float32 array to fill
+    # @param  timeout seconds to wait, forever if None
+    # @return the filled block, or None on timeout or when the source finished
+    def read_block(this, out=None, timeout=None):
+        with this.ready:
+            if not this.ready.wait_for(lambda: this.block_ready() or this.finished, timeout):
+                return None
+            if not this.block_ready():
+                return None
+
+        if out is None:
+            out = zeros((this.channels, this.block_size), dtype=float32)
+
+        # Time stamp the block from the reference channel's chunk it starts in,
+        # so gaps between chunks and a consumer running behind don't skew it
+        ring = this.rings[0]
+        mark = ring.mark(ring.read_idx)
+        if mark is not None:
+            this.block_time = mark[1] + (ring.read_idx - mark[0]) / this.rate
+
+        for i in range(this.channels):
+            this.rings[i].read(out[i])
+        this.blocks_read += 1
+
+        # Wake up any source waiting for space
+        with this.ready:
+            this.ready.notify_all()
+
+        return out
+
+## adc_timestamp
+# PortAudio reports the ADC time of the first sample on the stream clock,
+# convert it to time.monotonic() through the stream time of the callback.
+# Some host APIs report 0, assume the block was just captured for those.
+#
+# @param  time_info  PortAudio callback time info
+# @param  frame_count samples in the block
+# @param  rate        sample rate
+# @return monotonic time of the first sample
+def adc_timestamp(time_info, frame_count, rate):
+    now = time.monotonic()
+    adc_time = time_info.get("input_buffer_adc_time", 0) if time_info else 0
+    current_time = time_info.get("current_time", 0) if time_info else 0
+    if adc_time <= 0 or current_time <= 0 or adc_time > current_time:
+        return now - frame_count / rate
+    return now - (current_time - adc_time)
+
+class PyAudioSource:
+    """ USB microphones found by device name"""
+
+    def __init__(this, mic_dict, rate, block_size):
+        this.mic_dict = mic_dict
+        this.rate = rate
+        this.block_size = block_size
+        this.streams = []
+        this.pa = None
+
+    # Custom callback which inserts the index of the microphone into the local scope
+    def portaudio_callback(this, engine, idx):
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            engine.write(idx, frombuffer(in_data, dtype=float32), adc_timestamp(time_info, frame_count, this.rate))
+            return (None, pyaudio.paContinue)
+        return callback
+
+    def start(this, engine):
+        import pyaudio
+
+        p = pyaudio.PyAudio()
+        this.pa = p
+
+        # Search for our microphones
+        print("Searching for microphones by name")
+        info = p.get_host_api_info_by_index(0)
+        numdevices = info.get('deviceCount')
+        for i in range(numdevices):
+                if (p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
+                    dev_name = p.get_device_info_by_host_api_device_index(0, i).get('name')
+                    #print("Input Device id %d - %s" % (i, dev_name))
+
+                    # Check if this is the correct microphone and set the index
+                    for key in this.mic_dict:
+                        if key in dev_name:
+                            this.mic_dict[key][0] = i
+                            this.mic_dict[key][1] = dev_name
+
+        # Verify that all microphones are attached
+        for key in this.mic_dict:
+            if this.mic_dict[key][0] == -1:
+                print("%s not found. Please make sure the device is plugged in." % (key))
+                exit()
+
+        # Print all microphone id
+        for key in this.mic_dict:
+            print("Input Device id %d - %s" % (this.mic_dict[key][0], this.mic_dict[key][1]))
+
+        # Open microphone streams, they keep running until stop() is called
+        for idx, key in enumerate(this.mic_dict):
+            this.streams.append(p.open(
+                format = pyaudio.paFloat32,
+                channels = 1,
+                rate = this.rate,
+                input = True,
+                output = False,
+                frames_per_buffer = this.block_size,
+                input_device_index = this.mic_dict[key][0],
+                stream_callback = this.portaudio_callback(engine, idx)
+            ))
+
+        for s in this.streams:
+            s.start_stream()
+
+    def stop(this):
+        for s in this.streams:
+            s.stop_stream()
+            s.close()
+        this.streams = []
+
+        if this.pa is not None:
+            this.pa.terminate()
+            this.pa = None
+
+class ThreadedSource:
+    """ Base class for sources that generate blocks on a worker thread
+        Subclasses implement generate(n) which returns a (channels x n) array,
+        or None when there is no more data.
+    """
+
+    def __init__(this, block_size, rate, realtime=True):
+        this.block_size = block_size
+        this.rate = rate
+        this.realtime = realtime
+        this.running = False
+        this.thread = None
+
+    def start(this, engine):
+        this.running = True
+        this.thread = threading.Thread(target=this.run, args=(engine,), daemon=True)
+        this.thread.start()
+
+    def stop(this):
+        this.running = False
+        if this.thread is not None and this.thread is not threading.current_thread():
+            this.thread.join()
+        this.thread = None
+
+    def run(this, engine):
+        period = this.block_size / this.rate
+        deadline = time.monotonic()
+
+        while this.running:
+            block = this.generate(this.block_size)
+            if block is None:
+                break
+
+            # Pace the output like a real sound card, otherwise let the engine throttle us
+            if this.realtime:
+                deadline += period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            timestamp = time.monotonic() - block.shape[1] / this.rate
+            for i in range(len(block)):
+                engine.write(i, block[i], timestamp, block=not this.realtime)
+
+        engine.finish()
+
+    def generate(this, n):
+        raise NotImplementedError
+
+class FileSource(ThreadedSource):
+    """ Replays a WAV file or a (channels x samples) .npy array"""
+
+    def __init__(this, path, block_size, rate, realtime=True, loop=False):
+        ThreadedSource.__init__(this, block_size, rate, realtime)
+        this.samples = load_samples(path)
+        this.loop = loop
+        this.position = 0
+
+    def generate(this, n):
+        if this.position + n > this.samples.shape[1]:
+            if not this.loop:
+                return None
+            this.position = 0
+
+        block = this.samples[:, this.position:this.position + n]
+        this.position += n
+        return block
+
+class SyntheticSource(ThreadedSource):
+    """ Generates a sine tone as heard by each microphone
+        delays are in seconds relative to the first sample clock and gains are
+        linear amplitudes, one entry per channel.
+    """
+
+    def __init__(this, block_size, rate, channels=3, frequency=440, delays=None, gains=None, noise=0.0, realtime=True, seed=None):
+        ThreadedSource.__init__(this, block_size, rate, realtime)
+        this.frequency = frequency
+        this.delays = asarray(delays if delays is not None else [0.0] * channels, dtype=float).reshape(-1, 1)
+        this.gains = asarray(gains if gains is not None else [0.1] * channels, dtype=float).reshape(-1, 1)
+        this.noise = noise
+        this.rng = default_rng(seed)
+        this.position = 0
+
+    def generate(this, n):
+        t = (arange(this.position, this.position + n) / this.rate) - this.delays
+        this.position += n
+
+        block = this.gains * sin(2 * pi * this.frequency * t)
+        if this.noise:
+            block = block + this.rng.normal(0, this.noise, block.shape)
+        return block.astype(float32)
+
+## load_samples
+# Load a recording as a float32 (channels x samples) array. WAV files are
+# scaled to +/- 1.0 like the PyAudio float stream.
+#
+# @param  path .wav or .npy file
+# @return sample array
+def load_samples(path):
+    if path.endswith(".npy"):
+        samples = load(path).astype(float32)
+        return samples.reshape(1, -1) if samples.ndim == 1 else samples
+
+    with wave.open(path, "rb") as f:
+        width = f.getsampwidth()
+        channels = f.getnchannels()
+        raw = f.readframes(f.getnframes())
+
+    if width == 1:
+        samples = (frombuffer(raw, dtype=uint8).astype(float32) - 128) / 128
+    elif width == 2:
+        samples = frombuffer(raw, dtype=int16).astype(float32) / 32768
+    elif width == 4:
+        samples = frombuffer(raw, dtype=int32).astype(float32) / 2147483648
+    else:
+        raise ValueError("Unsupported WAV sample width: %d bytes" % (width))
+
+    # WAV frames are interleaved
+    return samples.reshape(-1, channels).T.copy()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" calibration_store.py: columnar calibration dataset
+    Each calibration point is one row of raw audio plus its rig position, so
+    the calibration run can append as it goes instead of keeping every buffer
+    in memory and pickling it at the end.
+
+    <path>/samples    (points x repeats x mics x BUFFER) float32
+    <path>/positions  (points x 3) float32, (x, y, z) in mm
+
+    A position that is visited more than once, for example on each pass of
+    the calibration run, has one row per visit.
+
+    <path>/manifest.json  checkpoint of the run writing the dataset, the rows
+                          it has flushed and how far through its plan it got
+
+    BackgroundWriter appends and flushes on its own thread in batches, and
+    only moves the checkpoint forward once the rows behind it are on disk.
+    A restarted run truncates the dataset to the checkpoint and skips the
+    part of the plan that is done.
+
+    Run it directly to convert a training_data.db pickle:
+    python calibration_store.py training_data.db training_data
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import hashlib, json, os, pickle, queue, sys, threading, time
+import numpy as np
+from array_store import AppendableArray, open_array
+
+class CalibrationWriter:
+    ## __init__
+    # Creates the dataset, or reopens it to append more points
+    #
+    # @param path    dataset directory
+    # @param repeats buffers captured at each point
+    # @param mics    number of microphones
+    # @param buffer  samples per buffer
+    # @param rate    sample rate, kept in the header
+    def __init__(this, path, repeats, mics, buffer, rate=None):
+        os.makedirs(path, exist_ok=True)
+        this.path = path
+        this.samples = AppendableArray(os.path.join(path, "samples"), (repeats, mics, buffer), "float32", {"rate": rate})
+        this.positions = AppendableArray(os.path.join(path, "positions"), (3,), "float32")
+
+        # A crash between the two appends leaves a sample row without a position
+        this.samples.truncate(min(len(this.samples), len(this.positions)))
+        this.positions.truncate(len(this.samples))
+
+    ## truncate
+    # Drop the rows past a checkpoint
+    #
+    # @param  rows number of rows to keep
+    # @return number of rows
+    def truncate(this, rows):
+        rows = min(rows, len(this))
+        this.samples.truncate(rows)
+        return this.positions.truncate(rows)
+
+    ## append
+    # @param position (x, y, z) of the sound source
+    # @param blocks   (repeats x mics x buffer) raw audio
+    def append(this, position, blocks):
+        this.samples.append(blocks)
+        this.positions.append(position)
+
+    def flush(this):
+        this.samples.flush()
+        this.positions.flush()
+
+    def close(this):
+        this.samples.close()
+        this.positions.close()
+
+    def __len__(this):
+        return len(this.positions)
+
+    def __enter__(this):
+        return this
+
+    def __exit__(this, *args):
+        this.close()
+
+## plan_key
+# @param  arrays values that define a run, e.g. the route and the mode
+# @return hash a checkpoint is only resumed with
+def plan_key(*arrays):
+    key = hashlib.sha1()
+    for a in arrays:
+        key.update(np.ascontiguousarray(a).tobytes() if isinstance(a, np.ndarray) else repr(a).encode("utf-8"))
+    return key.hexdigest()
+
+class CaptureManifest:
+    """ Checkpoint of the run writing a dataset, <path>/manifest.json"""
+
+    ## __init__
+    # Resumes the checkpoint if it belongs to the same plan, otherwise a new
+    # run starts after the rows already in the dataset
+    #
+    # @param path  dataset directory
+    # @param plan  plan_key() of the run
+    # @param total steps in the plan
+    # @param rows  rows in the dataset
+    def __init__(this, path, plan, total, rows):
+        this.path = os.path.join(path, "manifest.json")
+        this.plan = plan
+        this.total = total
+        this.done = 0
+        this.rows = rows
+        this.resumed = False
+
+        if os.path.exists(this.path):
+            with open(this.path, "r") as f:
+                data = json.load(f)
+
+            if data["plan"] == plan:
+                this.done = data["done"]
+                this.rows = min(data["rows"], rows)
+                this.resumed = True
+
+        # Rows a new run writes before its first checkpoint are dropped on a restart
+        if not this.resumed:
+            this.save(0, rows)
+
+    def complete(this):
+        return this.done >= this.total
+
+    ## save
+    # @param done steps of the plan finished
+    # @param rows dataset rows on disk behind those steps
+    def save(this, done, rows):
+        this.done = done
+        this.rows = rows
+        data = {"plan": this.plan, "done": done, "total": this.total, "rows": rows, "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+        # A crash leaves either the old or the new checkpoint, never half of one
+        temp = this.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, this.path)
+
+class BackgroundWriter:
+    """ Appends to a CalibrationWriter from its own thread so a slow disk never
+        holds up the capture. The checkpoint is saved every batch steps, after
+        the rows are flushed.
+    """
+
+    ## __init__
+    # @param writer   CalibrationWriter, truncated to the manifest
+    # @param manifest CaptureManifest
+    # @param batch    steps between flushes
+    # @param pending  rows queued before append() waits for the disk
+    def __init__(this, writer, manifest, batch=8, pending=256):
+        this.writer = writer
+        this.manifest = manifest
+        this.batch = batch
+        this.queue = queue.Queue(pending)
+        this.error = None
+        this.thread = threading.Thread(target=this.run, daemon=True)
+        this.thread.start()
+
+    def check(this):
+        if this.error is not None:
+            raise this.error
+
+    # Wait for room in the queue, unless the writer thread has died
+    def put(this, item):
+        while True:
+            try:
+                return this.queue.put(item, timeout=0.5)
+            except queue.Full:
+                this.check()
+
+    ## append
+    # @param position (x, y, z) of the sound source
+    # @param blocks   (repeats x mics x buffer) raw audio, copied
+    def append(this, position, blocks):
+        this.check()
+        this.put((np.array(position, np.float32), np.array(blocks, np.float32)))
+
+    ## commit
+    # Everything appended so far finishes step done of the plan
+    def commit(this, done):
+        this.check()
+        this.put(done)
+
+    def run(this):
+        committed = None
+        steps = 0
+        try:
+            while True:
+                item = this.queue.get()
+                if item is None:
+                    break
+
+                if isinstance(item, int):
+                    committed = (item, len(this.writer))
+                    steps += 1
+                    if steps >= this.batch:
+                        this.checkpoint(committed)
+                        steps = 0
+                else:
+                    this.writer.append(*item)
+        except Exception as e:
+            this.error = e
+            return
+
+        if committed is not None:
+            this.checkpoint(committed)
+
+    def checkpoint(this, committed):
+        this.writer.flush()
+        this.manifest.save(*committed)
+
+    ## close
+    # Write out everything queued, save the last checkpoint and close the writer
+    def close(this):
+        if this.thread.is_alive():
+            this.put(None)
+        this.thread.join()
+        this.writer.close()
+        this.check()
+
+    def __enter__(this):
+        return this
+
+    def __exit__(this, *args):
+        this.close()
+
+class CalibrationDataset:
+    """ Read only view of a dataset, samples are memory mapped"""
+
+    def __init__(this, path):
+        this.path = path
+        this.samples = open_array(os.path.join(path, "samples"))
+        this.positions = np.array(open_array(os.path.join(path, "positions")))
+
+        # Ignore a sample row without a position
+        this.samples = this.samples[:len(this.positions)]
+        this.repeats, this.mics, this.buffer = this.samples.shape[1:]
+
+    def __len__(this):
+        return len(this.positions)
+
+    ## grid
+    # @return (N x 3) unique calibration positions
+    def grid(this):
+        return np.unique(this.positions, axis=0)
+
+    ## index
+    # @param  position (x, y, z), any of them can be None to match everything
+    # @return row indices of the matching points
+    def index(this, position):
+        match = np.ones(len(this.positions), bool)
+        for axis, value in enumerate(position):
+            if value is not None:
+                match &= this.positions[:, axis] == value
+        return np.flatnonzero(match)
+
+    ## select
+    # Only the selected rows are read from disk
+    #
+    # @param  position (x, y, z), see index()
+    # @return ((N x repeats x mics x buffer) samples, (N x 3) positions)
+    def select(this, position):
+        rows = this.index(position)
+        return this.samples[rows], this.positions[rows]
+
+    ## chunks
+    # Iterate over the whole dataset a few points at a time
+    #
+    # @param size points per chunk
+    def chunks(this, size=64):
+        for start in range(0, len(this), size):
+            yield this.samples[start:start + size], this.positions[start:start + size]
+
+## convert_pickle
+# Convert a training_data.db pickle into a dataset. Both the layout written
+# by acoustic_fixture_calibration.py, {position: [[mic1, mic2, mic3], ...]}
+# and the one written by trim_training_data.py,
+# {position: [[[mic1 buffers], [mic2 buffers], [mic3 buffers]]]} are read.
+#
+# @param  db_path  pickle to convert
+# @param  path     dataset directory to write
+# @param  repeats  buffers per row, defaults to the fewest buffers of any point
+# @param  rate     sample rate to record in the header
+# @return number of rows written
+def convert_pickle(db_path, path, repeats=None, rate=None):
+    with open(db_path, "rb") as f:
+        data = pickle.load(f)
+
+    points = {}
+    for key, value in data.items():
+        buffers = np.asarray(value, np.float32)
+        if buffers.ndim == 4:
+            # trimmed: 1 x mics x repeats x buffer
+            mics, buffer = buffers.shape[1], buffers.shape[3]
+            buffers = buffers.transpose(0, 2, 1, 3).reshape(-1, mics, buffer)
+        points[key] = buffers
+
+    if repeats is None:
+        repeats = min(len(buffers) for buffers in points.values())
+    mics, buffer = next(iter(points.values())).shape[1:]
+
+    with CalibrationWriter(path, repeats, mics, buffer, rate) as writer:
+        for key, buffers in points.items():
+            rows = len(buffers) // repeats
+            if len(buffers) % repeats:
+                print("Dropping %d buffers from (%d, %d, %d)" % ((len(buffers) % repeats,) + tuple(key)))
+            for i in range(rows):
+                writer.append(key, buffers[i * repeats:(i + 1) * repeats])
+        count = len(writer)
+
+    return count
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: %s training_data.db output_directory [repeats]" % (sys.argv[0]))
+        sys.exit(1)
+
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    count = convert_pickle(sys.argv[1], sys.argv[2], repeats)
+    print("Wrote %d points to %s" % (count, sys.argv[2]))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" fixture_geometry.py: microphone array description
+    Names the USB microphones of one array, where they are relative to the
+    array's center and where the array is in laser coordinates, so arrays of
+    any shape and number of mics can be run and their estimates combined.
+
+    {
+        "name": "bench",
+        "mics": [
+            {"name": "Mosquito 1", "position": [-69.3, -40, 0]},
+            {"name": "Mosquito 2", "position": [0, 80, 0]},
+            {"name": "Mosquito 3", "position": [69.3, -40, 0]}
+        ],
+        "origin": [0, 447.6, 56],
+        "rotation": [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+        "mic_calibration": "bench_calibration.json"
+    }
+
+    origin and rotation place the array in laser coordinates, a position p
+    the array localizes is rotation . p + origin for the laser. Each mic may
+    also list "cal_amplitudes" at the fixture's CAL_DISTANCE.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import json
+import numpy as np
+
+class FixtureGeometry:
+    ## __init__
+    # @param names           USB device name of each mic
+    # @param positions       (mics x 3) positions in mm from the array center
+    # @param origin          array center in laser coordinates
+    # @param rotation        3 x 3 array to laser rotation, identity if None
+    # @param name            array name for logs
+    # @param cal_amplitudes  per mic calibration tables, or None
+    # @param mic_calibration mic_calibration.py parameter file, or None
+    def __init__(this, names, positions, origin=(0, 0, 0), rotation=None, name="fixture", cal_amplitudes=None, mic_calibration=None):
+        this.names = list(names)
+        this.positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        this.origin = np.asarray(origin, dtype=float)
+        this.rotation = np.eye(3) if rotation is None else np.asarray(rotation, dtype=float)
+        this.name = name
+        this.cal_amplitudes = cal_amplitudes
+        this.mic_calibration = mic_calibration
+
+        if len(this.names) != len(this.positions):
+            raise ValueError("%s has %d mic names but %d positions" % (name, len(this.names), len(this.positions)))
+
+    def __len__(this):
+        return len(this.names)
+
+    ## max_spacing
+    # @return largest distance between two mics in mm
+    def max_spacing(this):
+        return np.linalg.norm(this.positions[:, None, :] - this.positions[None, :, :], axis=2).max()
+
+    ## to_laser
+    # @param  positions (3) or (N x 3) positions relative to the array
+    # @return the positions in laser coordinates
+    def to_laser(this, positions):
+        return np.asarray(positions, dtype=float) @ this.rotation.T + this.origin
+
+    ## backend_config
+    # @param  base fixture BACKEND_CONFIG
+    # @return the config with this array's mics and calibration
+    def backend_config(this, base):
+        config = dict(base, mic_positions=this.positions)
+
+        if this.mic_calibration is not None:
+            config["mic_calibration"] = this.mic_calibration
+        if this.cal_amplitudes is not None:
+            config["cal_amplitudes"] = this.cal_amplitudes
+
+        if this.mic_calibration is None and len(config["cal_amplitudes"]) != len(this):
+            raise ValueError("%s has %d mics but %d calibration tables, give each mic cal_amplitudes or set mic_calibration" % (this.name, len(this), len(config["cal_amplitudes"])))
+        return config
+
+    @staticmethod
+    def load(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        mics = data["mics"]
+        tables = [mic["cal_amplitudes"] for mic in mics if "cal_amplitudes" in mic]
+        return FixtureGeometry(
+            [mic["name"] for mic in mics],
+            [mic["position"] for mic in mics],
+            data.get("origin", (0, 0, 0)),
+            data.get("rotation"),
+            data.get("name", path),
+            tables if len(tables) == len(mics) else None,
+            data.get("mic_calibration"))
+
+    def save(this, path):
+        mics = [{"name": name, "position": position.tolist()} for name, position in zip(this.names, this.positions)]
+        if this.cal_amplitudes is not None:
+            for mic, table in zip(mics, this.cal_amplitudes):
+                mic["cal_amplitudes"] = list(table)
+
+        data = {"name": this.name, "mics": mics, "origin": this.origin.tolist(), "rotation": this.rotation.tolist()}
+        if this.mic_calibration is not None:
+            data["mic_calibration"] = this.mic_calibration
+
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" fixture_supervisor.py: several mic arrays, one laser
+    Each array runs as an AcousticFixture in its own process, so a larger
+    room is covered by adding arrays instead of a faster CPU. The workers
+    send their position estimates in laser coordinates back over a queue,
+    the supervisor keeps the newest estimate of each array and fuses the
+    recent ones with a weighted mean. Arrays are trusted less the further
+    the target is from them, the amplitude curves flatten out with distance.
+    Like a single fixture, the fused positions are tracked and the laser is
+    aimed where the target will be once the command lands.
+
+    python fixture_supervisor.py left.json right.json ...
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import multiprocessing, queue, sys, time
+import numpy as np
+
+# Estimates closer than this are weighted the same, mm
+MIN_WEIGHT_DISTANCE = 25
+
+## run_fixture
+# Worker process body
+#
+# @param index          array number reported with each estimate
+# @param geometry       FixtureGeometry or JSON file
+# @param backend        localization backend name
+# @param source_factory callable returning a capture source for the geometry, the USB mics if None
+# @param results        queue of (index, capture time, laser position, distance) estimates
+# @param stop           event that ends the worker
+def run_fixture(index, geometry, backend, source_factory, results, stop):
+    from acoustic_fixture import create_fixture
+    from fixture_geometry import FixtureGeometry
+
+    if isinstance(geometry, str):
+        geometry = FixtureGeometry.load(geometry)
+
+    af = create_fixture(backend=backend, geometry=geometry, offline=True, verbose=False,
+                        source=source_factory(geometry) if source_factory is not None else None)
+    try:
+        while not stop.is_set() and af.update():
+            position = np.array((af.x, af.y, af.z), dtype=float)
+            if np.isfinite(position).all():
+                results.put((index, af.block_time, tuple(af.geometry.to_laser(position)), float(np.linalg.norm(position))))
+    finally:
+        af.close()
+
+        # Tell the supervisor this array is done
+        results.put((index, None, None, None))
+
+class FixtureSupervisor:
+    ## __init__
+    # @param geometries     FixtureGeometry objects or JSON files, one per array
+    # @param backend        localization backend name, the fixture default if None
+    # @param source_factory see run_fixture, must be picklable
+    # @param max_age        seconds an estimate takes part in the fusion
+    # @param offline        don't connect to the laser, the fixture OFFLINE_MODE if None
+    # @param tracking       aim ahead of the fused position, the fixture TRACKING if None
+    def __init__(this, geometries, backend=None, source_factory=None, max_age=0.1, offline=None, tracking=None):
+        this.geometries = list(geometries)
+        this.backend = backend
+        this.source_factory = source_factory
+        this.max_age = max_age
+        this.offline = offline
+        this.tracking = tracking
+
+        # Newest (capture time, laser position, weight) of each array
+        this.latest = {}
+        this.running = set()
+        this.processes = []
+        this.results = None
+        this.stop_event = None
+        this.ser = None
+        this.laser = None
+        this.position = None    # Fused position in laser coordinates
+        this.target = None      # Where the laser was last aimed
+        this.tracker = None     # target_tracker.TargetTracker, made by start()
+        this.window = 0         # Seconds the averaged audio lags its capture time
+
+    def start(this):
+        import acoustic_fixture
+
+        # Spawned workers behave the same on Windows and Linux
+        context = multiprocessing.get_context("spawn")
+        this.results = context.Queue()
+        this.stop_event = context.Event()
+
+        for index, geometry in enumerate(this.geometries):
+            process = context.Process(target=run_fixture, args=(index, geometry, this.backend, this.source_factory, this.results, this.stop_event), daemon=True)
+            process.start()
+            this.processes.append(process)
+            this.running.add(index)
+
+        offline = acoustic_fixture.OFFLINE_MODE if this.offline is None else this.offline
+        if not offline:
+            this.ser, this.laser = acoustic_fixture.connect_laser()
+
+        # The same tracking and lead as a single fixture, see AcousticFixture.lead_time
+        tracking = acoustic_fixture.TRACKING if this.tracking is None else this.tracking
+        if tracking and this.tracker is None:
+            from target_tracker import TargetTracker
+            this.tracker = TargetTracker(acoustic_fixture.TRACK_PROCESS_NOISE, acoustic_fixture.TRACK_MEASUREMENT_NOISE)
+        this.window = (acoustic_fixture.AMPLITUDE_SIZE - 1) / 2 * acoustic_fixture.BUFFER / acoustic_fixture.RATE
+
+    def stop(this):
+        if this.stop_event is not None:
+            this.stop_event.set()
+
+        # Drain the queue so the workers can flush it and exit
+        deadline = time.monotonic() + 5
+        while this.running and time.monotonic() < deadline:
+            this.update(0.1)
+
+        for process in this.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        this.processes = []
+
+        if this.laser is not None:
+            this.laser.stop()
+            this.laser = None
+
+    ## fuse
+    # @param  now monotonic time
+    # @return weighted mean laser position of the recent estimates, or None
+    def fuse(this, now):
+        recent = [(position, weight) for timestamp, position, weight in this.latest.values() if now - timestamp <= this.max_age]
+        if not recent:
+            return None
+
+        positions = np.array([position for position, weight in recent])
+        weights = np.array([weight for position, weight in recent])
+        return (weights[:, None] * positions).sum(axis=0) / weights.sum()
+
+    ## lead_time
+    # Seconds between the middle of the averaged audio and the laser moving
+    #
+    # @param  origin capture time of the estimate
+    # @return lead time in seconds
+    def lead_time(this, origin):
+        lead = this.window + time.monotonic() - origin
+        if this.laser is not None:
+            lead += this.laser.last_latency
+        return lead
+
+    ## update
+    # Wait for the next estimate from any array, fuse and aim ahead of it
+    #
+    # @param  timeout seconds to wait for an estimate
+    # @return False when every array has finished
+    def update(this, timeout=1.0):
+        try:
+            index, timestamp, position, distance = this.results.get(timeout=timeout)
+        except queue.Empty:
+            return bool(this.running)
+
+        if timestamp is None:
+            this.running.discard(index)
+            this.latest.pop(index, None)
+            return bool(this.running)
+
+        this.latest[index] = (timestamp, position, 1 / max(distance, MIN_WEIGHT_DISTANCE) ** 2)
+
+        fused = this.fuse(timestamp)
+        if fused is not None:
+            this.position = fused
+            this.target = fused
+            if this.tracker is not None:
+                this.tracker.update(fused, timestamp)
+                predicted = this.tracker.target(this.lead_time(timestamp))
+                if predicted is not None:
+                    this.target = predicted
+            if this.laser is not None:
+                this.laser.submit(tuple(this.target), timestamp)
+        return True
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: %s geometry.json [geometry.json ...]" % (sys.argv[0]))
+        sys.exit(1)
+
+    supervisor = FixtureSupervisor(sys.argv[1:])
+    supervisor.start()
+    try:
+        while supervisor.update():
+            if supervisor.position is not None:
+                print("x: %4.0f, y: %4.0f, z: %4.0f, arrays: %d" % (tuple(supervisor.position) + (len(supervisor.latest),)))
+    except KeyboardInterrupt:
+        pass
+    supervisor.stop()
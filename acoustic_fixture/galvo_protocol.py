@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" galvo_protocol.py: binary framing between the host and the laser galvo
+    A text aim update costs a formatted G1 line, the firmware's debug echo and
+    a prompt round-trip. A binary frame carries one or more float targets in
+    a fixed layout, is answered with a 6 byte ACK or NAK frame and can be
+    resent by sequence number.
+
+    Frame layout, little endian:
+    SYNC  uint8    0xA5, never appears in the text shell output
+    LEN   uint8    payload length
+    SEQ   uint8    sequence number, echoed back in the ACK
+    TYPE  uint8    FRAME_* type
+    DATA  LEN bytes
+    SUM   uint16   Fletcher-16 of LEN, SEQ, TYPE and DATA
+
+    MOVE payloads are a uint8 count followed by count x (x, y, z) float32
+    targets. SETPOINT payloads are a uint8 count followed by count x (x, z)
+    uint16 DAC codes mapped on the host, see trajectory.py. The firmware decoder lives in laser_galvo_firmware/include/protocol.h
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import struct
+from collections import namedtuple
+
+FRAME_SYNC = 0xA5
+
+FRAME_MOVE = 0x01
+FRAME_SETPOINT = 0x02
+FRAME_LASER_ON = 0x03
+FRAME_LASER_OFF = 0x05
+FRAME_ACK = 0x06
+FRAME_NAK = 0x15
+
+# The firmware receive buffer is 64 bytes
+MAX_PAYLOAD = 61
+MAX_TARGETS = (MAX_PAYLOAD - 1) // 12
+MAX_SETPOINTS = (MAX_PAYLOAD - 1) // 4
+
+CHECKSUM = struct.Struct("<H")
+TARGET = struct.Struct("<fff")
+SETPOINT = struct.Struct("<HH")
+
+Frame = namedtuple("Frame", ["type", "seq", "payload"])
+
+## fletcher16
+# Cheap enough to run on the microcontroller for every byte
+def fletcher16(data):
+    sum1 = 0
+    sum2 = 0
+    for b in data:
+        sum1 = (sum1 + b) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+## encode
+# @param  type    FRAME_* type
+# @param  payload frame data
+# @param  seq     sequence number, wraps at 256
+# @return frame bytes
+def encode(type, payload=b"", seq=0):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError("Payload of %d bytes is larger than %d" % (len(payload), MAX_PAYLOAD))
+
+    body = struct.pack("<BBB", len(payload), seq & 0xFF, type) + payload
+    return bytes((FRAME_SYNC,)) + body + CHECKSUM.pack(fletcher16(body))
+
+## encode_move
+# @param  targets list of up to MAX_TARGETS (x, y, z) targets
+# @param  seq     sequence number
+# @return frame bytes
+def encode_move(targets, seq=0):
+    payload = bytearray((len(targets),))
+    for target in targets:
+        payload += TARGET.pack(*target)
+    return encode(FRAME_MOVE, bytes(payload), seq)
+
+## decode_move
+# @param  payload MOVE frame data
+# @return list of (x, y, z) targets
+def decode_move(payload):
+    count = payload[0]
+    return [TARGET.unpack_from(payload, 1 + i * TARGET.size) for i in range(count)]
+
+## encode_setpoints
+# @param  setpoints list of up to MAX_SETPOINTS (x, z) DAC codes
+# @param  seq       sequence number
+# @return frame bytes
+def encode_setpoints(setpoints, seq=0):
+    payload = bytearray((len(setpoints),))
+    for setpoint in setpoints:
+        payload += SETPOINT.pack(*setpoint)
+    return encode(FRAME_SETPOINT, bytes(payload), seq)
+
+## decode_setpoints
+# @param  payload SETPOINT frame data
+# @return list of (x, z) DAC codes
+def decode_setpoints(payload):
+    count = payload[0]
+    return [SETPOINT.unpack_from(payload, 1 + i * SETPOINT.size) for i in range(count)]
+
+class FrameEncoder:
+    """ Numbers frames so acknowledgements can be matched to them"""
+
+    def __init__(this):
+        this.seq = 0
+
+    def next_seq(this):
+        seq = this.seq
+        this.seq = (this.seq + 1) & 0xFF
+        return seq
+
+    def move(this, targets):
+        return encode_move(targets, this.next_seq())
+
+    # Split any number of targets into as few MOVE frames as possible
+    def moves(this, targets):
+        return [this.move(targets[i:i + MAX_TARGETS]) for i in range(0, len(targets), MAX_TARGETS)]
+
+    def setpoint(this, setpoints):
+        return encode_setpoints(setpoints, this.next_seq())
+
+    # Split any number of DAC codes into as few SETPOINT frames as possible
+    def setpoints(this, setpoints):
+        return [this.setpoint(setpoints[i:i + MAX_SETPOINTS]) for i in range(0, len(setpoints), MAX_SETPOINTS)]
+
+    def laser(this, on):
+        return encode(FRAME_LASER_ON if on else FRAME_LASER_OFF, b"", this.next_seq())
+
+class FrameDecoder:
+    """ Incremental frame parser
+        Bytes outside of a frame, like the shell's text output, are skipped.
+        A frame with a bad checksum is dropped and the search for the next
+        sync byte starts right after its sync byte.
+    """
+
+    def __init__(this):
+        this.buf = bytearray()
+        this.errors = 0
+        this.skipped = 0
+
+    ## feed
+    # @param  data received bytes
+    # @return list of complete frames
+    def feed(this, data):
+        this.buf += data
+        frames = []
+
+        while True:
+            start = this.buf.find(FRAME_SYNC)
+            if start < 0:
+                this.skipped += len(this.buf)
+                this.buf.clear()
+                break
+
+            if start:
+                this.skipped += start
+                del this.buf[:start]
+
+            # Wait for SYNC, LEN, SEQ and TYPE
+            if len(this.buf) < 4:
+                break
+
+            length, seq, type = this.buf[1], this.buf[2], this.buf[3]
+            end = 4 + length + CHECKSUM.size
+            if length > MAX_PAYLOAD:
+                this.errors += 1
+                del this.buf[:1]
+                continue
+
+            if len(this.buf) < end:
+                break
+
+            body = bytes(this.buf[1:4 + length])
+            if CHECKSUM.unpack_from(this.buf, 4 + length)[0] != fletcher16(body):
+                this.errors += 1
+                del this.buf[:1]
+                continue
+
+            frames.append(Frame(type, seq, body[3:]))
+            del this.buf[:end]
+
+        return frames
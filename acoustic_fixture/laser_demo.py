@@ -3,7 +3,8 @@
 
 """ laser_demo.py: Scan the laser module across a grid
 	The grid should be in 1 cm increments. The program scans
-	in 20 cm increments
+	in 20 cm increments. The grid is mapped to DAC codes once up front and
+	sent as SETPOINT frames, see trajectory.py
 """
 
 __version__ = "1.0"
@@ -13,11 +14,14 @@ __copyright__ = "Copyright 2021, Andrew Miyaguchi"
 __license__ = "Apache 2.0"
 
 import serial, time
-from serial_comms import waitFor, sendCommand
+from serial_comms import transport
+from galvo_protocol import FrameEncoder, FrameDecoder
+from trajectory import galvo_setpoints
 
 # Configuration
 COM_PORT = "COM3"   # Laser com port
 OFFLINE_MODE = False
+BINARY_PROTOCOL = True  # Send host mapped SETPOINT frames instead of G1 text commands
 
 STEP = 20
 X_MAX = 60
@@ -40,32 +44,41 @@ start_time = time.time()
 
 print("Connecting to Laser...")
 if not OFFLINE_MODE:
-    ser = serial.Serial(COM_PORT, 115200)
-    waitFor(ser, "\rsh$ ")    # Wait for the system to initialize
-    sendCommand(ser, "M3", "\rsh$ ")
+    port = transport(serial.Serial(COM_PORT, 115200))
+    port.wait_for("\rsh$ ")    # Wait for the system to initialize
+    port.send("M3", "\rsh$ ")
     print("Connected to laser")
 else:
     print("Offline mode enabled. Simulating outputs")
 
+# Build the serpentine scan once
+targets = []
+z_range = range(-Z_MAX, Z_MAX + STEP, STEP) if z_dir == FWD else range(Z_MAX, -(Z_MAX + STEP), -STEP)
+for z in z_range:
+    z += Z_OFFSET
+
+    x_range = range(-X_MAX, X_MAX + STEP, STEP) if x_dir == FWD else range(X_MAX, -(X_MAX + STEP), -STEP)
+    for x in x_range:
+        targets.append((x + X_OFFSET, y, z))
+
+    # Reverse the direction of x
+    x_dir = not x_dir
+
+setpoints = galvo_setpoints(targets).tolist()
+encoder = FrameEncoder()
+decoder = FrameDecoder()
+
 # Cycle through the training at least 3 times
 while(True):
-    z_range = range(-Z_MAX, Z_MAX + STEP, STEP) if z_dir == FWD else range(Z_MAX, -(Z_MAX + STEP), -STEP)
-    for z in z_range:
-        z += Z_OFFSET
-
-        x_range = range(-X_MAX, X_MAX + STEP, STEP) if x_dir == FWD else range(X_MAX, -(X_MAX + STEP), -STEP)
-        for x in x_range:
-            x += X_OFFSET
-            command = "G1 X%.2f Y%.2f Z%.2f" % (x, y, z)
-            if not OFFLINE_MODE:
-                sendCommand(ser, command, "\rsh$ ")
-            else:
-                print("[%12.6f] %s" % (time.time() - start_time, command))
-
-            time.sleep(0.5) # Wait 500ms for the fixture to stabalize before capturing data
-            
-        # Reverse the direction of x
-        x_dir = ~x_dir 
-    
-    # Reverse the direction of y
-    #z_dir = ~z_dir
+    for target, setpoint in zip(targets, setpoints):
+        command = "G1 X%.2f Y%.2f Z%.2f" % target
+        if OFFLINE_MODE:
+            print("[%12.6f] %s, DAC %d %d" % ((time.time() - start_time, command) + tuple(setpoint)))
+        elif BINARY_PROTOCOL:
+            seq = encoder.seq
+            port.write(encoder.setpoint([setpoint]))
+            port.wait_ack(decoder, seq, 0.5)
+        else:
+            port.send(command, "\rsh$ ")
+
+        time.sleep(0.5) # Wait 500ms for the fixture to stabalize before capturing data
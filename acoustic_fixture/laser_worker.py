@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" laser_worker.py: background laser command pipeline
+    The fixture hands off the latest target and returns immediately. A worker
+    thread sends it to the galvo and waits for the prompt. Targets that arrive
+    while a command is in flight replace each other, only the newest one is
+    sent, so the laser never falls behind the localization.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import threading, time
+from serial_comms import transport
+from galvo_protocol import FrameEncoder, FrameDecoder
+
+class LaserCommandWorker:
+    ## __init__
+    # @param ser     open serial port to the laser galvo
+    # @param prompt  response that acknowledges a command
+    # @param timeout seconds to wait for the acknowledgement
+    # @param command format string for a target
+    # @param binary  send galvo_protocol MOVE frames instead of text commands
+    # @param drain   seconds the late prompt of a timed out text command may
+    #                still take, it's dropped instead of acking the next one
+    def __init__(this, ser, prompt="\rsh$ ", timeout=0.5, command="G1 X%.2f Y%.2f Z%.2f", binary=False, drain=1.0):
+        this.ser = ser
+        this.port = transport(ser)
+        this.prompt = prompt
+        this.timeout = timeout
+        this.drain = drain
+        this.command = command
+        this.binary = binary
+        this.tracer = None  # latency_trace.LatencyTracer for the write and ack checkpoints
+        this.encoder = FrameEncoder()
+        this.decoder = FrameDecoder()
+
+        # Single slot queue, a new target replaces the one waiting to be sent
+        this.pending = None
+        this.ready = threading.Condition()
+        this.running = False
+        this.thread = None
+
+        # Statistics
+        this.submitted = 0
+        this.coalesced = 0
+        this.sent = 0
+        this.acked = 0
+        this.timeouts = 0
+        this.last_latency = 0
+
+    def start(this):
+        this.running = True
+        this.thread = threading.Thread(target=this.run, daemon=True)
+        this.thread.start()
+
+    def stop(this):
+        with this.ready:
+            this.running = False
+            this.ready.notify_all()
+
+        if this.thread is not None:
+            this.thread.join()
+            this.thread = None
+
+    ## submit
+    # Queue a target without blocking
+    #
+    # @param target (x, y, z) in laser coordinates
+    # @param origin monotonic capture time of the audio the target came from
+    def submit(this, target, origin=None):
+        with this.ready:
+            if this.pending is not None:
+                this.coalesced += 1
+            this.pending = (tuple(target), origin)
+            this.submitted += 1
+            this.ready.notify()
+
+    # Late prompts dropped
+    @property
+    def late(this):
+        return this.port.dropped
+
+    def stats(this):
+        return {
+            "submitted": this.submitted,
+            "coalesced": this.coalesced,
+            "sent": this.sent,
+            "acked": this.acked,
+            "timeouts": this.timeouts,
+            "late": this.late,
+            "latency_ms": this.last_latency * 1000,
+        }
+
+    def run(this):
+        while True:
+            with this.ready:
+                this.ready.wait_for(lambda: this.pending is not None or not this.running)
+                if not this.running:
+                    break
+                target, origin = this.pending
+                this.pending = None
+
+            sent_time = time.time()
+            if this.binary:
+                seq = this.encoder.seq
+                this.port.write(this.encoder.move([target]))
+            else:
+                this.port.flush()
+                this.port.write_line(this.command % target)
+
+            if this.tracer is not None:
+                this.tracer.mark("write", origin)
+
+            if this.binary:
+                acked = this.port.wait_ack(this.decoder, seq, this.timeout)
+            else:
+                acked = this.port.wait_for(this.prompt, this.timeout) is not None
+            this.sent += 1
+
+            if acked:
+                this.acked += 1
+                this.last_latency = time.time() - sent_time
+                if this.tracer is not None:
+                    this.tracer.mark("ack", origin)
+            else:
+                this.timeouts += 1
+
+                # Prompts carry no sequence number, the late one would be
+                # credited to the next command. Have the transport drop it
+                # instead of waiting for it here, the next target goes out
+                # right away. ACKs are matched by seq.
+                if not this.binary:
+                    this.port.skip(this.prompt, this.drain)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" latency_trace.py: end to end latency from the microphones to the laser
+    Every frame carries the monotonic capture time of its first sample. Each
+    stage marks a checkpoint when it is done with the frame and the time
+    since capture goes into that checkpoint's histogram:
+
+    capture   block read from the capture engine
+    filter    bandpass filtered
+    tdoa      time delays estimated
+    localize  position solved
+    enqueue   target handed to the laser worker
+    write     command written to the serial port
+    ack       command acknowledged by the galvo
+
+    The histograms use log spaced buckets like HdrHistogram, 2^(SUB_BITS-1)
+    buckets per power of two of microseconds, so recording is a few integer
+    operations and the error of a percentile is under 100 / 2^(SUB_BITS-1) %.
+    Snapshots can be dumped to a JSON file periodically or served as JSON
+    from a local http endpoint.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import json, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHECKPOINTS = ["capture", "filter", "tdoa", "localize", "enqueue", "write", "ack"]
+
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+
+class LatencyHistogram:
+    """ Counts of latencies in microseconds, log bucketed"""
+
+    def __init__(this):
+        this.counts = [0] * SUB_COUNT
+        this.total = 0
+        this.sum = 0
+        this.max = 0
+
+    ## bucket
+    # Values below SUB_COUNT get their own bucket, above that every power of
+    # two is split into HALF_COUNT buckets
+    @staticmethod
+    def bucket(value):
+        if value < SUB_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        return SUB_COUNT + (shift - 1) * HALF_COUNT + (value >> shift) - HALF_COUNT
+
+    # Lowest value that falls into a bucket
+    @staticmethod
+    def bucket_value(index):
+        if index < SUB_COUNT:
+            return index
+        shift = (index - SUB_COUNT) // HALF_COUNT + 1
+        return (HALF_COUNT + (index - SUB_COUNT) % HALF_COUNT) << shift
+
+    ## record
+    # @param us latency in microseconds
+    def record(this, us):
+        us = max(int(us), 0)
+        index = this.bucket(us)
+        if index >= len(this.counts):
+            this.counts.extend([0] * (index + 1 - len(this.counts)))
+        this.counts[index] += 1
+        this.total += 1
+        this.sum += us
+        if us > this.max:
+            this.max = us
+
+    ## percentile
+    # @param  p percentile, 0 to 100
+    # @return latency in microseconds, the middle of the bucket it falls in,
+    #         the largest latency recorded for the last rank
+    def percentile(this, p):
+        if not this.total:
+            return 0
+        rank = max(1, int(p / 100 * this.total + 0.5))
+        if rank >= this.total:
+            return this.max
+        seen = 0
+        for index, count in enumerate(this.counts):
+            seen += count
+            if seen >= rank:
+                return min((this.bucket_value(index) + this.bucket_value(index + 1)) / 2, this.max)
+        return this.max
+
+    def reset(this):
+        this.__init__()
+
+    def summary(this):
+        return {
+            "count": this.total,
+            "mean_ms": this.sum / this.total / 1000 if this.total else 0,
+            "p50_ms": this.percentile(50) / 1000,
+            "p90_ms": this.percentile(90) / 1000,
+            "p99_ms": this.percentile(99) / 1000,
+            "max_ms": this.max / 1000,
+        }
+
+class LatencyTracer:
+    def __init__(this, checkpoints=CHECKPOINTS):
+        this.histograms = {name: LatencyHistogram() for name in checkpoints}
+        this.started = time.time()
+        this.dumper = None
+        this.server = None
+
+    ## mark
+    # @param checkpoint name from CHECKPOINTS
+    # @param origin     monotonic capture time of the frame
+    # @param now        monotonic time the checkpoint was reached, defaults to now
+    def mark(this, checkpoint, origin, now=None):
+        if origin is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        this.histograms[checkpoint].record((now - origin) * 1e6)
+
+    ## latency
+    # @param  checkpoint name from CHECKPOINTS
+    # @param  p          percentile
+    # @return seconds from capture to the checkpoint, None before any frame reached it
+    def latency(this, checkpoint, p=50):
+        histogram = this.histograms[checkpoint]
+        return histogram.percentile(p) / 1e6 if histogram.total else None
+
+    def snapshot(this):
+        return {
+            "uptime_s": time.time() - this.started,
+            "checkpoints": {name: histogram.summary() for name, histogram in this.histograms.items()},
+        }
+
+    def reset(this):
+        for histogram in this.histograms.values():
+            histogram.reset()
+
+    ## dump
+    # Write a snapshot, readers never see a partially written file
+    def dump(this, path):
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(this.snapshot(), f, indent=2)
+        os.replace(temp, path)
+
+    ## start_dump
+    # @param path     JSON file to write
+    # @param interval seconds between dumps
+    def start_dump(this, path, interval=5.0):
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                this.dump(path)
+
+        this.dumper = (stop, threading.Thread(target=run, daemon=True))
+        this.dumper[1].start()
+
+    ## serve
+    # Serve snapshots at http://host:port/metrics
+    #
+    # @param  port TCP port, 0 picks a free one
+    # @param  host interface to listen on, local only by default
+    # @return the port being served
+    def serve(this, port=8000, host="127.0.0.1"):
+        tracer = this
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(this):
+                if this.path.rstrip("/") not in ("", "/metrics"):
+                    this.send_error(404)
+                    return
+                body = json.dumps(tracer.snapshot(), indent=2).encode()
+                this.send_response(200)
+                this.send_header("Content-Type", "application/json")
+                this.send_header("Content-Length", str(len(body)))
+                this.end_headers()
+                this.wfile.write(body)
+
+            # Don't print a line for every request
+            def log_message(this, format, *args):
+                pass
+
+        this.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=this.server.serve_forever, daemon=True).start()
+        return this.server.server_address[1]
+
+    def close(this):
+        if this.dumper is not None:
+            this.dumper[0].set()
+            this.dumper[1].join()
+            this.dumper = None
+        if this.server is not None:
+            this.server.shutdown()
+            this.server.server_close()
+            this.server = None
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" localization_backends.py: registry of position solvers for the fixture
+    Backends are registered by "module:attribute" name and only imported the
+    first time they are created, so the fixture doesn't load scikit-learn or
+    the trained model unless the machine learning backend is selected.
+
+    A backend is a class constructed with the fixture configuration dict and
+    providing two methods:
+    features(peaks)             per frame value to smooth from the peak
+                                amplitude of each mic
+    locate(smoothed, previous)  (N x 3) positions from the smoothed values,
+                                previous is the last position or None
+
+    and optionally the attribute
+    retunable                   True if locate() still holds when the fixture
+                                moves its bandpass to follow the wingbeat
+                                tone. Missing means False: the calibration
+                                tables, the trained model and the lookup
+                                table all hold amplitudes measured in the
+                                LPF to HPF band, and amplitudes from another
+                                band would be read against them.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import importlib
+
+BACKENDS = {
+    "trilateration": "localization_backends:TrilaterationBackend",
+    "ml": "trilateration_linear_regression_model:RegressionBackend",
+    "lookup": "lookup_localizer:LookupBackend",
+}
+
+# Backend classes that have already been imported
+loaded = {}
+
+## register_backend
+# @param name   backend name used by create_backend
+# @param target "module:attribute" of the backend class
+def register_backend(name, target):
+    BACKENDS[name] = target
+    loaded.pop(name, None)
+
+def load_backend(name):
+    if name not in loaded:
+        if name not in BACKENDS:
+            raise KeyError("Unknown localization backend '%s', expected one of %s" % (name, ", ".join(BACKENDS)))
+
+        module, attribute = BACKENDS[name].split(":")
+        loaded[name] = getattr(importlib.import_module(module), attribute)
+    return loaded[name]
+
+## create_backend
+# @param  name   backend name
+# @param  config fixture configuration dict
+# @return backend instance
+def create_backend(name, config):
+    return load_backend(name)(config)
+
+class TrilaterationBackend:
+    """ Converts amplitudes to distances with the mic calibration curves and
+        solves for the position with multilateration
+    """
+
+    def __init__(this, config):
+        from os.path import exists
+        from mic_calibration import MicCalibration
+        from multilateration import multilaterate, MicArray
+
+        this.multilaterate = multilaterate
+        this.mic_positions = config["mic_positions"]
+        this.mic_array = MicArray(this.mic_positions)
+
+        # Fitted curves if there are any, otherwise fit the hand measured tables
+        path = config.get("mic_calibration")
+        if path is not None and exists(path):
+            this.mic_cal = MicCalibration.load(path)
+        else:
+            this.mic_cal = MicCalibration.from_tables(config["cal_distance"], config["cal_amplitudes"], config.get("cal_model", "inverse_square"))
+
+    def features(this, peaks):
+        return this.mic_cal.evaluate(peaks)
+
+    def locate(this, ranges, previous=None):
+        return this.multilaterate(ranges, this.mic_array, previous)
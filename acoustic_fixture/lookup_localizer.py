@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" lookup_localizer.py: calibration lookup table localizer
+    The calibration dataset is compiled offline into a table of the mean log
+    peak amplitude of each mic at every calibration position. A query finds
+    the nearest table entries in log amplitude space and blends their
+    positions with inverse distance weighting. The table is a small .npz and
+    a query is a few numpy calls, no scikit-learn is needed at runtime.
+
+    Run it directly to compile a table:
+    python lookup_localizer.py training_data lookup.npz
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import sys
+import numpy as np
+
+RATE = 44100
+LPF = 400
+HPF = 480
+
+# Smallest amplitude taken into the log, silence would be -inf otherwise
+AMPLITUDE_FLOOR = 1e-6
+
+def log_amplitude(peaks):
+    return np.log(np.maximum(peaks, AMPLITUDE_FLOOR))
+
+## compile_lookup
+# @param  data_path calibration dataset from acoustic_fixture_calibration.py
+# @param  output    .npz file to write
+# @param  lowcut    bandpass low cutoff in Hz
+# @param  highcut   bandpass high cutoff in Hz
+# @param  fs        sample rate
+# @return number of table entries
+def compile_lookup(data_path="training_data", output="lookup.npz", lowcut=LPF, highcut=HPF, fs=RATE):
+    from feature_extraction import extract_features
+
+    features, positions = extract_features(data_path, lowcut, highcut, fs, 3)
+    grid, inverse = np.unique(positions, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Average every visit to a position
+    keys = np.zeros((len(grid), features.shape[1]))
+    np.add.at(keys, inverse, log_amplitude(features))
+    keys /= np.bincount(inverse, minlength=len(grid))[:, None]
+
+    np.savez(output, keys=keys, positions=grid)
+    return len(grid)
+
+class LookupLocalizer:
+    ## __init__
+    # @param path  table written by compile_lookup
+    # @param k     number of nearest entries to blend
+    # @param power inverse distance weighting exponent
+    def __init__(this, path="lookup.npz", k=4, power=2):
+        with np.load(path) as data:
+            this.keys = data["keys"]
+            this.positions = data["positions"]
+
+        this.k = min(k, len(this.keys))
+        this.power = power
+        this.key_norms = (this.keys ** 2).sum(axis=1)
+
+    ## query
+    # @param  amplitudes (mics) or (N x mics) log peak amplitudes
+    # @return (N x 3) positions
+    def query(this, amplitudes):
+        q = np.atleast_2d(amplitudes)
+
+        # Squared distance to every entry without building an (N x entries x mics) array
+        d2 = (q ** 2).sum(axis=1)[:, None] - 2 * q @ this.keys.T + this.key_norms
+        np.maximum(d2, 0, out=d2)
+
+        rows = np.arange(len(q))[:, None]
+        nearest = np.argpartition(d2, this.k - 1, axis=1)[:, :this.k]
+        weights = 1 / (d2[rows, nearest] ** (this.power / 2) + 1e-12)
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        return (weights[:, :, None] * this.positions[nearest]).sum(axis=1)
+
+class LookupBackend:
+    """ Localization backend for the fixture, see localization_backends.py"""
+
+    def __init__(this, config):
+        this.localizer = LookupLocalizer(config.get("lookup_path", "lookup.npz"))
+
+    # The table is built from averaged log amplitudes
+    def features(this, peaks):
+        return log_amplitude(peaks)
+
+    def locate(this, amplitudes, previous=None):
+        return this.localizer.query(amplitudes)
+
+if __name__ == "__main__":
+    data_path = sys.argv[1] if len(sys.argv) > 1 else "training_data"
+    output = sys.argv[2] if len(sys.argv) > 2 else "lookup.npz"
+    print("Compiled %d positions into %s" % (compile_lookup(data_path, output), output))
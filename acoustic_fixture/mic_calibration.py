@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" mic_calibration.py: amplitude to distance curves for each microphone
+    Each mic's curve is a small parametric model fitted with linear least
+    squares, and every mic is evaluated at once on (N x mics) amplitudes, so
+    the live path and bulk reprocessing of recordings are a few numpy calls.
+
+    inverse_square  A = a^2 / (d - b)^2 + floor, d = a / sqrt(A - floor) + b
+                    floor is the noise the mic hears with no source, it is
+                    found by a search, a and b by least squares
+    log             log(d + offset) = a * log(A) + b, a power law with a
+                    fixed offset so the fixture distance 0 can be fitted
+
+    Parameters are saved as versioned JSON files. Run it directly to fit the
+    curves from a calibration dataset, or from the tables in
+    acoustic_fixture.py without one:
+    python mic_calibration.py [training_data] [mic_calibration.json] [model]
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import json, os, sys, time
+import numpy as np
+
+# Bump when the file layout changes, older files are still read
+FORMAT_VERSION = 1
+
+MODELS = {
+    "inverse_square": ["a", "b", "floor"],
+    "log": ["a", "b", "offset"],
+}
+
+# Smallest amplitude above the floor, anything quieter is as far away as the curve goes
+MIN_SIGNAL = 1e-9
+
+## fit_line
+# Least squares d = a * x + b for every column at once
+#
+# @param  x (N x K) regressors
+# @param  d (N x K) distances
+# @return (a, b, squared residual) each (K)
+def fit_line(x, d):
+    x_mean = x.mean(axis=0)
+    d_mean = d.mean(axis=0)
+    dx = x - x_mean
+    a = (dx * (d - d_mean)).sum(axis=0) / np.maximum((dx ** 2).sum(axis=0), 1e-30)
+    b = d_mean - a * x_mean
+    return a, b, ((a * x + b - d) ** 2).sum(axis=0)
+
+## fit_inverse_square
+# @param  amplitudes (N) peak amplitudes of one mic
+# @param  distances  (N) distances to the source in mm
+# @param  steps      noise floor candidates to try
+# @return [a, b, floor]
+def fit_inverse_square(amplitudes, distances, steps=200):
+    # Every floor candidate is fitted at once as one column
+    floors = np.linspace(0, 0.99 * amplitudes.min(), steps)
+    x = (amplitudes[:, None] - floors[None, :]) ** -0.5
+    a, b, residual = fit_line(x, np.repeat(distances[:, None], steps, axis=1))
+    best = np.argmin(residual)
+    return [a[best], b[best], floors[best]]
+
+def fit_log(amplitudes, distances, offset=10.0):
+    a, b, residual = fit_line(np.log(amplitudes)[:, None], np.log(distances + offset)[:, None])
+    return [a[0], b[0], offset]
+
+class MicCalibration:
+    ## __init__
+    # @param model  name from MODELS
+    # @param params (mics x 3) model parameters
+    # @param limit  largest distance returned, in mm
+    # @param source where the curves were fitted from
+    def __init__(this, model, params, limit=1000.0, source=None):
+        if model not in MODELS:
+            raise ValueError("Unknown calibration model '%s', expected one of %s" % (model, ", ".join(MODELS)))
+
+        this.model = model
+        this.params = np.asarray(params, dtype=float).reshape(-1, 3)
+        this.limit = limit
+        this.source = source
+        this.a, this.b, this.c = this.params.T.copy()
+
+    def __len__(this):
+        return len(this.params)
+
+    ## evaluate
+    # @param  amplitudes (mics) or (N x mics) peak amplitudes
+    # @return distances in mm, the same shape
+    def evaluate(this, amplitudes):
+        amplitudes = np.asarray(amplitudes, dtype=float)
+        if this.model == "inverse_square":
+            d = this.a / np.sqrt(np.maximum(amplitudes - this.c, MIN_SIGNAL)) + this.b
+        else:
+            d = np.exp(this.a * np.log(np.maximum(amplitudes, MIN_SIGNAL)) + this.b) - this.c
+        return np.clip(d, 0, this.limit)
+
+    ## fit
+    # @param  amplitudes (N x mics) peak amplitudes
+    # @param  distances  (N x mics) distance from each mic to the source in mm
+    # @param  model      name from MODELS
+    # @param  source     description kept in the parameter file
+    # @return MicCalibration
+    @staticmethod
+    def fit(amplitudes, distances, model="inverse_square", source=None):
+        amplitudes = np.asarray(amplitudes, dtype=float)
+        distances = np.asarray(distances, dtype=float)
+        fit = fit_inverse_square if model == "inverse_square" else fit_log
+
+        params = [fit(amplitudes[:, mic], distances[:, mic]) for mic in range(amplitudes.shape[1])]
+        return MicCalibration(model, params, 2 * distances.max(), source)
+
+    ## from_tables
+    # Fit the hand measured tables, CAL_DISTANCE and MIC_CAL in acoustic_fixture.py
+    #
+    # @param  distances  calibration distances in mm
+    # @param  amplitudes list of each mic's peak amplitude at those distances
+    # @param  model      name from MODELS
+    # @return MicCalibration
+    @staticmethod
+    def from_tables(distances, amplitudes, model="inverse_square"):
+        amplitudes = np.asarray(amplitudes, dtype=float).T
+        distances = np.repeat(np.asarray(distances, dtype=float)[:, None], amplitudes.shape[1], axis=1)
+        return MicCalibration.fit(amplitudes, distances, model, "tables")
+
+    ## residuals
+    # @return (mics) RMS error in mm of the curves on the given data
+    def residuals(this, amplitudes, distances):
+        return np.sqrt(((this.evaluate(amplitudes) - distances) ** 2).mean(axis=0))
+
+    def save(this, path):
+        data = {
+            "version": FORMAT_VERSION,
+            "model": this.model,
+            "param_names": MODELS[this.model],
+            "params": this.params.tolist(),
+            "limit": this.limit,
+            "source": this.source,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+        # Write to a temporary name first so the fixture never reads half a file
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        if data.get("version", 0) > FORMAT_VERSION:
+            raise ValueError("%s is calibration format %d, this version reads up to %d" % (path, data["version"], FORMAT_VERSION))
+        return MicCalibration(data["model"], data["params"], data.get("limit", 1000.0), data.get("source"))
+
+## fit_dataset
+# @param  data_path     calibration dataset from acoustic_fixture_calibration.py
+# @param  mic_positions (mics x 3) mic positions in the dataset's frame
+# @param  band          (lowcut, highcut, fs) the fixture filters with
+# @param  model         name from MODELS
+# @return MicCalibration
+def fit_dataset(data_path, mic_positions, band, model="inverse_square"):
+    from feature_extraction import extract_features
+
+    peaks, positions = extract_features(data_path, *band)
+    distances = np.linalg.norm(positions[:, None, :] - np.asarray(mic_positions)[None, :, :], axis=2)
+    return MicCalibration.fit(peaks, distances, model, os.path.abspath(data_path))
+
+if __name__ == "__main__":
+    from acoustic_fixture import CAL_DISTANCE, MIC_CAL, FIXT_MIC_POSITIONS, LPF, HPF, RATE
+
+    data_path = sys.argv[1] if len(sys.argv) > 1 else "training_data"
+    output = sys.argv[2] if len(sys.argv) > 2 else "mic_calibration.json"
+    model = sys.argv[3] if len(sys.argv) > 3 else "inverse_square"
+
+    if os.path.isdir(data_path):
+        cal = fit_dataset(data_path, FIXT_MIC_POSITIONS, (LPF, HPF, RATE), model)
+    else:
+        print("No dataset at %s, fitting the calibration tables" % (data_path))
+        cal = MicCalibration.from_tables(CAL_DISTANCE, MIC_CAL, model)
+        print("RMS error (mm): %s" % (cal.residuals(np.asarray(MIC_CAL).T, np.asarray(CAL_DISTANCE)[:, None])))
+
+    cal.save(output)
+    print("Saved %s curves for %d mics to %s" % (model, len(cal), output))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" multilateration.py: batched position solver for a microphone array
+    Works on whole arrays of range measurements at once, so recorded sessions
+    can be reprocessed in a single call. When the spheres don't intersect the
+    closed form has no real solution, those rows fall back to a least squares
+    fit instead of returning NaN.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy
+
+## array_frame
+# Describe the microphone array by its centroid and principal axes. For a flat
+# array the last axis is the plane normal, oriented towards +z so solutions are
+# placed in front of the fixture.
+#
+# @param  mics (mics x 3) microphone positions
+# @return centroid, (3 x 3) axes, True if the mics are coplanar
+def array_frame(mics):
+    center = mics.mean(axis=0)
+    _, s, axes = numpy.linalg.svd(mics - center)
+    if axes[2][2] < 0:
+        axes[2] = -axes[2]
+
+    planar = len(mics) < 4 or s[-1] < 1e-6 * s[0]
+    return center, axes, planar
+
+class MicArray:
+    """ Everything the solvers need that depends only on the microphone
+        positions, the SVD of the array and the pseudo inverse of the
+        linearized sphere equations, computed once per array
+    """
+
+    ## __init__
+    # @param mics (mics x 3) microphone positions
+    def __init__(this, mics):
+        this.mics = numpy.array(mics, dtype=float)
+        this.center, this.axes, this.planar = array_frame(this.mics)
+        this.dims = 2 if this.planar else 3
+        this.local = (this.mics - this.center) @ this.axes[:this.dims].T
+
+        # 2 (p_i - p_0) . x = r_0^2 - r_i^2 + |p_i|^2 - |p_0|^2
+        norms = (this.local**2).sum(axis=1)
+        this.offset = norms[1:] - norms[0]
+        this.solver = numpy.linalg.pinv(2 * (this.local[1:] - this.local[0])).T
+
+    ## closed_form
+    # Linearize the sphere equations by subtracting the first microphone's
+    # equation from the others, then solve every row with one matrix product.
+    # http://wiki.gis.com/wiki/index.php/Trilateration
+    #
+    # @param  ranges (N x mics) distance to each microphone
+    # @param  clamp  place non-intersecting rows on the array plane instead of NaN
+    # @return (N x 3) positions, NaN where the spheres don't intersect
+    def closed_form(this, ranges, clamp=False):
+        b = ranges[:, :1]**2 - ranges[:, 1:]**2 + this.offset
+        solution = b @ this.solver
+
+        positions = this.center + solution @ this.axes[:this.dims]
+        if this.planar:
+            # Height above the array plane, averaged over all the spheres
+            height = (ranges**2 - ((solution[:, None, :] - this.local[None])**2).sum(axis=2)).mean(axis=1)
+            if clamp:
+                height = numpy.maximum(height, 0)
+            with numpy.errstate(invalid='ignore'):
+                positions += numpy.sqrt(height)[:, None] * this.axes[2]
+
+        return positions
+
+    ## multilaterate
+    # @param  ranges     (N x mics) distance to each microphone
+    # @param  initial    warm start for rows that need the least squares fit,
+    #                    e.g. the previous position. (N x 3) or (3,)
+    # @param  iterations maximum Gauss-Newton iterations
+    # @return (N x 3) positions
+    def multilaterate(this, ranges, initial=None, iterations=10):
+        positions = this.closed_form(ranges)
+        failed = ~numpy.isfinite(positions).all(axis=1)
+        if not failed.any():
+            return positions
+
+        # Start just in front of the array plane
+        guess = this.closed_form(ranges[failed], clamp=True) + this.axes[2]
+        if initial is None:
+            start = guess
+        else:
+            start = numpy.broadcast_to(numpy.asarray(initial, dtype=float), positions.shape)[failed]
+            start = numpy.where(numpy.isfinite(start), start, guess)
+
+        # The guess is NaN for NaN ranges, fall back to the array center
+        start = numpy.where(numpy.isfinite(start), start, this.center)
+        if not this.planar:
+            fit = least_squares(ranges[failed], this.mics, start, iterations)
+        else:
+            # The height has no gradient on the plane of a flat array, a fit
+            # that starts there never leaves it, and one that starts off it
+            # only creeps back when the best fit is on the plane. Fit from
+            # both in one batch and keep the smaller residual.
+            height = (start - this.center) @ this.axes[2]
+            lifted = start + (numpy.maximum(numpy.abs(height), 1) - height)[:, None] * this.axes[2]
+            flat = start - height[:, None] * this.axes[2]
+            both = numpy.vstack([ranges[failed]] * 2)
+            fits = least_squares(both, this.mics, numpy.vstack([lifted, flat]), iterations)
+            residual = ((numpy.linalg.norm(fits[:, None, :] - this.mics[None], axis=2) - both)**2).sum(axis=1)
+            lifted, flat = numpy.split(fits, 2)
+            better = numpy.split(residual, 2)
+            fit = numpy.where((better[0] <= better[1])[:, None], lifted, flat)
+
+        # A flat array can't tell front from back, mirror the fit in front of it
+        if this.planar:
+            height = (fit - this.center) @ this.axes[2]
+            fit -= 2 * numpy.minimum(height, 0)[:, None] * this.axes[2]
+
+        positions[failed] = fit
+        return positions
+
+## least_squares
+# Vectorized Gauss-Newton fit minimizing the range residuals of every row
+# together. A damping term keeps the normal equations solvable when the point
+# sits on the array plane, and each step is limited to the size of the
+# largest range so a poor start can't throw the solution away.
+#
+# @param  ranges     (N x mics) distance to each microphone
+# @param  mics       (mics x 3) microphone positions
+# @param  start      (N x 3) initial guess
+# @param  iterations maximum number of iterations
+# @param  tolerance  stop when every step is smaller than this
+# @param  damping    Levenberg damping added to the normal equations
+# @return (N x 3) positions
+def least_squares(ranges, mics, start, iterations=10, tolerance=1e-3, damping=1e-2):
+    x = numpy.array(start, dtype=float)
+    eye = numpy.eye(3) * damping
+    max_step = numpy.maximum(numpy.abs(ranges).max(axis=1, keepdims=True), 1)
+
+    for i in range(iterations):
+        diff = x[:, None, :] - mics[None]
+        dist = numpy.maximum(numpy.sqrt((diff**2).sum(axis=2)), 1e-9)
+        residual = dist - ranges
+        jacobian = diff / dist[:, :, None]
+
+        jtj = numpy.einsum('nmi,nmj->nij', jacobian, jacobian) + eye
+        jtr = numpy.einsum('nmi,nm->ni', jacobian, residual)
+        step = numpy.linalg.solve(jtj, jtr[:, :, None])[:, :, 0]
+        step *= numpy.minimum(1, max_step / numpy.maximum(numpy.sqrt((step**2).sum(axis=1, keepdims=True)), 1e-12))
+        x -= step
+
+        if numpy.abs(step).max() < tolerance:
+            break
+
+    return x
+
+## as_array
+# @return mics as a MicArray, positions are only decomposed if they aren't one yet
+def as_array(mics):
+    return mics if isinstance(mics, MicArray) else MicArray(mics)
+
+## closed_form
+# See MicArray.closed_form
+#
+# @param  ranges (N x mics) distance to each microphone
+# @param  mics   (mics x 3) microphone positions or a MicArray
+# @param  clamp  place non-intersecting rows on the array plane instead of NaN
+# @return (N x 3) positions, NaN where the spheres don't intersect
+def closed_form(ranges, mics, clamp=False):
+    return as_array(mics).closed_form(ranges, clamp)
+
+## multilaterate
+# @param  ranges     (N x mics) or (mics,) distance to each microphone
+# @param  mics       (mics x 3) microphone positions, or a MicArray to reuse
+#                    the decomposition of the array between calls
+# @param  initial    warm start for rows that need the least squares fit,
+#                    e.g. the previous position. (N x 3) or (3,)
+# @param  iterations maximum Gauss-Newton iterations
+# @return (N x 3) positions
+def multilaterate(ranges, mics, initial=None, iterations=10):
+    ranges = numpy.atleast_2d(numpy.asarray(ranges, dtype=float))
+    return as_array(mics).multilaterate(ranges, initial, iterations)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" process_pipeline.py: capture, DSP and laser output in separate processes
+    The audio callbacks, the DSP and the serial port all want the GIL, so a
+    garbage collection or a slow plot in one of them delays the others. Here
+    each stage is its own process:
+
+    capture  runs the capture engine and copies every synchronized block
+             into a slot of a shared memory ring
+    dsp      runs an AcousticFixture on the slots in place, no copies
+    output   owns the serial port and aims the laser
+
+    Only small descriptors go through the queues between them, (slot, block
+    number, capture time) to the DSP and (target, capture time) to the output.
+    Slots go back to the capture process over a free queue once processed, so
+    a stalled DSP stage makes the capture engine drop whole blocks instead of
+    the audio callbacks blocking.
+
+    python process_pipeline.py [geometry.json] [backend]
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import multiprocessing, queue, sys
+import numpy as np
+from multiprocessing import shared_memory
+
+# Seconds the stages wait on a queue before checking for a stop
+POLL = 0.1
+
+class SharedBlockRing:
+    """ (slots x channels x block size) float32 blocks in shared memory
+        The process that creates the ring unlinks it, the others only attach.
+    """
+
+    ## __init__
+    # @param slots      number of blocks
+    # @param channels   number of microphones
+    # @param block_size samples per block
+    # @param name       shared memory block to attach to, a new one is created if None
+    def __init__(this, slots, channels, block_size, name=None):
+        this.shape = (slots, channels, block_size)
+        size = int(np.prod(this.shape)) * np.dtype(np.float32).itemsize
+
+        this.owner = name is None
+        this.shm = shared_memory.SharedMemory(name=name, create=this.owner, size=size)
+        this.blocks = np.ndarray(this.shape, dtype=np.float32, buffer=this.shm.buf)
+
+    def __len__(this):
+        return this.shape[0]
+
+    ## descriptor
+    # @return arguments that attach another process to this ring
+    def descriptor(this):
+        return this.shape + (this.shm.name,)
+
+    def close(this):
+        # Views of the buffer must be gone before the mapping can be closed
+        this.blocks = None
+        this.shm.close()
+        if this.owner:
+            this.shm.unlink()
+
+class LaserQueue:
+    """ Stands in for the LaserCommandWorker of the DSP fixture, targets go
+        to the output process instead of a serial port
+    """
+
+    def __init__(this, commands, latency):
+        this.commands = commands
+        this.latency = latency
+
+    def submit(this, target, origin=None):
+        this.commands.put((tuple(float(v) for v in target), origin))
+
+    @property
+    def last_latency(this):
+        return this.latency.value
+
+    def stop(this):
+        pass
+
+## capture_stage
+# @param ring           SharedBlockRing descriptor
+# @param names          microphone names
+# @param source_factory callable returning a capture source, the USB mics if None
+# @param free           queue of slots the capture may fill
+# @param filled         queue of (slot, block number, capture time) descriptors
+# @param dropped        shared count of samples the capture engine dropped
+# @param ready          event set once the DSP stage can take blocks
+# @param stop           event that ends the pipeline
+def capture_stage(ring, names, source_factory, free, filled, dropped, ready, stop):
+    from acoustic_fixture import RATE, BUFFER, CAPTURE_BLOCKS
+    from audio_capture import CaptureEngine, PyAudioSource
+
+    ring = SharedBlockRing(*ring)
+    source = source_factory() if source_factory is not None else PyAudioSource({name: [-1, ""] for name in names}, RATE, BUFFER)
+    engine = CaptureEngine(len(names), BUFFER, RATE, CAPTURE_BLOCKS)
+
+    # Loading the backend takes a while, don't capture into a full ring until then
+    while not ready.wait(POLL):
+        if stop.is_set():
+            break
+    engine.start(source)
+
+    number = 0
+    slot = None
+    try:
+        while not stop.is_set():
+            # Wait for the DSP to hand back a slot, the engine keeps buffering meanwhile
+            if slot is None:
+                try:
+                    slot = free.get(timeout=POLL)
+                except queue.Empty:
+                    continue
+
+            # Copy straight from the capture rings into shared memory
+            if engine.read_block(ring.blocks[slot], timeout=POLL) is None:
+                if engine.finished:
+                    break
+                continue
+
+            filled.put((slot, number, engine.block_time))
+            dropped.value = engine.dropped()
+            number += 1
+            slot = None
+    finally:
+        engine.stop()
+        filled.put(None)
+        ring.close()
+
+## dsp_stage
+# @param ring     SharedBlockRing descriptor
+# @param geometry FixtureGeometry or JSON file
+# @param backend  localization backend name
+# @param free     queue the processed slots go back on
+# @param filled   queue of block descriptors from the capture stage
+# @param commands queue of (target, capture time) to the output stage, None offline
+# @param latency  shared galvo round trip in seconds, for the lead time
+# @param verbose  print a line for every frame
+# @param ready    event set once the fixture is built
+# @param processed shared count of blocks the fixture processed
+def dsp_stage(ring, geometry, backend, free, filled, commands, latency, verbose, ready, processed):
+    from acoustic_fixture import create_fixture
+
+    ring = SharedBlockRing(*ring)
+    af = create_fixture(backend=backend, geometry=geometry, offline=True, verbose=verbose, capture=False)
+    if commands is not None:
+        af.laser = LaserQueue(commands, latency)
+    ready.set()
+
+    try:
+        while True:
+            descriptor = filled.get()
+            if descriptor is None:
+                break
+
+            slot, number, block_time = descriptor
+            af.feed(ring.blocks[slot], block_time)
+            free.put(slot)
+            processed.value += 1
+    finally:
+        af.close()
+        if commands is not None:
+            commands.put(None)
+
+        # The fixture still holds a view of the last slot
+        del af
+        ring.close()
+
+## output_stage
+# @param commands queue of (target, capture time) from the DSP stage
+# @param latency  shared galvo round trip in seconds
+def output_stage(commands, latency):
+    from acoustic_fixture import connect_laser
+
+    ser, laser = connect_laser()
+    try:
+        while True:
+            command = commands.get()
+            if command is None:
+                break
+
+            # The worker only keeps the newest target anyway
+            laser.submit(*command)
+            latency.value = laser.last_latency
+    finally:
+        laser.stop()
+        ser.close()
+
+class ProcessPipeline:
+    ## __init__
+    # @param geometry       FixtureGeometry or JSON file, the fixture default if None
+    # @param backend        localization backend name, the fixture default if None
+    # @param source_factory picklable callable returning a capture source, the USB mics if None
+    # @param slots          blocks in the shared ring, CAPTURE_BLOCKS if None
+    # @param offline        don't start the output stage, the fixture OFFLINE_MODE if None
+    # @param verbose        print a line for every frame
+    def __init__(this, geometry=None, backend=None, source_factory=None, slots=None, offline=None, verbose=True):
+        this.geometry = geometry
+        this.backend = backend
+        this.source_factory = source_factory
+        this.slots = slots
+        this.offline = offline
+        this.verbose = verbose
+
+        this.ring = None
+        this.processes = []
+        this.queues = []
+        this.stop_event = None
+        this.dropped = None
+        this.processed = None
+
+    def start(this):
+        import acoustic_fixture
+        from fixture_geometry import FixtureGeometry
+
+        geometry = this.geometry or acoustic_fixture.GEOMETRY or acoustic_fixture.DEFAULT_GEOMETRY
+        if isinstance(geometry, str):
+            geometry = FixtureGeometry.load(geometry)
+        offline = acoustic_fixture.OFFLINE_MODE if this.offline is None else this.offline
+
+        this.ring = SharedBlockRing(this.slots or acoustic_fixture.CAPTURE_BLOCKS, len(geometry), acoustic_fixture.BUFFER)
+
+        # Spawned stages behave the same on Windows and Linux
+        context = multiprocessing.get_context("spawn")
+        free = context.Queue()
+        filled = context.Queue()
+        commands = None if offline else context.Queue()
+        latency = context.Value("d", 0.0, lock=False)
+        this.dropped = context.Value("q", 0, lock=False)
+        this.processed = context.Value("q", 0, lock=False)
+        this.stop_event = context.Event()
+        ready = context.Event()
+
+        # Keep the queues alive until the stages have attached to them
+        this.queues = [free, filled, commands, latency, ready]
+
+        for slot in range(len(this.ring)):
+            free.put(slot)
+
+        stages = [
+            (capture_stage, (this.ring.descriptor(), geometry.names, this.source_factory, free, filled, this.dropped, ready, this.stop_event)),
+            (dsp_stage, (this.ring.descriptor(), geometry, this.backend, free, filled, commands, latency, this.verbose, ready, this.processed)),
+        ]
+        if commands is not None:
+            stages.append((output_stage, (commands, latency)))
+
+        for target, args in stages:
+            process = context.Process(target=target, args=args, name=target.__name__, daemon=True)
+            process.start()
+            this.processes.append(process)
+
+    ## wait
+    # @param  timeout seconds to wait, forever if None
+    # @return True when every stage has finished
+    def wait(this, timeout=None):
+        for process in this.processes:
+            process.join(timeout)
+        return not any(process.is_alive() for process in this.processes)
+
+    ## stop
+    # The capture stage stops first, the others finish the blocks in flight
+    def stop(this):
+        if this.stop_event is not None:
+            this.stop_event.set()
+
+        for process in this.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        this.processes = []
+        this.queues = []
+
+        if this.ring is not None:
+            this.ring.close()
+            this.ring = None
+
+if __name__ == "__main__":
+    pipeline = ProcessPipeline(sys.argv[1] if len(sys.argv) > 1 else None, sys.argv[2] if len(sys.argv) > 2 else None)
+    pipeline.start()
+    try:
+        pipeline.wait()
+    except KeyboardInterrupt:
+        pass
+    pipeline.stop()
+    print("Processed %d blocks, dropped %d samples" % (pipeline.processed.value, pipeline.dropped.value))
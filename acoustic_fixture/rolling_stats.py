@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" rolling_stats.py: constant time rolling window statistics
+    Replaces the roll() + average() pattern. The window is a preallocated
+    (channels x window) array with a write index, and the running sum and max
+    are updated with each new column instead of being recomputed, so pushing a
+    value doesn't allocate a new array.
+
+    Modes
+    mean - average over the last window values
+    ema  - exponential moving average, alpha defaults to 2/(window+1)
+    peak - peak hold with decay. A value above the current average fills the
+           whole window, smaller values decay the average like the mean mode.
+           A window of 0 holds the maximum forever.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy
+
+class RollingWindow:
+    def __init__(this, channels, window, mode="mean", alpha=None, initial=0.0):
+        if mode not in ("mean", "ema", "peak"):
+            raise ValueError("Unknown rolling window mode: %s" % (mode))
+
+        this.channels = channels
+        this.window = window
+        this.mode = mode
+        this.alpha = alpha if alpha is not None else 2 / (window + 1)
+        this.index = 0
+
+        # Preallocated window storage and running statistics
+        this.store = numpy.full((channels, window), initial, dtype=float)
+        this.sum = numpy.full(channels, initial * window, dtype=float)
+        this.max = numpy.full(channels, initial, dtype=float)
+        this.value = numpy.full(channels, initial, dtype=float)
+
+        # Scratch space so push() doesn't allocate
+        this.oldest = numpy.zeros(channels)
+        this.evicted = numpy.zeros(channels)
+        this.mask = numpy.zeros(channels, dtype=bool)
+
+    @property
+    def mean(this):
+        return this.sum / max(this.window, 1)
+
+    def reset(this, initial=0.0):
+        this.store.fill(initial)
+        this.sum.fill(initial * this.window)
+        this.max.fill(initial)
+        this.value.fill(initial)
+        this.index = 0
+
+    ## push
+    # Add one value per channel to the window
+    #
+    # @param  values (channels,) new values
+    # @return the current statistic for each channel. The array is updated in
+    #         place by the next push, copy it to keep it.
+    def push(this, values):
+        if this.window == 0:
+            # Nothing to average, only the peak hold makes sense
+            numpy.maximum(this.value, values, out=this.value)
+            numpy.maximum(this.max, values, out=this.max)
+            return this.value
+
+        if this.mode == "peak":
+            # Values above the current average fill the whole window
+            numpy.greater(values, this.value, out=this.mask)
+            if this.mask.any():
+                numpy.copyto(this.store, numpy.reshape(values, (-1, 1)), where=this.mask[:, None])
+                numpy.multiply(values, this.window, out=this.oldest)
+                numpy.copyto(this.sum, this.oldest, where=this.mask)
+                numpy.copyto(this.max, values, where=this.mask)
+
+            # The rest are added to the window like the mean
+            numpy.logical_not(this.mask, out=this.mask)
+            this.insert(values, this.mask)
+            numpy.divide(this.sum, this.window, out=this.value)
+            return this.value
+
+        this.insert(values)
+        if this.mode == "mean":
+            numpy.divide(this.sum, this.window, out=this.value)
+        else:
+            this.value *= 1 - this.alpha
+            this.value += this.alpha * numpy.asarray(values)
+        return this.value
+
+    # Overwrite the oldest column and update the running sum and max
+    def insert(this, values, where=True):
+        column = this.store[:, this.index]
+        numpy.copyto(this.evicted, column)
+        numpy.copyto(column, values, where=where)
+
+        # sum += new - evicted
+        numpy.subtract(column, this.evicted, out=this.oldest)
+        this.sum += this.oldest
+
+        # The max only has to be rescanned when the old max leaves the window,
+        # compare the evicted values themselves, new - (new - old) can round
+        numpy.maximum(this.max, column, out=this.max)
+        numpy.greater_equal(this.evicted, this.max, out=this.mask)
+        if this.mask.any():
+            this.store.max(axis=1, out=this.max)
+
+        this.index += 1
+        if this.index == this.window:
+            this.index = 0
+
+            # Recompute the sum once per lap so rounding errors don't accumulate
+            this.store.sum(axis=1, out=this.sum)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" scan_planner.py: calibration scan order and printer motion timing
+    The calibration rig moves a sound source over a grid with a 3D printer.
+    Every axis has its own top speed (Z is usually far slower than X and Y)
+    and moves accelerate on a trapezoid, so the time between two points is
+    not their distance. The planner estimates each move's time the way the
+    printer will run it, orders the points with a serpentine per layer and
+    improves that with 2-opt on the move times.
+
+    For the continuous scan the source never stops, audio is captured while
+    a row is swept at a slow feed rate. MotionTimeline keeps the timed moves
+    that were sent and interpolates where the head was when each audio block
+    was captured, on the same trapezoid the printer runs.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+
+# Printer limits, mm/s and mm/s^2, see M203 and M204 on the printer
+FEEDRATE = 150
+MAX_SPEED = (200, 200, 12)
+ACCELERATION = 1000
+
+## grid_points
+# @param  x_max  largest |x| in mm
+# @param  y_max  largest |y| in mm
+# @param  z_max  largest z in mm
+# @param  step   grid spacing in mm
+# @return (N x 3) points, z from 0 to z_max
+def grid_points(x_max, y_max, z_max, step):
+    x = np.arange(-x_max, x_max + step, step)
+    y = np.arange(-y_max, y_max + step, step)
+    z = np.arange(0, z_max + step, step)
+    return np.stack(np.meshgrid(x, y, z, indexing="ij"), axis=-1).reshape(-1, 3).astype(float)
+
+## move_time
+# Seconds to cover a distance on a trapezoid that starts and ends at rest
+#
+# @param  distance mm, any shape
+# @param  speed    cruise speed in mm/s
+# @param  accel    acceleration in mm/s^2
+# @return seconds, the same shape
+def move_time(distance, speed, accel):
+    distance = np.asarray(distance, dtype=float)
+    speed = np.broadcast_to(speed, distance.shape)
+
+    # Short moves never reach the cruise speed and are a triangle
+    cruise = distance >= speed ** 2 / accel
+    return np.where(cruise, distance / np.maximum(speed, 1e-9) + speed / accel, 2 * np.sqrt(distance / accel))
+
+## move_distance
+# Distance covered t seconds into a move, the inverse of move_time
+#
+# @param  t        seconds since the move started, any shape
+# @param  distance mm
+# @param  speed    cruise speed in mm/s
+# @param  accel    acceleration in mm/s^2
+# @return mm, the same shape as t
+def move_distance(t, distance, speed, accel):
+    t = np.clip(np.asarray(t, dtype=float), 0, move_time(distance, speed, accel))
+
+    # Peak speed is lower than the cruise speed on a triangle
+    peak = min(speed, np.sqrt(distance * accel))
+    ramp = peak / accel
+    coast = move_time(distance, speed, accel) - 2 * ramp
+
+    accelerating = accel * t ** 2 / 2
+    cruising = accel * ramp ** 2 / 2 + peak * (t - ramp)
+    braking = distance - accel * np.maximum(2 * ramp + coast - t, 0) ** 2 / 2
+    return np.where(t < ramp, accelerating, np.where(t < ramp + coast, cruising, braking))
+
+class ScanPlanner:
+    ## __init__
+    # @param feedrate  requested speed in mm/s
+    # @param max_speed top speed of each axis in mm/s
+    # @param accel     acceleration in mm/s^2
+    # @param settle    seconds waited at each point before capturing
+    def __init__(this, feedrate=FEEDRATE, max_speed=MAX_SPEED, accel=ACCELERATION, settle=0.5):
+        this.feedrate = feedrate
+        this.max_speed = np.asarray(max_speed, dtype=float)
+        this.accel = accel
+        this.settle = settle
+
+    ## speed
+    # The printer scales the whole move down until no axis is over its limit
+    #
+    # @param  delta (... x 3) moves in mm
+    # @return cruise speed of each move in mm/s
+    def speed(this, delta):
+        delta = np.abs(np.asarray(delta, dtype=float))
+        distance = np.linalg.norm(delta, axis=-1, keepdims=True)
+        axis_limit = np.where(delta > 0, this.max_speed * distance / np.maximum(delta, 1e-12), np.inf)
+        return np.minimum(this.feedrate, axis_limit.min(axis=-1))
+
+    ## travel_time
+    # @param  a (... x 3) start points
+    # @param  b (... x 3) end points, broadcast against a
+    # @return seconds of each move
+    def travel_time(this, a, b):
+        delta = np.asarray(b, dtype=float) - np.asarray(a, dtype=float)
+        return move_time(np.linalg.norm(delta, axis=-1), this.speed(delta), this.accel)
+
+    ## serpentine
+    # Layer by layer, alternating the direction of every row and of the rows
+    # in every layer so each move is one step
+    #
+    # @param  points (N x 3) grid points
+    # @return visiting order of the points
+    def serpentine(this, points):
+        order = []
+        y_forward = True
+        x_forward = True
+        for z in np.unique(points[:, 2]):
+            layer = np.flatnonzero(points[:, 2] == z)
+            rows = np.unique(points[layer, 1])
+            for y in rows if y_forward else rows[::-1]:
+                row = layer[points[layer, 1] == y]
+                row = row[np.argsort(points[row, 0])]
+                order.extend(row if x_forward else row[::-1])
+                x_forward = not x_forward
+            y_forward = not y_forward
+        return np.array(order)
+
+    ## two_opt
+    # Reverse sections of the route while that makes it faster. The route
+    # starts at start and may end anywhere.
+    #
+    # @param  points (N x 3) points
+    # @param  order  initial visiting order
+    # @param  start  (x, y, z) the head starts at
+    # @param  passes largest number of improvement passes
+    # @return improved visiting order
+    def two_opt(this, points, order, start, passes=10):
+        route = np.vstack([start, points[order]])
+        order = np.concatenate([[-1], order])
+        n = len(route)
+
+        for _ in range(passes):
+            improved = False
+            for i in range(n - 2):
+                # Reverse route[i + 1:j + 1] for every j at once
+                j = np.arange(i + 2, n)
+                after = np.minimum(j + 1, n - 1)
+                last = j == n - 1
+                before_cost = this.travel_time(route[i], route[i + 1]) + np.where(last, 0, this.travel_time(route[j], route[after]))
+                after_cost = this.travel_time(route[i], route[j]) + np.where(last, 0, this.travel_time(route[i + 1], route[after]))
+                gain = before_cost - after_cost
+
+                best = np.argmax(gain)
+                if gain[best] > 1e-9:
+                    k = j[best]
+                    route[i + 1:k + 1] = route[i + 1:k + 1][::-1].copy()
+                    order[i + 1:k + 1] = order[i + 1:k + 1][::-1].copy()
+                    improved = True
+            if not improved:
+                break
+        return order[1:]
+
+    ## plan
+    # @param  points (N x 3) points to visit
+    # @param  start  (x, y, z) the head starts at
+    # @param  passes times to visit every point, each pass runs the route
+    #                backwards from where the last one ended
+    # @return (N * passes x 3) points in visiting order
+    def plan(this, points, start, passes=1):
+        points = np.asarray(points, dtype=float)
+        order = this.two_opt(points, this.serpentine(points), np.asarray(start, dtype=float))
+        route = points[order]
+        return np.vstack([route if p % 2 == 0 else route[::-1] for p in range(passes)])
+
+    ## duration
+    # @param  route (N x 3) points in visiting order
+    # @param  start (x, y, z) the head starts at
+    # @param  dwell seconds spent capturing at each point
+    # @return estimated seconds for the whole scan
+    def duration(this, route, start, dwell=0.0):
+        route = np.vstack([start, route])
+        return this.travel_time(route[:-1], route[1:]).sum() + (len(route) - 1) * (this.settle + dwell)
+
+    ## rows
+    # Sweeps for the continuous scan, one per row of x, serpentine like the
+    # stepped scan
+    #
+    # @param  points (N x 3) grid points
+    # @return (rows x 2 x 3) start and end of each sweep
+    def rows(this, points):
+        route = points[this.serpentine(points)]
+        ends = np.flatnonzero(np.any(route[1:, 1:] != route[:-1, 1:], axis=1))
+        starts = np.concatenate([[0], ends + 1])
+        ends = np.concatenate([ends, [len(route) - 1]])
+        return np.stack([route[starts], route[ends]], axis=1)
+
+class MotionTimeline:
+    """ Where the printer head was over time, built from the moves as they are
+        sent. Moves are assumed to start when the printer accepts them, the
+        host waits for the planner to empty before timing a move.
+    """
+
+    ## __init__
+    # @param position (x, y, z) the head is at
+    # @param planner  ScanPlanner with the printer limits
+    def __init__(this, position, planner):
+        this.planner = planner
+        this.position = np.asarray(position, dtype=float)
+        this.moves = []     # (start time, end time, start, end, speed)
+
+    ## add
+    # @param  start_time monotonic time the move started
+    # @param  target     (x, y, z) end of the move
+    # @param  feedrate   speed in mm/s, the planner feed rate if None
+    # @return monotonic time the move ends
+    def add(this, start_time, target, feedrate=None):
+        target = np.asarray(target, dtype=float)
+        delta = target - this.position
+        distance = np.linalg.norm(delta)
+
+        speed = this.planner.speed(delta)
+        if feedrate is not None:
+            speed = min(speed, feedrate)
+        end_time = start_time + float(move_time(distance, speed, this.planner.accel))
+
+        this.moves.append((start_time, end_time, this.position, target, speed))
+        this.position = target
+        return end_time
+
+    ## end_time
+    # @return monotonic time the last move ends, None without moves
+    def end_time(this):
+        return this.moves[-1][1] if this.moves else None
+
+    ## at
+    # @param  times monotonic times, any shape
+    # @return (... x 3) head positions, at rest between moves
+    def at(this, times):
+        times = np.asarray(times, dtype=float)
+        if not this.moves:
+            return np.broadcast_to(this.position, times.shape + (3,)).copy()
+
+        result = np.empty(times.shape + (3,))
+        result[...] = this.moves[0][2]
+        for start_time, end_time, start, end, speed in this.moves:
+            # Later moves overwrite earlier ones, after the end the head rests at the end
+            distance = np.linalg.norm(end - start)
+            active = times >= start_time
+            if distance:
+                travelled = move_distance(times[active] - start_time, distance, speed, this.planner.accel)
+                result[active] = start + (end - start) * (travelled / distance)[..., None]
+            else:
+                result[active] = end
+        return result
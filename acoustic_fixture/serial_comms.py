@@ -1,7 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-""" serial_comms.py: communicate over serial"""
+""" serial_comms.py: communicate over serial
+    SerialTransport keeps everything read from a port in one bytearray. Reads
+    take whatever is waiting at once and block in the driver for at most
+    POLL seconds when nothing is, so a wait never spins on in_waiting. Lines
+    and prompts are matched as the bytes come in, from where the last search
+    stopped. Text replies and binary frames share the buffer: frames start
+    with FRAME_SYNC, which never appears in text, so waiting for an ACK only
+    takes the frames out and waiting for text puts back the frames it passes.
+
+    A reply that timed out can still arrive later and be taken for the reply
+    to the next command. skip() drops it when it comes, flush() drops the
+    ones already there without waiting.
+
+    Every port has one transport, see transport(), which owns the port's read
+    timeout. waitFor() and sendCommand() are kept for scripts written against
+    the old functions and use that same transport.
+"""
 
 __version__ = "1.0"
 
@@ -9,33 +25,275 @@ __author__ = "Andrew Miyaguchi"
 __copyright__ = "Copyright 2021, Andrew Miyaguchi"
 __license__ = "Apache 2.0"
 
-import time
+import threading, time, weakref
+from galvo_protocol import FRAME_SYNC, FRAME_ACK, FRAME_NAK, MAX_PAYLOAD, CHECKSUM
+
+POLL = 0.05     # Longest a read blocks in the driver, seconds
+MAX_TEXT = 4096 # Unread text kept while only frames are read, the oldest is dropped
 
 start_time = time.time()
 
-# Wait for the machine to return ok
-def waitFor(ser, response):
+## split_frames
+# Separate the frames from the text around them
+#
+# @param  data received bytes
+# @return (text, complete frames, incomplete frame at the end), frames are
+#         not checked, that's left to the FrameDecoder
+def split_frames(data):
+    text = bytearray()
+    frames = bytearray()
+    i = 0
     while True:
-        ret = ""
-        if ser.in_waiting:
-            while ser.in_waiting:
-                c = ser.read().decode("utf-8")
-                ret += c
-                if c == "\n":
-                    break
-            print("[%12.6f] %s" % (time.time() - start_time, ret.replace("\n", "").replace("\r", "")))
-
-        if ret == response:
-            break
+        start = data.find(FRAME_SYNC, i)
+        if start < 0:
+            text += data[i:]
+            return text, frames, bytearray()
+
+        text += data[i:start]
+        if len(data) < start + 2:
+            return text, frames, bytearray(data[start:])
+
+        # A length no frame can have means the sync byte was noise
+        if data[start + 1] > MAX_PAYLOAD:
+            i = start + 1
+            continue
+
+        end = start + 4 + data[start + 1] + CHECKSUM.size
+        if len(data) < end:
+            return text, frames, bytearray(data[start:])
+        frames += data[start:end]
+        i = end
+
+class SerialTransport:
+    ## __init__
+    # @param ser  open serial port. Its read timeout is lowered to poll while
+    #             the transport has it, release() puts it back.
+    # @param poll longest a single read blocks, waits check their deadline in between
+    # @param echo print the lines that are read
+    def __init__(this, ser, poll=POLL, echo=True):
+        this.ser = ser
+        this.poll = poll
+        this.echo = echo
+        this.buffer = bytearray()
+        this.scanned = 0    # Bytes of the buffer already searched
+        this.late = {}      # Reply to drop: monotonic times the skips expire
+        this.dropped = 0    # Late replies dropped
+        this.lock = threading.RLock()
+
+        this.timeout = ser.timeout
+        if ser.timeout is None or ser.timeout > poll:
+            ser.timeout = poll
+
+    ## release
+    # Give the port back with its own read timeout
+    # @return bytes read but not used yet
+    def release(this):
+        with this.lock:
+            this.ser.timeout = this.timeout
+            data = bytes(this.buffer)
+            this.buffer.clear()
+            this.scanned = 0
+            return data
+
+    ## fill
+    # Read everything waiting, or block up to one poll for the next byte
+    # @return number of bytes read
+    def fill(this):
+        data = this.ser.read(this.ser.in_waiting or 1)
+        if data and this.ser.in_waiting:
+            data += this.ser.read(this.ser.in_waiting)
+        this.buffer += data
+        return len(data)
+
+    def print_lines(this, data):
+        for line in data.decode("utf-8", "replace").split("\n"):
+            line = line.replace("\r", "")
+            if line:
+                print("[%12.6f] %s" % (time.time() - start_time, line))
+
+    ## find
+    # @param  pattern  bytes to look for
+    # @param  anchored only match at the start of a line
+    # @return index of the match in the buffer, -1 without one
+    def find(this, pattern, anchored):
+        index = this.buffer.find(pattern, max(0, this.scanned - len(pattern) + 1))
+        while anchored and index > 0 and this.buffer[index - 1] not in b"\r\n":
+            index = this.buffer.find(pattern, index + 1)
+        this.scanned = len(this.buffer)
+        return index
+
+    ## skip
+    # Drop the next match of a reply that timed out but may still come, so it
+    # isn't taken for the reply to the next command. In case the reply was
+    # lost the skip expires after within seconds.
+    #
+    # @param response reply, as passed to read_until
+    # @param within   seconds the late reply may still take
+    def skip(this, response, within):
+        if isinstance(response, str):
+            response = response.encode("utf-8")
+        with this.lock:
+            this.late.setdefault(response, []).append(time.monotonic() + within)
+
+    ## skipped
+    # @return True if a match of pattern read now is a late reply to drop
+    def skipped(this, pattern):
+        now = time.monotonic()
+        expires = [t for t in this.late.pop(pattern, ()) if t >= now]
+        if not expires:
+            return False
+        if len(expires) > 1:
+            this.late[pattern] = expires[1:]
+        this.dropped += 1
+        return True
+
+    ## flush
+    # Drop the late replies that already arrived, without waiting for the rest
+    def flush(this):
+        with this.lock:
+            if this.ser.in_waiting:
+                this.fill()
+            for pattern in list(this.late):
+                data, _ = this.read_until(pattern, 0, anchored=True)
+                if data is not None and this.echo:
+                    this.print_lines(data)
+
+    ## read_until
+    # @param  pattern  bytes or str that ends the read
+    # @param  timeout  seconds to wait, forever if None, 0 only searches what
+    #                  is buffered
+    # @param  anchored only match the pattern at the start of a line
+    # @return (text up to and including the pattern, monotonic time it was
+    #         read), (None, None) on timeout. The text before a match is
+    #         dropped from the buffer, frames in it are kept. Nothing is
+    #         dropped on timeout.
+    def read_until(this, pattern, timeout=None, anchored=False):
+        if isinstance(pattern, str):
+            pattern = pattern.encode("utf-8")
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with this.lock:
+            while True:
+                index = this.find(pattern, anchored)
+                if index >= 0:
+                    end = index + len(pattern)
+                    text, frames, partial = split_frames(this.buffer[:end])
+                    this.buffer[:end] = frames + partial
+                    this.scanned = 0
+                    if this.skipped(pattern):
+                        continue
+                    return bytes(text), time.monotonic()
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None, None
+                this.fill()
+
+    ## readline
+    # @param  timeout seconds to wait, forever if None
+    # @return the line as str, None on timeout
+    def readline(this, timeout=None):
+        data, _ = this.read_until(b"\n", timeout)
+        return None if data is None else data.decode("utf-8", "replace")
+
+    ## read
+    # Everything buffered, waits up to one poll if nothing is
+    # @return bytes, empty if nothing arrived
+    def read(this):
+        with this.lock:
+            if not this.buffer:
+                this.fill()
+            data = bytes(this.buffer)
+            this.buffer.clear()
+            this.scanned = 0
+            return data
+
+    ## wait_for
+    # @param  response line or prompt to wait for, matched at the start of a line
+    # @param  timeout  seconds to wait, forever if None
+    # @return monotonic time the response arrived, None on timeout
+    def wait_for(this, response, timeout=None):
+        data, arrived = this.read_until(response, timeout, anchored=True)
+        if data is not None and this.echo:
+            this.print_lines(data)
+        return arrived
+
+    ## write_line
+    # Write a command without waiting for a response
+    # @param terminator appended unless the command already ends in "\r\n"
+    def write_line(this, command, terminator="\r"):
+        # Make sure we terminate our gcode
+        if command[-2:] != "\r\n":
+            command += terminator
+
+        if this.echo:
+            print("> %s" % (command.replace("\n", "").replace("\r", "")))
+        this.ser.write(command.encode("utf-8"))
+
+    ## send
+    # @param  response reply that acknowledges the command
+    # @return monotonic time the reply arrived, None on timeout
+    def send(this, command, response="ok\n", timeout=None, terminator="\r"):
+        with this.lock:
+            this.write_line(command, terminator)
+            return this.wait_for(response, timeout)
+
+    def write(this, data):
+        this.ser.write(data)
+
+    ## wait_ack
+    # Wait for the firmware to acknowledge frame seq, see galvo_protocol.py.
+    # Replies to other frames, like ones that timed out, are passed over.
+    #
+    # @param  decoder FrameDecoder the buffered frames are fed to, the text
+    #         around them stays in the buffer
+    # @return False on a NAK or if timeout seconds pass without the ACK
+    def wait_ack(this, decoder, seq, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with this.lock:
+            while True:
+                text, frames, partial = split_frames(this.buffer)
+                this.buffer[:] = text[-MAX_TEXT:] + partial
+                this.scanned = 0
+
+                for frame in decoder.feed(bytes(frames)):
+                    if frame.seq == seq and frame.type == FRAME_ACK:
+                        return True
+                    if frame.seq == seq and frame.type == FRAME_NAK:
+                        return False
+
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+                this.fill()
+
+# One transport per port, so every caller reads from the same buffer
+transports = weakref.WeakKeyDictionary()
+transports_lock = threading.Lock()
+
+## transport
+# The port's read timeout is lowered to POLL on first use, anything reading
+# the port directly should do so through the transport or release() it first
+#
+# @return the SerialTransport of ser, created on first use
+def transport(ser):
+    with transports_lock:
+        if ser not in transports:
+            transports[ser] = SerialTransport(ser)
+        return transports[ser]
+
+## release
+# Stop using the transport of ser and restore the port's read timeout
+# @return bytes read but not used yet
+def release(ser):
+    with transports_lock:
+        port = transports.pop(ser, None)
+    return port.release() if port is not None else b""
+
+# Wait for the machine to return the response
+# Returns False if timeout seconds pass without the response
+def waitFor(ser, response, timeout=None):
+    return transport(ser).wait_for(response, timeout) is not None
 
 # Write a gcode command to the printer
-def sendCommand(ser, gcode, trigger="ok\n"):
-    # Make sure we terminate our gcode
-    if gcode[-2:] != "\r\n":
-        gcode += "\r"
-
-    # Send the command
-    print("> %s" % (gcode.replace("\n", "").replace("\r", "")))
-    ser.write(str.encode(gcode))
-    time.sleep(0.1)
-    waitFor(ser, trigger)
\ No newline at end of file
+def sendCommand(ser, gcode, trigger="ok\n", timeout=None):
+    return transport(ser).send(gcode, trigger, timeout) is not None
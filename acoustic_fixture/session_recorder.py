@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" session_recorder.py: record and replay raw microphone sessions
+    The recorder appends every block the fixture reads to a memory mappable
+    file along with the capture time of its first sample. The replay source
+    feeds a recording back through the capture engine, either paced by the
+    recorded timestamps or as fast as the fixture can process it, so filter,
+    correlation and localization settings can be tuned against real
+    sessions without the microphones.
+
+    <path>/blocks  (blocks x channels x block size) float32
+    <path>/times   (blocks) float64, monotonic capture time in seconds
+
+    Run it directly to replay a session through the fixture:
+    python session_recorder.py session_directory [realtime]
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import os, sys, time
+import numpy as np
+from array_store import AppendableArray, open_array, read_header
+from audio_capture import ThreadedSource
+
+class SessionRecorder:
+    ## __init__
+    # @param path       session directory, appended to if it exists
+    # @param channels   number of microphones
+    # @param block_size samples per block
+    # @param rate       sample rate
+    def __init__(this, path, channels, block_size, rate):
+        os.makedirs(path, exist_ok=True)
+        this.blocks = AppendableArray(os.path.join(path, "blocks"), (channels, block_size), "float32", {"rate": rate})
+        this.times = AppendableArray(os.path.join(path, "times"), (), "float64")
+
+    ## write
+    # @param block     (channels x block size) samples
+    # @param timestamp monotonic capture time of the first sample
+    def write(this, block, timestamp):
+        this.blocks.append(block)
+        this.times.append(time.monotonic() if timestamp is None else timestamp)
+
+    def close(this):
+        this.blocks.close()
+        this.times.close()
+
+    def __len__(this):
+        return len(this.blocks)
+
+## load_session
+# @param  path session directory
+# @return ((blocks x channels x block size) memory mapped samples, (blocks) times, sample rate)
+def load_session(path):
+    blocks = open_array(os.path.join(path, "blocks"))
+    times = np.array(open_array(os.path.join(path, "times")))
+    rate = read_header(os.path.join(path, "blocks"))["meta"]["rate"]
+
+    # A crash between the two appends leaves a block without a time
+    count = min(len(blocks), len(times))
+    return blocks[:count], times[:count], rate
+
+class ReplaySource(ThreadedSource):
+    """ Plays a recorded session into the capture engine
+        realtime keeps the recorded spacing between blocks, including any
+        gaps, otherwise blocks are written as fast as the engine accepts them.
+        Either way each block is stamped with its recorded time.
+    """
+
+    def __init__(this, path, realtime=True, loop=False):
+        this.blocks, this.times, rate = load_session(path)
+        ThreadedSource.__init__(this, this.blocks.shape[2], rate, realtime)
+        this.loop = loop
+        this.position = 0
+
+    def run(this, engine):
+        # Recorded times are moved by one offset to the start of the replay,
+        # so the fixture sees the same spacing as the live run at any speed
+        shift = time.monotonic() - (this.times[0] if len(this.times) else 0)
+
+        while this.running:
+            if this.position >= len(this.blocks):
+                if not this.loop or not len(this.blocks):
+                    break
+                this.position = 0
+                shift = time.monotonic() - this.times[0]
+
+            block = this.blocks[this.position]
+            timestamp = this.times[this.position] + shift
+            if this.realtime:
+                # Release each block when its last sample would have been captured
+                delay = timestamp + this.block_size / this.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            this.position += 1
+
+            for i in range(len(block)):
+                engine.write(i, block[i], timestamp, block=not this.realtime)
+
+        engine.finish()
+
+if __name__ == "__main__":
+    from acoustic_fixture import create_fixture
+
+    if len(sys.argv) < 2:
+        print("usage: %s session_directory [realtime]" % (sys.argv[0]))
+        sys.exit(1)
+
+    # Replays never aim the laser
+    source = ReplaySource(sys.argv[1], realtime=len(sys.argv) > 2 and sys.argv[2] == "realtime")
+    af = create_fixture(source=source, offline=True)
+
+    start = time.time()
+    blocks = 0
+    while af.update():
+        blocks += 1
+    elapsed = time.time() - start
+    af.close()
+
+    recorded = blocks * source.block_size / source.rate
+    print("Replayed %d blocks (%.1f s of audio) in %.2f s, %.1fx real time" % (blocks, recorded, elapsed, recorded / max(elapsed, 1e-9)))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" target_tracker.py: constant velocity tracking of the localized sources
+    Every track is a Kalman filter on (x, y, z, vx, vy, vz) and all tracks are
+    stepped together as stacked arrays. Each frame the tracks are predicted
+    to the frame time, the localized positions are gated by their Mahalanobis
+    distance to each track and greedily associated, nearest pair first.
+    Measurements that match no track start a new one and tracks that go
+    unmatched for too long are dropped.
+
+    The laser is aimed at where the target will be once the command lands,
+    the track's position extrapolated by the pipeline latency.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+
+# 99% of 3 degree of freedom chi-squared, squared Mahalanobis distance
+GATE_99 = 11.34
+
+class TargetTracker:
+    ## __init__
+    # @param process_noise     acceleration noise in mm/s^2
+    # @param measurement_noise localization noise in mm
+    # @param gate              squared Mahalanobis distance a measurement must be within
+    # @param confirm           hits before a track is aimed at
+    # @param max_misses        frames a track survives without a measurement
+    # @param initial_speed     velocity uncertainty of a new track in mm/s
+    def __init__(this, process_noise=500.0, measurement_noise=10.0, gate=GATE_99, confirm=3, max_misses=10, initial_speed=500.0):
+        this.process_noise = process_noise
+        this.R = np.eye(3) * measurement_noise ** 2
+        this.gate = gate
+        this.confirm = confirm
+        this.max_misses = max_misses
+        this.initial_speed = initial_speed
+
+        this.X = np.zeros((0, 6))       # track states
+        this.P = np.zeros((0, 6, 6))    # track covariances
+        this.hits = np.zeros(0, int)
+        this.misses = np.zeros(0, int)
+        this.ids = np.zeros(0, int)
+        this.next_id = 0
+        this.time = None
+
+    def __len__(this):
+        return len(this.X)
+
+    ## predict
+    # Advance every track by dt seconds
+    def predict(this, dt):
+        if dt <= 0 or not len(this.X):
+            return
+
+        F = np.eye(6)
+        F[:3, 3:] = np.eye(3) * dt
+
+        # White noise acceleration
+        q = this.process_noise ** 2
+        Q = np.zeros((6, 6))
+        Q[:3, :3] = np.eye(3) * q * dt ** 4 / 4
+        Q[:3, 3:] = Q[3:, :3] = np.eye(3) * q * dt ** 3 / 2
+        Q[3:, 3:] = np.eye(3) * q * dt ** 2
+
+        this.X = this.X @ F.T
+        this.P = F @ this.P @ F.T + Q
+
+    ## associate
+    # @param  Z (M x 3) measurements
+    # @return (track index, measurement index) pairs
+    def associate(this, Z):
+        if not len(this.X) or not len(Z):
+            return []
+
+        S = this.P[:, :3, :3] + this.R                          # T x 3 x 3
+        y = Z[None, :, :] - this.X[:, None, :3]                 # T x M x 3
+        d2 = np.einsum("tmi,tij,tmj->tm", y, np.linalg.inv(S), y)
+
+        # Nearest pairs first, each track and measurement is used once
+        pairs = []
+        used_tracks = set()
+        used_measurements = set()
+        for flat in np.argsort(d2, axis=None):
+            t, m = np.unravel_index(flat, d2.shape)
+            if d2[t, m] > this.gate:
+                break
+            if t in used_tracks or m in used_measurements:
+                continue
+            pairs.append((t, m))
+            used_tracks.add(t)
+            used_measurements.add(m)
+        return pairs
+
+    ## correct
+    # Kalman update of the matched tracks
+    def correct(this, tracks, Z):
+        P = this.P[tracks]
+        S = P[:, :3, :3] + this.R
+        K = P[:, :, :3] @ np.linalg.inv(S)                      # n x 6 x 3
+        y = Z - this.X[tracks, :3]
+
+        this.X[tracks] += np.einsum("nij,nj->ni", K, y)
+        this.P[tracks] = P - K @ P[:, :3, :]
+
+    def spawn(this, Z):
+        P = np.zeros((len(Z), 6, 6))
+        P[:, :3, :3] = this.R
+        P[:, 3:, 3:] = np.eye(3) * this.initial_speed ** 2
+
+        this.X = np.concatenate([this.X, np.hstack([Z, np.zeros((len(Z), 3))])])
+        this.P = np.concatenate([this.P, P])
+        this.hits = np.concatenate([this.hits, np.ones(len(Z), int)])
+        this.misses = np.concatenate([this.misses, np.zeros(len(Z), int)])
+        this.ids = np.concatenate([this.ids, np.arange(this.next_id, this.next_id + len(Z))])
+        this.next_id += len(Z)
+
+    ## update
+    # @param  measurements (M x 3) positions localized this frame
+    # @param  timestamp    capture time of the frame in seconds
+    # @return (N x 6) states of the confirmed tracks
+    def update(this, measurements, timestamp):
+        Z = np.asarray(measurements, float).reshape(-1, 3)
+        Z = Z[np.isfinite(Z).all(axis=1)]
+
+        # A frame older than the last one is corrected at the last frame's
+        # time, the clock never goes back so no stretch is predicted twice
+        if this.time is None:
+            this.time = timestamp
+        elif timestamp > this.time:
+            this.predict(timestamp - this.time)
+            this.time = timestamp
+
+        pairs = this.associate(Z)
+        matched = np.zeros(len(this.X), bool)
+        new = np.ones(len(Z), bool)
+        if pairs:
+            tracks, found = (np.array(index) for index in zip(*pairs))
+            this.correct(tracks, Z[found])
+            matched[tracks] = True
+            new[found] = False
+
+        this.hits[matched] += 1
+        this.misses[matched] = 0
+        this.misses[~matched] += 1
+
+        # Forget lost tracks before starting new ones
+        keep = this.misses <= this.max_misses
+        this.X, this.P, this.hits, this.misses, this.ids = this.X[keep], this.P[keep], this.hits[keep], this.misses[keep], this.ids[keep]
+        if new.any():
+            this.spawn(Z[new])
+
+        return this.X[this.hits >= this.confirm]
+
+    ## target
+    # Where the most established track will be after the lead time
+    #
+    # @param  lead seconds to extrapolate
+    # @return (x, y, z) or None without a confirmed track
+    def target(this, lead=0.0):
+        confirmed = np.flatnonzero(this.hits >= this.confirm)
+        if not len(confirmed):
+            return None
+        best = confirmed[np.argmax(this.hits[confirmed] - this.misses[confirmed])]
+        return this.X[best, :3] + this.X[best, 3:] * lead
+
+    ## predictions
+    # @param  lead seconds to extrapolate
+    # @return (ids, (N x 3) positions) of every confirmed track
+    def predictions(this, lead=0.0):
+        confirmed = this.hits >= this.confirm
+        return this.ids[confirmed], this.X[confirmed, :3] + this.X[confirmed, 3:] * lead
+
+    def reset(this):
+        this.__init__(this.process_noise, np.sqrt(this.R[0, 0]), this.gate, this.confirm, this.max_misses, this.initial_speed)
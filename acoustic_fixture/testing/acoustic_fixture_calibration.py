@@ -12,6 +12,17 @@
     cellphone is zip tied to the head which produces the approprate tone, and
     data is captured every 20mm
 
+    The points are visited in the order scan_planner.py finds fastest for the
+    printer. SCAN_MODE = "continuous" captures while sweeping each row instead
+    of stopping at every point, every block is tagged with the position the
+    head was at when it was captured. Run it against testing/fake_marlin.py
+    to try it without the rig:
+    python acoustic_fixture_calibration.py [port] [step|continuous]
+
+    Blocks are written to disk as they are captured and the run keeps a
+    checkpoint in the dataset's manifest.json. After a crash or Ctrl-C run it
+    again with the same settings and it picks up where the checkpoint is.
+
     https://kevinponce.com/blog/python/send-gcode-through-serial-to-a-3d-printer-using-python/
 """
 
@@ -21,15 +32,20 @@ __author__ = "Andrew Miyaguchi"
 __copyright__ = "Copyright 2021, Andrew Miyaguchi"
 __license__ = "Apache 2.0"
 
-import serial
+import serial, sys
 import time
-from acoustic_fixture import AcousticFixture as AF, BUFFER, AMPLITUDE_SIZE
-import pickle
-
-start_time = time.time()
-
-# Initialize the acoustic fixture in calibration mode
-af = AF(cal_mode=True)
+import numpy as np
+from acoustic_fixture import AcousticFixture as AF, BUFFER, RATE, AMPLITUDE_SIZE
+from calibration_store import CalibrationWriter, CaptureManifest, BackgroundWriter, plan_key
+from scan_planner import ScanPlanner, MotionTimeline, grid_points
+from serial_comms import transport
+
+PRINTER_PORT = "COM4"
+SCAN_MODE = "step"      # step stops at every point, continuous captures while sweeping rows
+CONTINUOUS_DATA = "training_data_continuous"    # one block per position, kept apart from training_data
+SCAN_SPEED = 10         # mm/s, continuous sweep speed
+SETTLE_TIME = 0.5       # Wait for the fixture to stabalize before capturing data
+PASSES = 3              # Cycle through the training at least 3 times
 
 # Assume lower left corner of the fixture is located at (0, 0, 0)
 FIXTURE_HEIGHT = 56     # Distance to the top of the microphones
@@ -40,109 +56,167 @@ X_MAX = 80
 Y_MAX = 80
 Z_MAX = 120
 
+HEIGHT_OFFSET = 20
 
-# Wait for the machine to return ok
-def waitFor(ser, response):
-    ret = ""
-    while True:
-        if ser.in_waiting:
-            while ser.in_waiting:
-                ret = ser.readline().decode("utf-8")
-            print("[%12.6f] %s" % (time.time() - start_time, ret.replace("\n", "").replace("\r", "")))
-
-        if ret == response:
-            break
+start_time = time.time()
 
 # Write a gcode command to the printer
+# Returns the monotonic time the printer accepted it
 def sendCommand(ser, gcode):
-    # Make sure we terminate our gcode
-    if gcode[-2:] != "\r\n":
-        gcode += "\r\n"
-
-    # Send the command
-    print("> %s" % (gcode.replace("\n", "").replace("\r", "")))
-    ser.write(str.encode(gcode))
-    time.sleep(0.1)
-    waitFor(ser, "ok\n")
-
-print("Connecting to printer...")
-ser = serial.Serial("COM4", 115200)
-waitFor(ser, "LCD status changed\n")    # Wait for the system to initialize
-
-prompt = "Remove the acoustic fixture and phone, then press enter to home all axis"
-sendCommand(ser, "M0 %s" % (prompt))
-sendCommand(ser, "G28 0 W")               # Home the system
-sendCommand(ser, "G1 F9000")            # Set the feed rate
-
-# Move to the phone installation position
-sendCommand(ser, "G1 X%d Y%d Z%d" % PHONE_CENTER)
-sendCommand(ser, "M400")                # Wait for moves to finish
-prompt = "Install the phone into the holder with the bottom flush to the bed"
-sendCommand(ser, "M0 %s" % (prompt))
-
-# Make the bed accessable to the user so we can install the acoustic fixture
-sendCommand(ser, "G1 X0 Y200 Z100")     
-sendCommand(ser, "M400")                # Wait for moves to finish
-prompt = "Install the acoustic fixture onto the print table"
-sendCommand(ser, "M0 %s" % (prompt))
-
-
-HEIGHT_OFFSET = 20
-center_x, center_y, center_z = PHONE_CENTER
-center_z += FIXTURE_HEIGHT + HEIGHT_OFFSET # start some distance above the mics
-
-cal_dict = {}
-
-num_datapoints = 0
-
-FWD = True
-REV = False
-
-x_dir = FWD
-y_dir = FWD
-z_dir = FWD
-
-# Cycle through the training at least 3 times
-for i in range(3):
-    # Step through each calibration point
-    for z in range(0, Z_MAX + STEP, STEP):
-        y_range = range(-Y_MAX, Y_MAX + STEP, STEP) if x_dir == FWD else range(Y_MAX, -(Y_MAX + STEP), -STEP)
-        for y in y_range:
-            x_range = range(-X_MAX, X_MAX + STEP, STEP) if x_dir == FWD else range(X_MAX, -(X_MAX + STEP), -STEP)
-            for x in x_range:
-                sendCommand(ser, "G1 X%d Y%d Z%d" % (x + center_x, y + center_y, z + center_z))
-                sendCommand(ser, "M400")
-                time.sleep(0.5) # Wait 500ms for the fixture to stabalize before capturing data
-
-                # initialize the array of data if it doesn't exit
-                k = (x, y, z + HEIGHT_OFFSET)
-                if k not in cal_dict:
-                    cal_dict[k] = []
-
-                # discard the first buffer since the fixture class is asynchronous
-                af.update()
-
-                # Take 10 samples of data
-                for i in range(AMPLITUDE_SIZE):
-                    # fill the buffer with new data
-                    af.update()
-
-                    # copy the buffer into our training data set
-                    cal_dict[k].append(af.buf_copy)
-                    num_datapoints += 1
-
-                # print the average for debug purposes only
-                print("[%12.6f] M1: %.4f, M2: %.4f, M3: %.4f, n: %d" % (time.time() - start_time, af.amplitude_avg[0], af.amplitude_avg[1], af.amplitude_avg[2], num_datapoints))
-            # Reverse the direction of x
-            x_dir = ~x_dir 
-        
-        # Reverse the direction of y
-        y_dir = ~y_dir
-
-# Dump the training data in binary format
-pickle.dump(cal_dict, open("training_data.db", 'wb'))
-
-end_time = time.time() - start_time
-print("All done! Captured %d samples in %d minutes and %d seconds." % (num_datapoints, int(end_time/60), int(end_time) % 60))
-
-ser.close
\ No newline at end of file
+    return transport(ser).send(gcode, "ok\n", terminator="\r\n")
+
+def moveTo(ser, position, feedrate=None):
+    gcode = "G1 X%.2f Y%.2f Z%.2f" % tuple(position)
+    if feedrate is not None:
+        gcode += " F%d" % (feedrate * 60)
+    return sendCommand(ser, gcode)
+
+## prepare_rig
+# Home the printer and walk the user through installing the phone and fixture
+def prepare_rig(ser, planner):
+    prompt = "Remove the acoustic fixture and phone, then press enter to home all axis"
+    sendCommand(ser, "M0 %s" % (prompt))
+    sendCommand(ser, "G28 0 W")               # Home the system
+    sendCommand(ser, "G1 F%d" % (planner.feedrate * 60))   # Set the feed rate
+
+    # Move to the phone installation position
+    sendCommand(ser, "G1 X%d Y%d Z%d" % PHONE_CENTER)
+    sendCommand(ser, "M400")                # Wait for moves to finish
+    prompt = "Install the phone into the holder with the bottom flush to the bed"
+    sendCommand(ser, "M0 %s" % (prompt))
+
+    # Make the bed accessable to the user so we can install the acoustic fixture
+    sendCommand(ser, "G1 X0 Y200 Z100")
+    sendCommand(ser, "M400")                # Wait for moves to finish
+    prompt = "Install the acoustic fixture onto the print table"
+    sendCommand(ser, "M0 %s" % (prompt))
+
+## step_scan
+# Stop at every point and capture AMPLITUDE_SIZE blocks
+#
+# @param cal_data BackgroundWriter, every point is one step
+# @param route    (N x 3) points relative to the phone center in visiting order
+# @param center   printer position of the route's origin
+# @param first    points of the route already captured
+# @return number of blocks captured
+def step_scan(ser, af, cal_data, route, center, first=0):
+    blocks = np.zeros((AMPLITUDE_SIZE, len(af.mic_dict), BUFFER), np.float32)
+    num_datapoints = 0
+
+    for step in range(first, len(route)):
+        point = route[step]
+        moveTo(ser, point + center)
+        sendCommand(ser, "M400")
+        time.sleep(SETTLE_TIME)
+
+        # discard the audio captured while the printer was moving
+        af.engine.discard()
+
+        for j in range(AMPLITUDE_SIZE):
+            # fill the buffer with new data
+            af.update()
+
+            # copy the buffer into our training data set
+            blocks[j] = af.buf_copy
+            num_datapoints += 1
+
+        cal_data.append(point + (0, 0, HEIGHT_OFFSET), blocks)
+        cal_data.commit(step + 1)
+
+        # print the average for debug purposes only
+        print("[%12.6f] %s, n: %d" % (time.time() - start_time, ", ".join("M%d: %.4f" % (i + 1, a) for i, a in enumerate(af.amplitude_avg)), num_datapoints))
+
+    return num_datapoints
+
+## continuous_scan
+# Sweep every row at SCAN_SPEED and capture the whole time
+#
+# @param cal_data BackgroundWriter, every row is one step
+# @param rows     (rows x 2 x 3) start and end of each sweep relative to the phone center
+# @param center   printer position of the rows' origin
+# @param first    rows already captured
+# @return number of blocks captured
+def continuous_scan(ser, af, cal_data, planner, rows, center, first=0):
+    num_datapoints = 0
+    offset = np.asarray(center) - (0, 0, HEIGHT_OFFSET)
+
+    for step in range(first, len(rows)):
+        start, end = rows[step]
+        moveTo(ser, start + center, planner.feedrate)
+        sendCommand(ser, "M400")
+        time.sleep(SETTLE_TIME)
+        af.engine.discard()
+
+        # The planner is empty, the sweep starts when the printer accepts it
+        timeline = MotionTimeline(start + center, planner)
+        end_time = timeline.add(moveTo(ser, end + center, SCAN_SPEED), end + center, SCAN_SPEED)
+
+        while af.update() and af.block_time <= end_time:
+            # Tag the block with where the head was half way through it
+            position = timeline.at(af.block_time + BUFFER / RATE / 2)
+            cal_data.append(position - offset, af.buf_copy[None])
+            num_datapoints += 1
+
+        cal_data.commit(step + 1)
+        print("[%12.6f] row %s to %s, n: %d" % (time.time() - start_time, start, end, num_datapoints))
+
+    return num_datapoints
+
+if __name__ == "__main__":
+    port = sys.argv[1] if len(sys.argv) > 1 else PRINTER_PORT
+    mode = sys.argv[2] if len(sys.argv) > 2 else SCAN_MODE
+
+    # Initialize the acoustic fixture in calibration mode
+    af = AF(cal_mode=True)
+    planner = ScanPlanner(settle=SETTLE_TIME)
+
+    print("Connecting to printer...")
+    ser = serial.Serial(port, 115200)
+    transport(ser).wait_for("LCD status changed\n")    # Wait for the system to initialize
+
+    prepare_rig(ser, planner)
+
+    center_x, center_y, center_z = PHONE_CENTER
+    center_z += FIXTURE_HEIGHT + HEIGHT_OFFSET # start some distance above the mics
+    center = np.array((center_x, center_y, center_z), dtype=float)
+
+    points = grid_points(X_MAX, Y_MAX, Z_MAX, STEP)
+
+    if mode == "continuous":
+        # Every other pass runs the rows backwards so no pass starts with a long move
+        route = planner.rows(points)
+        route = np.concatenate([route if p % 2 == 0 else route[::-1, ::-1] for p in range(PASSES)])
+        data_path, repeats = CONTINUOUS_DATA, 1
+    else:
+        route = planner.plan(points, np.array((0, 200, 100)) - center, PASSES)
+        data_path, repeats = "training_data", AMPLITUDE_SIZE
+
+    # Points are appended to the dataset as they are captured
+    writer = CalibrationWriter(data_path, repeats, len(af.mic_dict), BUFFER, RATE)
+    manifest = CaptureManifest(data_path, plan_key(mode, route, center, repeats, BUFFER, RATE), len(route), len(writer))
+
+    # Anything written after the checkpoint belongs to a step that didn't finish
+    writer.truncate(manifest.rows)
+    if manifest.resumed:
+        print("Resuming at step %d of %d, %d rows kept" % (manifest.done, len(route), manifest.rows))
+    if mode != "continuous":
+        print("Estimated scan time: %d minutes" % (planner.duration(route[manifest.done:], np.array((0, 200, 100)) - center, AMPLITUDE_SIZE * BUFFER / RATE) / 60))
+
+    num_datapoints = 0
+    cal_data = BackgroundWriter(writer, manifest)
+    try:
+        if mode == "continuous":
+            num_datapoints = continuous_scan(ser, af, cal_data, planner, route, center, manifest.done)
+        else:
+            num_datapoints = step_scan(ser, af, cal_data, route, center, manifest.done)
+    except KeyboardInterrupt:
+        print("Stopped, run again to resume")
+    finally:
+        # Everything captured so far is on disk and checkpointed
+        cal_data.close()
+        af.close()
+
+    end_time = time.time() - start_time
+    print("All done! Captured %d samples in %d minutes and %d seconds." % (num_datapoints, int(end_time/60), int(end_time) % 60))
+
+    ser.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" benchmark_update.py: per stage timing of the update() hot path
+    Every stage of AcousticFixture.update() is timed on its own over a sweep
+    of buffer sizes and channel counts, the 882 sample 3 mic case uses the
+    freeze frame in signal_data.py and everything else a synthetic tone.
+    Results are ops/sec and p50/p99 call times, plus the total of the stages
+    one frame runs through compared to the time a block takes to capture.
+
+    python benchmark_update.py --save baseline.json
+    python benchmark_update.py --compare baseline.json --threshold 1.5
+
+    With --compare the script exits with status 1 if any stage's p50 grew by
+    more than the threshold factor.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import argparse, json, os, platform, sys, tempfile, time
+import numpy as np
+from signal_data import test_signal
+from acoustic_fixture import RATE, LPF, HPF, AMPLITUDE_SIZE, MIC_CAL, CAL_DISTANCE, FIXT_MIC_RADIUS, FIXT_D, FIXT_E, FIXT_F, MAX_LAG_MS
+from acoustic_trilateration import StreamingBandpass, TimeDelayEstimator, get_time_shift, trilateration
+from localization_backends import TrilaterationBackend
+from lookup_localizer import LookupLocalizer
+from multilateration import multilaterate
+from rolling_stats import RollingWindow
+from galvo_protocol import FrameEncoder
+from wingbeat_tracker import WingbeatTracker
+
+# Stages that one frame of update() runs through with the default backend
+FRAME_STAGES = ["wingbeat", "bandpass", "tdoa", "mic_cal", "multilateration", "rolling_average", "command_binary"]
+
+## test_block
+# @param  buffer   samples per block
+# @param  channels number of mics
+# @return (channels x buffer) block
+def test_block(buffer, channels):
+    if buffer == 882 and channels == 3:
+        return np.array(test_signal, dtype=np.float32)
+
+    # A tone arriving a little later at each mic
+    rng = np.random.default_rng(0)
+    t = np.arange(buffer) / RATE - np.arange(channels)[:, None] * 1e-4
+    return (0.05 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 1e-3, (channels, buffer))).astype(np.float32)
+
+## mic_positions
+# @param  channels number of mics
+# @return (channels x 3) mics evenly spaced on the fixture radius
+def mic_positions(channels):
+    angle = np.pi / 2 + 2 * np.pi * np.arange(channels) / channels
+    return np.stack([FIXT_MIC_RADIUS * np.cos(angle), FIXT_MIC_RADIUS * np.sin(angle), np.zeros(channels)], axis=1)
+
+## make_stages
+# @param  buffer   samples per block
+# @param  channels number of mics
+# @param  tmp      directory for temporary files
+# @return {name: callable} for each stage
+def make_stages(buffer, channels, tmp):
+    block = test_block(buffer, channels)
+    bandpass = StreamingBandpass(LPF, HPF, RATE, 3, channels)
+    filtered = bandpass.filter(block)
+    tdoa = TimeDelayEstimator(buffer, RATE, MAX_LAG_MS, (LPF, HPF))
+    wingbeat = WingbeatTracker(buffer, RATE, (LPF, HPF))
+
+    backend = TrilaterationBackend({
+        "mic_positions": mic_positions(channels),
+        "cal_distance": CAL_DISTANCE,
+        "cal_amplitudes": [MIC_CAL[i % len(MIC_CAL)] for i in range(channels)],
+    })
+    peaks = filtered.max(axis=1)
+    ranges = np.asarray(backend.features(peaks), float).reshape(-1)
+    previous = (0, 0, 100)
+
+    window = RollingWindow(channels, AMPLITUDE_SIZE)
+    encoder = FrameEncoder()
+    target = (12.3, 456.7, 89.0)
+
+    # A lookup table the size of the calibration grid
+    table = os.path.join(tmp, "lookup-%d.npz" % (channels))
+    rng = np.random.default_rng(0)
+    np.savez(table, keys=rng.normal(-4, 1, (567, channels)), positions=rng.uniform(-80, 80, (567, 3)))
+    lookup = LookupLocalizer(table)
+    log_peaks = np.log(peaks)
+
+    stages = {
+        "wingbeat": lambda: wingbeat.update(block),
+        "bandpass": lambda: bandpass.filter(block),
+        "tdoa": lambda: tdoa.estimate(filtered),
+        "get_time_shift": lambda: get_time_shift(filtered[0], filtered[1], buffer, RATE),
+        "mic_cal": lambda: backend.features(peaks),
+        "multilateration": lambda: multilaterate(ranges, backend.mic_array, previous),
+        "lookup": lambda: lookup.query(log_peaks),
+        "rolling_average": lambda: window.push(peaks),
+        "command_text": lambda: ("G1 X%.2f Y%.2f Z%.2f" % target).encode(),
+        "command_binary": lambda: encoder.move([target]),
+    }
+
+    if channels == 3:
+        r = ranges.tolist()
+        stages["trilateration"] = lambda: trilateration(r[0], r[1], r[2], FIXT_D, FIXT_E, FIXT_F)
+
+    # The regression model is only benchmarked where scikit-learn is installed
+    try:
+        from trilateration_linear_regression_model import load_model
+        model = load_model(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model.obj"))
+        if channels == model.n_features_in_:
+            stages["predict"] = lambda: model.predict([peaks])
+    except Exception:
+        pass
+
+    return stages
+
+## time_stage
+# @param  fn      stage to time
+# @param  repeats timed calls
+# @param  warmup  untimed calls first, to fill caches
+# @return call times in ns
+def time_stage(fn, repeats, warmup=20):
+    for i in range(warmup):
+        fn()
+
+    times = np.zeros(repeats, dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i in range(repeats):
+        start = clock()
+        fn()
+        times[i] = clock() - start
+    return times
+
+def summarize(times):
+    return {
+        "ops_per_sec": 1e9 / times.mean(),
+        "mean_us": times.mean() / 1000,
+        "p50_us": np.percentile(times, 50) / 1000,
+        "p99_us": np.percentile(times, 99) / 1000,
+    }
+
+## run
+# @param  buffers  buffer sizes to sweep
+# @param  channels channel counts to sweep
+# @param  repeats  timed calls per stage
+# @return {"stage/buffer/channels": summary}
+def run(buffers, channels, repeats):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for buffer in buffers:
+            for count in channels:
+                budget = buffer / RATE * 1e6
+                frame = 0
+
+                print("\nBUFFER %d, %d mics, %.1f ms block" % (buffer, count, budget / 1000))
+                print("%-18s %12s %10s %10s" % ("stage", "ops/sec", "p50 us", "p99 us"))
+                for name, fn in make_stages(buffer, count, tmp).items():
+                    # The legacy trilateration takes the root of a negative number with synthetic ranges
+                    with np.errstate(invalid="ignore"):
+                        summary = summarize(time_stage(fn, repeats))
+                    results["%s/%d/%d" % (name, buffer, count)] = summary
+                    print("%-18s %12.0f %10.1f %10.1f" % (name, summary["ops_per_sec"], summary["p50_us"], summary["p99_us"]))
+
+                    if name in FRAME_STAGES:
+                        frame += summary["p99_us"]
+
+                print("frame p99 total %.1f us, %.1f%% of the block" % (frame, frame / budget * 100))
+    return results
+
+## compare
+# @param  results   results of this run
+# @param  baseline  saved results
+# @param  threshold allowed p50 growth factor
+# @return list of (key, baseline p50, p50) regressions
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, summary in results.items():
+        if key in baseline and summary["p50_us"] > baseline[key]["p50_us"] * threshold:
+            regressions.append((key, baseline[key]["p50_us"], summary["p50_us"]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each stage of the fixture update")
+    parser.add_argument("--buffers", type=int, nargs="+", default=[441, 882, 1764])
+    parser.add_argument("--channels", type=int, nargs="+", default=[3, 4, 8])
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--save", help="write the results to a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.5, help="allowed p50 growth factor")
+    args = parser.parse_args()
+
+    results = run(args.buffers, args.channels, args.repeats)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+        print("\nSaved %d results to %s" % (len(results), args.save))
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, args.threshold)
+        for key, old, new in regressions:
+            print("REGRESSION %-30s p50 %.1f us -> %.1f us (%.2fx)" % (key, old, new, new / old))
+
+        if regressions:
+            sys.exit(1)
+        print("\nNo stage regressed by more than %.2fx" % (args.threshold))
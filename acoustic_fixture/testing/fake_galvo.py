@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" fake_galvo.py: laser galvo firmware simulator on a pseudo terminal
+    Answers like the MiyaSh shell in laser_galvo_firmware so the host code can
+    run without the hardware. Binary galvo_protocol frames are decoded and
+    acknowledged like the firmware does. Point COM_PORT at the printed device path.
+    Only available where pseudo terminals are (Linux, macOS).
+
+    python fake_galvo.py [latency_ms]
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import os, sys, threading, time, tty
+from math import atan, sqrt, pi
+from galvo_protocol import FrameDecoder, encode, decode_move, decode_setpoints, FRAME_SYNC, FRAME_MOVE, FRAME_SETPOINT, FRAME_LASER_ON, FRAME_LASER_OFF, FRAME_ACK, FRAME_NAK
+
+PROMPT = "\rsh$ "
+
+# Galvo geometry from lasergalvo.h
+H1 = 0.85
+ANGLE_MAX = pi/9
+X_INVERTED = False
+Z_INVERTED = True
+
+# Same as mapf.h
+def mapf(val, in_min, in_max, out_min, out_max):
+    return (val - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+class FakeGalvo:
+    ## __init__
+    # @param latency    seconds to spend on each command
+    # @param boot_delay seconds before the banner, pyserial flushes the input
+    #                   when the port is opened so the host must open it first
+    def __init__(this, latency=0.0, boot_delay=0.5):
+        this.latency = latency
+        this.boot_delay = boot_delay
+        this.laser = False
+        this.position = None
+        this.dac = None     # (x, z) DAC codes last written
+        this.commands = []
+        this.frames = []
+        this.decoder = FrameDecoder()
+        this.master, this.slave = os.openpty()
+        tty.setraw(this.slave)
+        this.port = os.ttyname(this.slave)
+        this.thread = None
+
+    def start(this):
+        this.thread = threading.Thread(target=this.run, daemon=True)
+        this.thread.start()
+        return this.port
+
+    def write(this, text):
+        os.write(this.master, text.encode("utf-8"))
+
+    def run(this):
+        # Boot like the arduino does after the port resets it
+        time.sleep(this.boot_delay)
+        this.write("Connected\r\nConnecting to DAC Y...success\r\nConnecting to DAC X...success\r\nDACs Connected\r\n" + PROMPT)
+
+        line = b""
+        while True:
+            try:
+                data = os.read(this.master, 1024)
+            except OSError:
+                break
+
+            for b in data:
+                # Binary frames start with a sync byte, like loop() in main.cpp
+                if this.decoder.buf or b == FRAME_SYNC:
+                    for frame in this.decoder.feed(bytes((b,))):
+                        this.handle_frame(frame)
+                    continue
+
+                line += bytes((b,))
+                if b == ord("\r"):
+                    command = line.strip().decode("utf-8")
+                    line = b""
+                    if command:
+                        this.handle(command)
+
+    def set_pos(this, x, y, z, verbose=True):
+        this.position = (x, y, z)
+
+        # Same debug line as LaserGalvo::setPos, cut to its 64 byte buffer
+        zAxis = min(max(atan(z/y) if y else 0, -ANGLE_MAX), ANGLE_MAX)
+        xAxis = min(max(atan(x/(H1 + sqrt(y*y + z*z))), -ANGLE_MAX), ANGLE_MAX)
+        if verbose:
+            this.write(("x: %.2f, y: %.2f, z: %.2f, xAxis: %.2frad, zAxis: %.2frad\n" % (x, y, z, xAxis, zAxis))[:63] + "\r\n")
+
+        # The conversion to uint16_t truncates
+        voltX = mapf(xAxis, -ANGLE_MAX, ANGLE_MAX, 4095, 0) if X_INVERTED else mapf(xAxis, -ANGLE_MAX, ANGLE_MAX, 0, 4095)
+        voltZ = mapf(zAxis, -ANGLE_MAX, ANGLE_MAX, 4095, 0) if Z_INVERTED else mapf(zAxis, -ANGLE_MAX, ANGLE_MAX, 0, 4095)
+        this.dac = (int(voltX), int(voltZ))
+
+    def handle_frame(this, frame):
+        this.frames.append(frame)
+        time.sleep(this.latency)
+
+        if frame.type == FRAME_MOVE:
+            for target in decode_move(frame.payload):
+                this.set_pos(*target, verbose=False)
+        elif frame.type == FRAME_SETPOINT:
+            for setpoint in decode_setpoints(frame.payload):
+                this.dac = setpoint
+        elif frame.type == FRAME_LASER_ON:
+            this.laser = True
+        elif frame.type == FRAME_LASER_OFF:
+            this.laser = False
+        else:
+            os.write(this.master, encode(FRAME_NAK, b"", frame.seq))
+            return
+
+        os.write(this.master, encode(FRAME_ACK, b"", frame.seq))
+
+    def handle(this, command):
+        this.commands.append(command)
+        args = command.split()
+        time.sleep(this.latency)
+
+        if args[0] == "G1":
+            pos = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+            for arg in args[1:]:
+                if arg[0] in pos:
+                    pos[arg[0]] = float(arg[1:])
+            this.set_pos(pos["X"], pos["Y"], pos["Z"])
+        elif args[0] == "M3":
+            this.laser = True
+            this.write("Laser Enabled\r\n")
+        elif args[0] == "M5":
+            this.laser = False
+            this.write("Laser Disabled\r\n")
+        else:
+            this.write("%s: command not found\r\n" % (args[0]))
+
+        this.write(PROMPT)
+
+if __name__ == "__main__":
+    galvo = FakeGalvo(float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0)
+    print("Fake laser galvo on %s" % (galvo.start()))
+
+    while True:
+        time.sleep(1)
+        if galvo.position is not None:
+            print("%d commands, %d frames, laser %s, position %s" % (len(galvo.commands), len(galvo.frames), "on" if galvo.laser else "off", galvo.position))
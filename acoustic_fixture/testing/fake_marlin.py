@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" fake_marlin.py: 3D printer simulator on a pseudo terminal
+    Answers like Marlin so acoustic_fixture_calibration.py can run without the
+    calibration rig. G1 moves go into a planner queue and are acknowledged
+    right away while there is room, the head moves on the acceleration
+    trapezoid from scan_planner.py in real time. M400 answers once the queue
+    is empty, M114 reports where the head is at that moment and M0 continues
+    as if the button was pressed. Point PRINTER_PORT at the printed device path.
+    Only available where pseudo terminals are (Linux, macOS).
+
+    python fake_marlin.py [start_delay_ms]
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import os, sys, threading, time, tty
+from scan_planner import ScanPlanner, MotionTimeline
+
+# Moves Marlin buffers before it stops answering, BLOCK_BUFFER_SIZE
+BLOCK_BUFFER_SIZE = 16
+
+class FakeMarlin:
+    ## __init__
+    # @param planner     ScanPlanner with the simulated printer limits
+    # @param start_delay seconds between accepting a move and the head moving
+    # @param boot_delay  seconds before the banner, pyserial flushes the input
+    #                    when the port is opened so the host must open it first
+    def __init__(this, planner=None, start_delay=0.0, boot_delay=0.5):
+        this.planner = planner or ScanPlanner()
+        this.start_delay = start_delay
+        this.boot_delay = boot_delay
+        this.timeline = MotionTimeline((0, 0, 0), this.planner)
+        this.feedrate = this.planner.feedrate
+        this.commands = []
+        this.master, this.slave = os.openpty()
+        tty.setraw(this.slave)
+        this.port = os.ttyname(this.slave)
+        this.thread = None
+
+    def start(this):
+        this.thread = threading.Thread(target=this.run, daemon=True)
+        this.thread.start()
+        return this.port
+
+    def write(this, text):
+        os.write(this.master, text.encode("utf-8"))
+
+    ## position
+    # @param  t monotonic time, now if None
+    # @return (x, y, z) of the head
+    def position(this, t=None):
+        return this.timeline.at(time.monotonic() if t is None else t)
+
+    def run(this):
+        time.sleep(this.boot_delay)
+        this.write("start\necho:Marlin 2.0.9\nLCD status changed\n")
+
+        line = b""
+        while True:
+            try:
+                data = os.read(this.master, 1024)
+            except OSError:
+                break
+
+            for b in data:
+                if b in b"\r\n":
+                    command = line.strip().decode("utf-8")
+                    line = b""
+                    if command:
+                        this.handle(command)
+                else:
+                    line += bytes((b,))
+
+    ## wait_moves
+    # Block until at most count moves are left in the planner
+    def wait_moves(this, count):
+        while True:
+            now = time.monotonic()
+            pending = [end for start, end, *move in this.timeline.moves if end > now]
+            if len(pending) <= count:
+                return
+            time.sleep(min(pending) - now)
+
+    def handle(this, command):
+        this.commands.append(command)
+        args = command.split()
+
+        if args[0] in ("G0", "G1"):
+            # Moves start when the one before them ends
+            this.wait_moves(BLOCK_BUFFER_SIZE - 1)
+            target = this.timeline.position.copy()
+            for arg in args[1:]:
+                if arg[0] in "XYZ":
+                    target["XYZ".index(arg[0])] = float(arg[1:])
+                elif arg[0] == "F":
+                    this.feedrate = float(arg[1:]) / 60
+
+            if (target != this.timeline.position).any():
+                start = max(time.monotonic() + this.start_delay, this.timeline.end_time() or 0)
+                this.timeline.add(start, target, this.feedrate)
+        elif args[0] == "G28":
+            this.wait_moves(0)
+            this.timeline.add(time.monotonic(), (0, 0, 0))
+            this.wait_moves(0)
+        elif args[0] == "M400":
+            this.wait_moves(0)
+        elif args[0] == "M114":
+            x, y, z = this.position()
+            this.write("X:%.2f Y:%.2f Z:%.2f E:0.00 Count X:0 Y:0 Z:0\n" % (x, y, z))
+        elif args[0] == "M0":
+            this.write("echo:%s\n" % (" ".join(args[1:])))
+        else:
+            this.write("echo:Unknown command: \"%s\"\n" % (command))
+
+        this.write("ok\n")
+
+if __name__ == "__main__":
+    printer = FakeMarlin(start_delay=float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0)
+    print("Fake printer on %s" % (printer.start()))
+
+    while True:
+        time.sleep(1)
+        print("%d commands, position %s" % (len(printer.commands), printer.position()))
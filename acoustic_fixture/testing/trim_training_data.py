@@ -4,6 +4,10 @@
 """ trim_training_data.py - I screwed up and this is how I fix the data
     It takes 1 hour to aquire 3 runs of training data, so it's more cost effective
     to write a script to fix the data rather than re-aquiring it.
+
+    New calibration runs are written with calibration_store.py, use
+    "python calibration_store.py training_data.db training_data" to convert
+    an old pickle instead.
 """
 
 __version__ = "1.0"
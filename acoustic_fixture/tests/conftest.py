@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" conftest.py: the fixture modules import each other by bare name, put
+    acoustic_fixture, its testing scripts (the fake devices) and the host
+    side scripts of the laser galvo firmware on the path
+"""
+
+import os, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "laser_galvo_firmware"))
+sys.path.insert(0, os.path.join(HERE, "..", "testing"))
+sys.path.insert(0, os.path.join(HERE, ".."))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_array_store.py: appending to, reopening and mapping on-disk arrays
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+
+from array_store import AppendableArray, open_array
+
+def test_append_grows_and_maps(tmp_path):
+    path = str(tmp_path / "rows")
+    rows = np.arange(5 * 2 * 3, dtype=np.float32).reshape(5, 2, 3)
+
+    with AppendableArray(path, (2, 3), meta={"rate": 44100}) as array:
+        assert len(array) == 0 and open_array(path).shape == (0, 2, 3)
+        assert array.append(rows[0]) == 0
+        assert array.append(rows[1:4]) == 1
+        array.flush()
+        np.testing.assert_array_equal(open_array(path), rows[:4])
+        assert array.append(rows[4]) == 4
+        assert len(array) == 5
+
+    mapped = open_array(path)
+    assert mapped.dtype == np.float32
+    np.testing.assert_array_equal(mapped, rows)
+
+def test_reopen_appends_after_the_last_row(tmp_path):
+    path = str(tmp_path / "rows")
+    with AppendableArray(path, (3,), "int16", {"note": "first"}) as array:
+        array.append([[1, 2, 3], [4, 5, 6]])
+
+    # The header is kept, no shape needed
+    with AppendableArray(path) as array:
+        assert len(array) == 2 and array.meta == {"note": "first"}
+        assert array.dtype == np.int16 and array.shape == (3,)
+        assert array.append([7, 8, 9]) == 2
+
+    np.testing.assert_array_equal(open_array(path), [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+
+def test_reopen_drops_a_partial_row(tmp_path):
+    path = str(tmp_path / "rows")
+    with AppendableArray(path, (4,)) as array:
+        array.append(np.ones((3, 4)))
+
+    # A crash half way through a row
+    with open(path + ".bin", "ab") as f:
+        f.write(np.zeros(2, np.float32).tobytes())
+    assert len(open_array(path)) == 3
+
+    with AppendableArray(path) as array:
+        assert len(array) == 3
+        array.append(np.full(4, 2))
+    np.testing.assert_array_equal(open_array(path)[3], 2)
+
+def test_truncate_to_a_row_count(tmp_path):
+    path = str(tmp_path / "rows")
+    with AppendableArray(path, (2,)) as array:
+        array.append(np.arange(10).reshape(5, 2))
+        assert array.truncate(2) == 2
+        assert array.append([10, 11]) == 2
+    np.testing.assert_array_equal(open_array(path), [[0, 1], [2, 3], [10, 11]])
+
+def test_shape_is_checked(tmp_path):
+    path = str(tmp_path / "rows")
+    with pytest.raises(ValueError):
+        AppendableArray(path)
+    AppendableArray(path, (2, 3)).close()
+    with pytest.raises(ValueError):
+        AppendableArray(path, (3, 2))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_audio_capture.py: channel alignment of the capture engine"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+from audio_capture import CaptureEngine
+
+BLOCK = 4
+
+def chunk(k):
+    return np.full(BLOCK, k, dtype=np.float32)
+
+# One ring overflowing must drop the same chunk on every channel
+def test_overflow_drops_in_lockstep():
+    engine = CaptureEngine(2, BLOCK, 1000, capacity_blocks=2)
+
+    # Channel 0 runs ahead and overflows on chunk 2
+    assert engine.write(0, chunk(0), 0.0)
+    assert engine.write(0, chunk(1), 0.0)
+    assert not engine.write(0, chunk(2), 0.0)
+
+    assert engine.write(1, chunk(0), 0.0)
+    assert engine.read_block(timeout=0)[:, 0].tolist() == [0, 0]
+
+    # Channel 1 would have room for chunk 2 now, it must be dropped anyway
+    assert engine.write(1, chunk(1), 0.0)
+    assert not engine.write(1, chunk(2), 0.0)
+    assert engine.write(0, chunk(3), 0.0)
+    assert engine.write(1, chunk(3), 0.0)
+
+    blocks = [engine.read_block(timeout=0)[:, 0].tolist() for i in range(2)]
+    assert blocks == [[1, 1], [3, 3]]
+    assert engine.rings[0].dropped == engine.rings[1].dropped == BLOCK
+    assert not engine.verdicts
+
+def test_blocks_stay_aligned_without_drops():
+    engine = CaptureEngine(3, BLOCK, 1000)
+    for k in range(5):
+        for channel in range(3):
+            engine.write(channel, chunk(k), 0.0)
+    for k in range(5):
+        assert engine.read_block(timeout=0)[:, 0].tolist() == [k] * 3
+    assert engine.dropped() == 0
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_calibration_store.py: converting the old pickles and resuming a
+    capture run that was killed part way
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import json, multiprocessing, os, pickle, time
+import numpy as np
+import pytest
+
+from calibration_store import CalibrationWriter, CalibrationDataset, CaptureManifest, BackgroundWriter, plan_key, convert_pickle
+
+MICS = 3
+BUFFER = 32
+REPEATS = 2
+STEPS = 40
+
+rng = np.random.default_rng(9)
+
+def make_points():
+    return {(x, y, 10): rng.normal(size=(5, MICS, BUFFER)).astype(np.float32) for x in (-10, 0, 10) for y in (0, 20)}
+
+def write_pickle(path, data):
+    with open(path, "wb") as f:
+        pickle.dump(data, f)
+
+@pytest.mark.parametrize("trimmed", [False, True])
+def test_convert_pickle(tmp_path, trimmed, capsys):
+    points = make_points()
+    if trimmed:
+        # {position: [[[mic1 buffers], [mic2 buffers], [mic3 buffers]]]}
+        data = {key: [buffers.transpose(1, 0, 2).tolist()] for key, buffers in points.items()}
+    else:
+        # {position: [[mic1, mic2, mic3], ...]}
+        data = {key: buffers.tolist() for key, buffers in points.items()}
+    write_pickle(str(tmp_path / "training_data.db"), data)
+
+    # Five buffers a point make two rows of two, one left over
+    count = convert_pickle(str(tmp_path / "training_data.db"), str(tmp_path / "data"), REPEATS, 44100)
+    assert count == 2 * len(points)
+    assert capsys.readouterr().out.count("Dropping 1 buffers") == len(points)
+
+    dataset = CalibrationDataset(str(tmp_path / "data"))
+    assert (dataset.repeats, dataset.mics, dataset.buffer) == (REPEATS, MICS, BUFFER)
+    for key, buffers in points.items():
+        samples, positions = dataset.select(key)
+        np.testing.assert_array_equal(positions, [key, key])
+        np.testing.assert_array_equal(samples.reshape(-1, MICS, BUFFER), buffers[:4])
+
+def test_convert_pickle_defaults_to_the_fewest_buffers(tmp_path):
+    points = make_points()
+    points[(0, 0, 10)] = points[(0, 0, 10)][:3]
+    write_pickle(str(tmp_path / "training_data.db"), {key: buffers.tolist() for key, buffers in points.items()})
+    assert convert_pickle(str(tmp_path / "training_data.db"), str(tmp_path / "data")) == len(points)
+    assert CalibrationDataset(str(tmp_path / "data")).repeats == 3
+
+## blocks
+# @return the audio a step captures, recognizable by its step and row
+def blocks(step, row):
+    return np.full((REPEATS, MICS, BUFFER), step * 10 + row, np.float32)
+
+## capture
+# Run the plan from where the manifest says, two rows a step, like
+# acoustic_fixture_calibration.py
+#
+# @param hang step to stop at after its rows, to be killed there
+def capture(path, hang=None):
+    writer = CalibrationWriter(path, REPEATS, MICS, BUFFER)
+    manifest = CaptureManifest(path, plan_key("step", np.arange(STEPS)), STEPS, len(writer))
+    writer.truncate(manifest.rows)
+    first = manifest.done
+
+    with BackgroundWriter(writer, manifest, batch=3) as cal_data:
+        for step in range(first, STEPS):
+            for row in range(2):
+                cal_data.append((step, row, 0), blocks(step, row))
+            if step == hang:
+                # The rows past the checkpoint reach the disk, then it dies
+                while len(cal_data.writer) < 2 * (step + 1):
+                    time.sleep(0.01)
+                cal_data.writer.flush()
+                time.sleep(60)
+            cal_data.commit(step + 1)
+    return first
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def test_resume_after_kill(tmp_path):
+    path = str(tmp_path / "data")
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=capture, args=(path, 11), daemon=True)
+    process.start()
+
+    # Kill it in step 11, the last checkpoint is after step 9 with batch=3
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline and (read_manifest(path) or {}).get("done") != 9:
+        time.sleep(0.01)
+    while time.monotonic() < deadline and os.path.getsize(os.path.join(path, "positions.bin")) < 24 * 12:
+        time.sleep(0.01)
+    process.kill()
+    process.join()
+
+    killed = read_manifest(path)
+    assert (killed["done"], killed["rows"]) == (9, 18)
+
+    # Rows of the unfinished steps made it to disk
+    assert len(CalibrationDataset(path)) == 24
+
+    # The resumed run starts at the checkpoint
+    assert capture(path) == killed["done"]
+    assert read_manifest(path)["done"] == STEPS
+
+    dataset = CalibrationDataset(path)
+    steps, rows = np.arange(STEPS).repeat(2), np.tile([0, 1], STEPS)
+    np.testing.assert_array_equal(dataset.positions, np.stack([steps, rows, np.zeros_like(steps)], axis=1))
+    np.testing.assert_array_equal(dataset.samples[:, 0, 0, 0], steps * 10 + rows)
+    assert len(np.unique(dataset.positions, axis=0)) == len(dataset)
+
+def test_other_plan_starts_after_the_data(tmp_path):
+    path = str(tmp_path / "data")
+    capture(path)
+    with CalibrationWriter(path, REPEATS, MICS, BUFFER) as writer:
+        manifest = CaptureManifest(path, plan_key("continuous", np.arange(STEPS)), STEPS, len(writer))
+    assert not manifest.resumed
+    assert (manifest.done, manifest.rows) == (0, 2 * STEPS)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_feature_extraction.py: training features against the live filter"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip("scipy")
+
+from acoustic_trilateration import StreamingBandpass
+from calibration_store import CalibrationWriter
+from feature_extraction import peak_features, extract_features
+
+RATE = 44100
+BUFFER = 882
+BAND = (400, 480)
+REPEATS = 8
+GAINS = np.array([0.3, 0.1, 0.05])
+
+## tone
+# @return (mics x blocks * BUFFER) wingbeat tone with a little noise
+def tone(blocks, frequency=440, seed=0):
+    t = np.arange(blocks * BUFFER) / RATE
+    rng = np.random.default_rng(seed)
+    return GAINS[:, None] * np.sin(2 * np.pi * frequency * t + np.arange(len(GAINS))[:, None]) + rng.normal(0, 2e-3, (len(GAINS), len(t)))
+
+## capture
+# Run the fixture's filter over a stream and keep the last REPEATS blocks
+# @return ((REPEATS x mics x BUFFER) raw blocks, (REPEATS x mics) live peaks)
+def capture(stream):
+    bandpass = StreamingBandpass(BAND[0], BAND[1], RATE, 3, len(GAINS))
+    blocks = stream.reshape(len(GAINS), -1, BUFFER).transpose(1, 0, 2)
+    peaks = np.array([bandpass.filter(block).max(axis=1) for block in blocks])
+    return blocks[-REPEATS:], peaks[-REPEATS:]
+
+@pytest.mark.parametrize("frequency", [420, 440, 470])
+def test_repeats_match_the_live_filter(frequency):
+    blocks, live = capture(tone(REPEATS + 40, frequency))
+    features = peak_features(blocks[None], BAND[0], BAND[1], RATE)[0]
+    assert features.shape == (REPEATS, len(GAINS))
+
+    # The first repeats settle, after that the stream is the live one
+    assert_allclose(features[:2], live[:2], rtol=0.1)
+    assert_allclose(features[3:], live[3:], rtol=1e-3)
+
+def test_extract_features_rows_and_cache(tmp_path):
+    path = str(tmp_path)
+    positions = [(0, 200, 0), (50, 250, 10), (-50, 300, 20)]
+    points = [capture(tone(REPEATS + 4, seed=k))[0].astype(np.float32) for k in range(len(positions))]
+    with CalibrationWriter(path, REPEATS, len(GAINS), BUFFER, RATE) as writer:
+        for position, blocks in zip(positions, points):
+            writer.append(position, blocks)
+
+    # One row per buffer, chunks don't change how a point is filtered
+    features, rows = extract_features(path, BAND[0], BAND[1], RATE, workers=1, chunk=2)
+    assert_allclose(rows, np.repeat(positions, REPEATS, axis=0))
+    assert_allclose(features[REPEATS:2 * REPEATS], peak_features(points[1], BAND[0], BAND[1], RATE), rtol=1e-6)
+
+    # The second call loads the cache
+    assert len(list(tmp_path.glob("features-*.npz"))) == 1
+    cached, _ = extract_features(path, BAND[0], BAND[1], RATE, workers=1, chunk=2)
+    assert_allclose(cached, features)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_fixture_geometry.py: the array description file and the array to
+    laser transform
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+
+from fixture_geometry import FixtureGeometry
+
+# Quarter turn about z
+QUARTER = [[0, -1, 0], [1, 0, 0], [0, 0, 1]]
+
+def make_geometry(**kwargs):
+    return FixtureGeometry(["Mosquito 1", "Mosquito 2", "Mosquito 3", "Mosquito 4"],
+                           [[-50, -50, 0], [-50, 50, 0], [50, 50, 0], [50, -50, 0]],
+                           (10, 400, 60), QUARTER, "square", **kwargs)
+
+@pytest.mark.parametrize("kwargs", [
+    {"cal_amplitudes": [[0.9, 0.5, 0.2], [0.8, 0.4, 0.1], [1.0, 0.6, 0.3], [0.7, 0.3, 0.1]]},
+    {"mic_calibration": "square_calibration.json"},
+])
+def test_save_load_round_trip(tmp_path, kwargs):
+    geometry = make_geometry(**kwargs)
+    path = str(tmp_path / "square.json")
+    geometry.save(path)
+    loaded = FixtureGeometry.load(path)
+
+    assert loaded.names == geometry.names and loaded.name == "square"
+    np.testing.assert_array_equal(loaded.positions, geometry.positions)
+    np.testing.assert_array_equal(loaded.origin, geometry.origin)
+    np.testing.assert_array_equal(loaded.rotation, geometry.rotation)
+    assert loaded.cal_amplitudes == kwargs.get("cal_amplitudes")
+    assert loaded.mic_calibration == kwargs.get("mic_calibration")
+
+def test_load_defaults(tmp_path):
+    path = tmp_path / "bare.json"
+    path.write_text('{"mics": [{"name": "a", "position": [0, 0, 0]}, {"name": "b", "position": [1, 0, 0]}]}')
+    loaded = FixtureGeometry.load(str(path))
+    assert loaded.name == str(path)
+    np.testing.assert_array_equal(loaded.origin, 0)
+    np.testing.assert_array_equal(loaded.rotation, np.eye(3))
+
+def test_to_laser_rotates_then_offsets():
+    geometry = make_geometry()
+    np.testing.assert_allclose(geometry.to_laser((100, 0, 20)), (10, 500, 80))
+    np.testing.assert_allclose(geometry.to_laser([(100, 0, 20), (0, 100, 0)]), [(10, 500, 80), (-90, 400, 60)])
+
+def test_backend_config_mic_count():
+    base = {"cal_amplitudes": [[1, 0.5]] * 3, "cal_distance": [100, 200]}
+    with pytest.raises(ValueError, match="4 mics but 3 calibration tables"):
+        make_geometry().backend_config(base)
+
+    # Own tables or a fitted calibration file cover every mic
+    tables = [[1, 0.5]] * 4
+    config = make_geometry(cal_amplitudes=tables).backend_config(base)
+    assert config["cal_amplitudes"] == tables and len(config["mic_positions"]) == 4
+    config = make_geometry(mic_calibration="square_calibration.json").backend_config(base)
+    assert config["mic_calibration"] == "square_calibration.json"
+
+def test_names_must_match_positions():
+    with pytest.raises(ValueError):
+        FixtureGeometry(["a", "b"], [[0, 0, 0]])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_fixture_supervisor.py: fusing the estimates of several arrays and
+    aiming ahead of the fused position, without worker processes
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import queue, time
+import numpy as np
+import pytest
+
+from fixture_supervisor import FixtureSupervisor, MIN_WEIGHT_DISTANCE
+from target_tracker import TargetTracker
+
+class FakeLaser:
+    last_latency = 0.0
+
+    def __init__(this):
+        this.targets = []
+
+    def submit(this, target, origin=None):
+        this.targets.append(target)
+
+def make_supervisor(arrays=2):
+    supervisor = FixtureSupervisor(["array%d.json" % (i) for i in range(arrays)], max_age=0.1, offline=True)
+    supervisor.results = queue.Queue()
+    supervisor.running = set(range(arrays))
+    return supervisor
+
+def test_fuse_weights_by_inverse_square_distance():
+    supervisor = make_supervisor()
+    supervisor.results.put((0, 10.0, (0, 0, 0), 100.0))
+    supervisor.results.put((1, 10.0, (50, 0, 0), 200.0))
+    assert supervisor.update(0) and supervisor.update(0)
+
+    # 1/100^2 against 1/200^2, four times the pull
+    np.testing.assert_allclose(supervisor.position, (10, 0, 0))
+    assert supervisor.latest[0][2] == pytest.approx(1 / 100 ** 2)
+
+def test_close_estimates_weigh_the_same():
+    supervisor = make_supervisor()
+    supervisor.results.put((0, 10.0, (0, 0, 0), 1.0))
+    supervisor.results.put((1, 10.0, (50, 0, 0), MIN_WEIGHT_DISTANCE / 2))
+    supervisor.update(0)
+    supervisor.update(0)
+    np.testing.assert_allclose(supervisor.position, (25, 0, 0))
+
+def test_fuse_drops_old_estimates():
+    supervisor = make_supervisor(3)
+    supervisor.latest = {0: (10.0, (0, 0, 0), 1.0), 1: (10.05, (30, 0, 0), 1.0), 2: (9.85, (600, 0, 0), 1.0)}
+    np.testing.assert_allclose(supervisor.fuse(10.08), (15, 0, 0))
+    np.testing.assert_allclose(supervisor.fuse(10.12), (30, 0, 0))
+    assert supervisor.fuse(10.2) is None
+
+def test_finished_array_is_forgotten():
+    supervisor = make_supervisor()
+    supervisor.results.put((0, 10.0, (0, 0, 0), 100.0))
+    supervisor.results.put((0, None, None, None))
+    assert supervisor.update(0)
+    assert supervisor.update(0)
+    assert 0 not in supervisor.latest and supervisor.running == {1}
+    supervisor.results.put((1, None, None, None))
+    assert not supervisor.update(0)
+
+def test_laser_is_aimed_ahead_of_a_moving_target():
+    supervisor = make_supervisor()
+    supervisor.laser = FakeLaser()
+    supervisor.tracker = TargetTracker(500, 1)
+    supervisor.window = 0.05
+
+    # Two arrays see a target moving 200 mm/s along x, captured up to now
+    start = time.monotonic() - 0.6
+    for i in range(30):
+        t = i * 0.02
+        supervisor.results.put((i % 2, start + t, (200 * t, 300, 50), 300.0))
+        supervisor.update(0)
+
+    # At least the averaging window and the 20 ms since the last capture
+    x, y, z = supervisor.laser.targets[-1]
+    assert 200 * 0.07 * 0.8 < x - supervisor.position[0] < 200 * 0.5
+    assert y == pytest.approx(300, abs=1) and z == pytest.approx(50, abs=1)
+
+def test_without_tracker_the_fused_position_is_aimed_at():
+    supervisor = make_supervisor()
+    supervisor.laser = FakeLaser()
+    supervisor.results.put((0, 1.0, (10, 20, 30), 100.0))
+    supervisor.update(0)
+    assert supervisor.laser.targets == [(10, 20, 30)]
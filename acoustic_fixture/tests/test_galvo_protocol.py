@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_galvo_protocol.py: frame encoder and decoder"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import pytest
+from numpy.testing import assert_allclose
+from galvo_protocol import (encode, encode_move, decode_move, encode_setpoints, decode_setpoints,
+    FrameEncoder, FrameDecoder, FRAME_MOVE, FRAME_SETPOINT, FRAME_LASER_ON, FRAME_LASER_OFF,
+    FRAME_ACK, FRAME_NAK, MAX_PAYLOAD, MAX_TARGETS, MAX_SETPOINTS)
+
+def decode_all(data):
+    return FrameDecoder().feed(data)
+
+def test_move_round_trip():
+    targets = [(1.5, 200.0, -3.25), (0.0, 328.8, 18.0)]
+    frame, = decode_all(encode_move(targets, 9))
+    assert (frame.type, frame.seq) == (FRAME_MOVE, 9)
+    assert_allclose(decode_move(frame.payload), targets, rtol=1e-6)
+
+def test_setpoint_round_trip():
+    setpoints = [(0, 4095), (2047, 1), (65535, 0)]
+    frame, = decode_all(encode_setpoints(setpoints, 200))
+    assert (frame.type, frame.seq) == (FRAME_SETPOINT, 200)
+    assert decode_setpoints(frame.payload) == setpoints
+
+def test_laser_round_trip():
+    encoder = FrameEncoder()
+    frames = decode_all(encoder.laser(True) + encoder.laser(False))
+    assert [(f.type, f.seq, f.payload) for f in frames] == [(FRAME_LASER_ON, 0, b""), (FRAME_LASER_OFF, 1, b"")]
+
+def test_replies_are_six_bytes():
+    # SYNC, LEN, SEQ, TYPE and the Fletcher-16
+    for type in (FRAME_ACK, FRAME_NAK):
+        reply = encode(type, b"", 7)
+        assert len(reply) == 6
+        frame, = decode_all(reply)
+        assert (frame.type, frame.seq, frame.payload) == (type, 7, b"")
+
+def test_resync_past_text_and_garbage():
+    decoder = FrameDecoder()
+    ack = encode(FRAME_ACK, b"", 4)
+    data = b"x: 1.00, y: 2.00\r\n\rsh$ " + ack + b"\x00\xff\x13" + encode_move([(1, 2, 3)], 5)
+
+    # Byte at a time, like a slow serial port
+    frames = []
+    for b in data:
+        frames += decoder.feed(bytes((b,)))
+    assert [(f.type, f.seq) for f in frames] == [(FRAME_ACK, 4), (FRAME_MOVE, 5)]
+    assert decoder.skipped > 0
+    assert decoder.errors == 0
+
+def test_stray_sync_byte_with_impossible_length():
+    decoder = FrameDecoder()
+    frames = decoder.feed(b"\xa5\xff" + encode(FRAME_ACK, b"", 1))
+    assert [(f.type, f.seq) for f in frames] == [(FRAME_ACK, 1)]
+    assert decoder.errors == 1
+
+@pytest.mark.parametrize("index", [1, 2, 3, 4, -2, -1])
+def test_corrupt_byte_gives_no_frame(index):
+    frame = bytearray(encode_move([(1, 2, 3)], 7))
+    frame[index] ^= 0x40
+    decoder = FrameDecoder()
+    assert decoder.feed(bytes(frame)) == []
+
+    # The next good frame still comes through
+    assert [(f.type, f.seq) for f in decoder.feed(bytes(64) + encode(FRAME_ACK, b"", 8))] == [(FRAME_ACK, 8)]
+
+def test_payload_limit():
+    assert len(encode(FRAME_MOVE, bytes(MAX_PAYLOAD))) == MAX_PAYLOAD + 6
+    with pytest.raises(ValueError):
+        encode(FRAME_MOVE, bytes(MAX_PAYLOAD + 1))
+    with pytest.raises(ValueError):
+        encode_move([(0, 0, 0)] * (MAX_TARGETS + 1))
+    with pytest.raises(ValueError):
+        encode_setpoints([(0, 0)] * (MAX_SETPOINTS + 1))
+
+def test_moves_split_at_max_targets():
+    targets = [(i, 200.0, -i) for i in range(2 * MAX_TARGETS + 1)]
+    frames = decode_all(b"".join(FrameEncoder().moves(targets)))
+    assert [len(decode_move(f.payload)) for f in frames] == [MAX_TARGETS, MAX_TARGETS, 1]
+    assert_allclose([t for f in frames for t in decode_move(f.payload)], targets, rtol=1e-6)
+
+def test_setpoints_split_at_max_setpoints():
+    setpoints = [(i, 4095 - i) for i in range(MAX_SETPOINTS * 2 + 3)]
+    frames = decode_all(b"".join(FrameEncoder().setpoints(setpoints)))
+    assert [len(decode_setpoints(f.payload)) for f in frames] == [MAX_SETPOINTS, MAX_SETPOINTS, 3]
+    assert [s for f in frames for s in decode_setpoints(f.payload)] == setpoints
+    assert [f.seq for f in frames] == [0, 1, 2]
+
+def test_sequence_wraps():
+    encoder = FrameEncoder()
+    encoder.seq = 254
+    frames = decode_all(b"".join(encoder.laser(True) for i in range(4)))
+    assert [f.seq for f in frames] == [254, 255, 0, 1]
+    assert encode(FRAME_ACK, b"", 257)[2] == 1
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_gcode_compiler.py: G-code frames and their encoding for the sender"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from gcode_compiler import parse_gcode, encode_frames, FRAME_DTYPE
+from galvo_protocol import FrameDecoder, decode_move, decode_setpoints, FRAME_MOVE, FRAME_SETPOINT, FRAME_LASER_ON, FRAME_LASER_OFF, MAX_SETPOINTS
+from trajectory import galvo_setpoints
+
+WALL = 200
+
+## drawing
+# @return FRAME_DTYPE array, 20 moves, laser on, 40 moves, laser off, 3 moves
+def drawing():
+    moves = lambda n, offset: [(FRAME_MOVE, offset + i, i / 2) for i in range(n)]
+    rows = moves(20, 0) + [(FRAME_LASER_ON, 0, 0)] + moves(40, 100) + [(FRAME_LASER_OFF, 0, 0)] + moves(3, 200)
+    return np.array(rows, dtype=FRAME_DTYPE)
+
+def decode(data, offsets):
+    frames = FrameDecoder().feed(data)
+    assert len(frames) == len(offsets) - 1
+    assert [f.seq for f in frames] == list(range(len(frames)))
+    return frames
+
+def test_parse_switches_the_laser_on_extrusion():
+    frames = parse_gcode(["G1 X1 Y2", "G1 X3 Y4 E1 ; draw", "G1 X5 Y6 E2", "G1 X7 Y8", "M84"])
+    assert frames["type"].tolist() == [FRAME_MOVE, FRAME_LASER_ON, FRAME_MOVE, FRAME_MOVE, FRAME_LASER_OFF, FRAME_MOVE]
+
+def test_setpoints_are_batched_between_laser_switches():
+    frames = drawing()
+    data, offsets = encode_frames(frames, WALL, setpoints=True)
+    decoded = decode(data, offsets)
+
+    types = [f.type for f in decoded]
+    counts = [len(decode_setpoints(f.payload)) for f in decoded if f.type == FRAME_SETPOINT]
+    assert types == [FRAME_SETPOINT] * 2 + [FRAME_LASER_ON] + [FRAME_SETPOINT] * 3 + [FRAME_LASER_OFF, FRAME_SETPOINT]
+    assert counts == [MAX_SETPOINTS, 5, MAX_SETPOINTS, MAX_SETPOINTS, 10, 3]
+
+    # Same codes in the same order as mapping every move on its own
+    moves = frames[frames["type"] == FRAME_MOVE]
+    expected = galvo_setpoints(np.column_stack([moves["x"], np.full(len(moves), WALL), moves["y"]])).tolist()
+    assert [list(s) for f in decoded if f.type == FRAME_SETPOINT for s in decode_setpoints(f.payload)] == expected
+
+def test_moves_are_batched():
+    frames = drawing()
+    data, offsets = encode_frames(frames, WALL)
+    decoded = decode(data, offsets)
+    targets = [t for f in decoded if f.type == FRAME_MOVE for t in decode_move(f.payload)]
+    moves = frames[frames["type"] == FRAME_MOVE]
+    assert_allclose(targets, np.column_stack([moves["x"], np.full(len(moves), WALL), moves["y"]]), rtol=1e-6)
+
+def test_frames_fit_the_receive_buffer():
+    for setpoints in (False, True):
+        data, offsets = encode_frames(drawing(), WALL, setpoints, max_frame=64)
+        assert np.diff(offsets).max() <= 64
+        decode(data, offsets)
+
+def test_stream_to_the_fake_galvo():
+    pytest.importorskip("tty")
+    serial = pytest.importorskip("serial")
+    from fake_galvo import FakeGalvo
+    from gcode_sender import FrameStreamer
+    from serial_comms import transport
+
+    frames = drawing()
+    galvo = FakeGalvo(boot_delay=0.1)
+    ser = serial.Serial(galvo.start(), 115200)
+    assert transport(ser).wait_for("sh$", 2) is not None
+
+    # A window smaller than a frame still sends it, one at a time
+    for window in (64, 32):
+        data, offsets = encode_frames(frames, WALL, setpoints=True)
+        streamer = FrameStreamer(ser, window)
+        streamer.stream(data, offsets)
+        assert (streamer.sent, streamer.acked, streamer.lost, streamer.naks) == (len(offsets) - 1, len(offsets) - 1, 0, 0)
+
+    last = frames[-1]
+    assert list(galvo.dac) == galvo_setpoints([[last["x"], WALL, last["y"]]])[0].tolist()
+    assert not galvo.laser
+    ser.close()
+
+def test_late_duplicate_ack_returns_no_credit():
+    pytest.importorskip("serial")
+    from gcode_sender import FrameStreamer
+    from galvo_protocol import encode, FRAME_ACK
+    from test_serial_comms import MemoryPort
+
+    # Frame 0 is acknowledged twice while 1 and 2 are still in flight
+    port = MemoryPort(encode(FRAME_ACK, b"", 0) * 2)
+    streamer = FrameStreamer(port, 64)
+    streamer.inflight.extend([(0, 20), (1, 20), (2, 20)])
+    streamer.credit = 4
+
+    streamer.receive()
+    assert list(streamer.inflight) == [(1, 20), (2, 20)]
+    assert (streamer.credit, streamer.acked, streamer.lost, streamer.stray) == (24, 1, 0, 1)
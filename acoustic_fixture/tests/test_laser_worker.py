@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_laser_worker.py: acknowledgements against testing/fake_galvo.py
+    Needs pseudo terminals, so it only runs on Linux and macOS.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import time
+import pytest
+
+pytest.importorskip("tty")
+serial = pytest.importorskip("serial")
+
+from fake_galvo import FakeGalvo
+from laser_worker import LaserCommandWorker
+from serial_comms import transport
+
+SLOW = 0.3
+FAST = 0.05
+TIMEOUT = 0.2
+
+## run_worker
+# Time out on one slow command, then send two fast ones
+# @return (worker, latency of each fast command)
+def run_worker(binary):
+    galvo = FakeGalvo(latency=SLOW, boot_delay=0.1)
+    ser = serial.Serial(galvo.start(), 115200)
+    assert transport(ser).wait_for("\rsh$ ", 2) is not None
+
+    worker = LaserCommandWorker(ser, timeout=TIMEOUT, binary=binary)
+    worker.start()
+    worker.submit((0, 200, 0))
+    time.sleep(SLOW + 0.2)
+    galvo.latency = FAST
+
+    latencies = []
+    for z in (10, 20):
+        worker.submit((0, 200, z))
+        time.sleep(SLOW)
+        latencies.append(worker.last_latency)
+    worker.stop()
+    ser.close()
+    return worker, latencies
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_late_reply_is_not_credited_to_the_next_command(binary):
+    worker, latencies = run_worker(binary)
+    assert (worker.sent, worker.acked, worker.timeouts) == (3, 2, 1)
+
+    # A stale reply would ack the next command right away
+    assert all(latency >= FAST for latency in latencies)
+    if not binary:
+        assert worker.late == 1
+
+def test_timeout_does_not_hold_up_the_next_target():
+    galvo = FakeGalvo(latency=SLOW, boot_delay=0.1)
+    ser = serial.Serial(galvo.start(), 115200)
+    assert transport(ser).wait_for("\rsh$ ", 2) is not None
+
+    worker = LaserCommandWorker(ser, timeout=TIMEOUT)
+    worker.start()
+    worker.submit((0, 200, 0))
+    time.sleep(TIMEOUT + 0.02)
+
+    # The first prompt is still due, the next target must go out anyway
+    galvo.latency = FAST
+    worker.submit((0, 200, 10))
+    time.sleep(0.04)
+    assert worker.pending is None
+    assert len(galvo.commands) == 1 and worker.timeouts == 1
+
+    time.sleep(SLOW)
+    worker.stop()
+    ser.close()
+    assert (worker.sent, worker.acked, worker.late) == (2, 1, 1)
+    assert worker.last_latency >= SLOW - TIMEOUT
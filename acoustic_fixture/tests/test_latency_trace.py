@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_latency_trace.py: histogram buckets and percentiles
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+
+from latency_trace import LatencyHistogram, LatencyTracer, SUB_COUNT, HALF_COUNT
+
+def test_bucket_bounds():
+    bucket, bucket_value = LatencyHistogram.bucket, LatencyHistogram.bucket_value
+    values = np.unique(np.concatenate([np.arange(4096), np.logspace(3, 8, 2000).astype(int)]))
+
+    previous = -1
+    for value in values.tolist():
+        index = bucket(value)
+        assert bucket_value(index) <= value < bucket_value(index + 1)
+        assert index in (previous, previous + 1) or value > 4096
+        previous = index
+
+        # Exact below SUB_COUNT, at most 1 / HALF_COUNT wide above
+        width = bucket_value(index + 1) - bucket_value(index)
+        assert width == 1 if value < SUB_COUNT else width <= bucket_value(index) / HALF_COUNT
+
+    # Every bucket starts where the one before it ends
+    starts = [bucket_value(i) for i in range(1000)]
+    assert all(bucket(start) == i for i, start in enumerate(starts))
+
+@pytest.mark.parametrize("seed", range(3))
+def test_percentiles_match_numpy(seed):
+    rng = np.random.default_rng(seed)
+    values = np.concatenate([rng.lognormal(np.log(8000), 0.6, 5000), rng.integers(0, SUB_COUNT, 200)]).astype(int)
+
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.total == len(values) and histogram.max == values.max()
+
+    for p in (1, 10, 50, 90, 99, 99.9):
+        exact = np.percentile(values, p, method="inverted_cdf")
+        assert abs(histogram.percentile(p) - exact) <= max(0.5, exact / HALF_COUNT)
+    assert histogram.percentile(100) == values.max()
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in (3, 3, 7, 12, -5):
+        histogram.record(value)
+    assert histogram.percentile(0) == 0.5
+    assert histogram.percentile(50) == 3.5
+    assert histogram.percentile(100) == 12
+    assert LatencyHistogram().percentile(50) == 0
+
+def test_tracer_reports_seconds():
+    tracer = LatencyTracer()
+    assert tracer.latency("ack") is None
+    for i in range(100):
+        tracer.mark("ack", 10.0, 10.0 + 0.004 + i * 1e-5)
+    tracer.mark("ack", None)
+    assert tracer.latency("ack") == pytest.approx(0.0045, rel=1 / HALF_COUNT)
+    assert tracer.snapshot()["checkpoints"]["ack"]["count"] == 100
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_lookup_localizer.py: compiling a table from a calibration dataset
+    and finding the calibration positions in it again
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+pytest.importorskip("scipy")
+
+from calibration_store import CalibrationWriter
+from feature_extraction import extract_features, peak_features
+from lookup_localizer import compile_lookup, log_amplitude, LookupLocalizer, LPF, HPF, RATE
+
+BUFFER = 882
+REPEATS = 4
+MICS = np.array([[-69.3, -40, 0], [0, 80, 0], [69.3, -40, 0]])
+
+## capture
+# @return (REPEATS x mics x BUFFER) 440 Hz tone, louder at the mics closer to position
+def capture(position, seed):
+    rng = np.random.default_rng(seed)
+    gains = 20 / np.linalg.norm(MICS - position, axis=1)
+    t = np.arange(REPEATS * BUFFER) / RATE
+    stream = gains[:, None] * np.sin(2 * np.pi * 440 * t + rng.uniform(0, 2 * np.pi, (len(MICS), 1)))
+    stream += rng.normal(0, 1e-3, stream.shape)
+    return stream.reshape(len(MICS), REPEATS, BUFFER).transpose(1, 0, 2).astype(np.float32)
+
+@pytest.fixture
+def table(tmp_path):
+    grid = np.stack(np.meshgrid([-50, 0, 50], [100, 150], [50, 100], indexing="ij"), axis=-1).reshape(-1, 3)
+    path = str(tmp_path / "data")
+
+    # Every position is visited twice
+    with CalibrationWriter(path, REPEATS, len(MICS), BUFFER, RATE) as writer:
+        for visit in range(2):
+            for i, position in enumerate(grid):
+                writer.append(position, capture(position, visit * len(grid) + i))
+
+    output = str(tmp_path / "lookup.npz")
+    assert compile_lookup(path, output) == len(grid)
+    return path, output, grid
+
+def test_keys_are_the_mean_log_amplitude(table):
+    path, output, grid = table
+    features, positions = extract_features(path, LPF, HPF, RATE, 3)
+    with np.load(output) as data:
+        keys, table_positions = data["keys"], data["positions"]
+
+    assert_allclose(np.sort(table_positions, axis=0), np.sort(grid, axis=0))
+    for key, position in zip(keys, table_positions):
+        rows = (positions == position).all(axis=1)
+        assert rows.sum() == 2 * REPEATS
+        assert_allclose(key, log_amplitude(features[rows]).mean(axis=0))
+
+def test_recovers_grid_points(table):
+    path, output, grid = table
+    localizer = LookupLocalizer(output)
+
+    # A table key is its own position
+    assert_allclose(localizer.query(localizer.keys), localizer.positions, atol=1e-6)
+
+    # A new capture at a grid point, averaged like the fixture does
+    for i, position in enumerate(grid):
+        peaks = peak_features(capture(position, 1000 + i)[None], LPF, HPF, RATE)[0]
+        found = localizer.query(log_amplitude(peaks).mean(axis=0))
+        assert found.shape == (1, 3)
+        assert np.linalg.norm(found[0] - position) < 5
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_mic_calibration.py: fitting the amplitude curves and the parameter file
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import json
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from mic_calibration import MicCalibration, FORMAT_VERSION
+
+DISTANCES = np.linspace(20, 400, 30)
+
+# (a, b, floor) of each mic
+TRUE_PARAMS = np.array([[30.0, 5.0, 0.002], [25.0, -3.0, 0.004], [40.0, 0.0, 0.001]])
+
+## amplitudes
+# @return (N x mics) amplitudes on the inverse square curves
+def amplitudes(distances):
+    a, b, floor = TRUE_PARAMS.T
+    return a ** 2 / (distances[:, None] - b) ** 2 + floor
+
+def test_fit_recovers_inverse_square():
+    distances = np.repeat(DISTANCES[:, None], len(TRUE_PARAMS), axis=1)
+    cal = MicCalibration.fit(amplitudes(DISTANCES), distances, source="synthetic")
+    assert len(cal) == len(TRUE_PARAMS) and cal.limit == 2 * DISTANCES.max()
+    assert_allclose(cal.evaluate(amplitudes(DISTANCES)), distances, atol=2)
+    assert_allclose(cal.params[:, 2], TRUE_PARAMS[:, 2], atol=2e-4)
+
+def test_fit_log_follows_a_power_law():
+    distances = np.repeat(DISTANCES[:, None], 2, axis=1)
+    power = np.stack([5000 * (DISTANCES + 10) ** -1.8, 800 * (DISTANCES + 10) ** -1.2], axis=1)
+    cal = MicCalibration.fit(power, distances, "log")
+    assert_allclose(cal.evaluate(power), distances, rtol=1e-6)
+    assert_allclose(cal.residuals(power, distances), 0, atol=1e-6)
+
+def test_from_tables():
+    tables = amplitudes(DISTANCES).T.tolist()
+    cal = MicCalibration.from_tables(DISTANCES, tables)
+    assert cal.source == "tables"
+    assert_allclose(cal.evaluate(amplitudes(DISTANCES)[:5]), np.repeat(DISTANCES[:5, None], 3, axis=1), atol=2)
+
+def test_evaluate_is_clamped():
+    cal = MicCalibration("inverse_square", TRUE_PARAMS, limit=500)
+    d = cal.evaluate([[0, 0, 0], [1e3, 1e3, 1e3]])
+    assert (d[0] == 500).all() and (d[1] >= 0).all()
+
+@pytest.mark.parametrize("model", ["inverse_square", "log"])
+def test_save_load_round_trip(tmp_path, model):
+    distances = np.repeat(DISTANCES[:, None], len(TRUE_PARAMS), axis=1)
+    cal = MicCalibration.fit(amplitudes(DISTANCES), distances, model, "synthetic")
+    path = str(tmp_path / "mic_calibration.json")
+    cal.save(path)
+
+    with open(path, "r") as f:
+        data = json.load(f)
+    assert data["version"] == FORMAT_VERSION and data["model"] == model
+
+    loaded = MicCalibration.load(path)
+    assert (loaded.model, loaded.limit, loaded.source) == (model, cal.limit, "synthetic")
+    assert_allclose(loaded.params, cal.params)
+    assert_allclose(loaded.evaluate(amplitudes(DISTANCES)), cal.evaluate(amplitudes(DISTANCES)))
+
+def test_load_checks_the_version(tmp_path):
+    path = str(tmp_path / "mic_calibration.json")
+    MicCalibration("log", [[1, 2, 10]]).save(path)
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    # Files from before the version field are still read
+    del data["version"], data["limit"]
+    with open(path, "w") as f:
+        json.dump(data, f)
+    assert MicCalibration.load(path).limit == 1000.0
+
+    data["version"] = FORMAT_VERSION + 1
+    with open(path, "w") as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError, match="format %d" % (FORMAT_VERSION + 1)):
+        MicCalibration.load(path)
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        MicCalibration("cubic", TRUE_PARAMS)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_multilateration.py: positions back from the ranges they give"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from multilateration import MicArray, multilaterate, closed_form, least_squares
+
+RADIUS = 75.0
+TRIANGLE = np.array([[-RADIUS * np.sqrt(3) / 2, -RADIUS / 2, 0], [0, RADIUS, 0], [RADIUS * np.sqrt(3) / 2, -RADIUS / 2, 0]])
+SQUARE = np.array([[-60, -60, 0], [60, -60, 0], [60, 60, 0], [-60, 60, 0]], float)
+TETRAHEDRON = np.array([[-60, -60, 0], [60, -60, 0], [0, 60, 0], [0, 0, 50]], float)
+
+def ranges(points, mics):
+    return np.linalg.norm(points[:, None, :] - mics[None], axis=2)
+
+def in_front(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(-200, 200, count), rng.uniform(-200, 200, count), rng.uniform(20, 400, count)])
+
+## squared_residual
+# @return sum of the squared range residuals of each position
+def squared_residual(positions, distances, mics):
+    return ((ranges(positions, mics) - distances)**2).sum(axis=1)
+
+@pytest.mark.parametrize("mics", [TRIANGLE, SQUARE, TETRAHEDRON], ids=["triangle", "square", "tetrahedron"])
+def test_noiseless_round_trip(mics):
+    points = in_front(100)
+    assert_allclose(multilaterate(ranges(points, mics), mics), points, atol=1e-6)
+
+    # The same through a reused array, and one row at a time
+    array = MicArray(mics)
+    assert_allclose(multilaterate(ranges(points, mics), array), points, atol=1e-6)
+    assert_allclose(multilaterate(ranges(points[:1], mics)[0], array), points[:1], atol=1e-6)
+
+def test_a_missing_mic_leaves_a_solvable_array():
+    points = in_front(20, 1)
+    distances = ranges(points, SQUARE)
+    for missing in range(len(SQUARE)):
+        keep = np.arange(len(SQUARE)) != missing
+        assert_allclose(multilaterate(distances[:, keep], SQUARE[keep]), points, atol=1e-6)
+
+def test_noisy_ranges_fall_back_to_the_best_fit():
+    # Close to a flat array, noise often leaves the spheres without a common point
+    rng = np.random.default_rng(3)
+    points = np.column_stack([rng.uniform(-150, 150, 400), rng.uniform(-150, 150, 400), rng.uniform(5, 80, 400)])
+    distances = ranges(points, SQUARE) + rng.normal(0, 3, (400, 4))
+    failed = ~np.isfinite(closed_form(distances, SQUARE)).all(axis=1)
+    assert failed.sum() > 10
+
+    # A warm start on the array plane, like the fixture's first frame, must
+    # still find fits off the plane. They fit no worse than a fit started at
+    # the truth.
+    positions = multilaterate(distances[failed], SQUARE, (0, 0, 0))
+    best = least_squares(distances[failed], SQUARE, points[failed], 200)
+    assert np.isfinite(positions).all()
+    assert (positions[:, 2] >= 0).all()
+    assert (positions[:, 2] > 1).any()
+    assert (squared_residual(positions, distances[failed], SQUARE) <= squared_residual(best, distances[failed], SQUARE) + 0.1).all()
+
+def test_spheres_that_miss_a_three_mic_array_fit_on_its_plane():
+    point = np.array([[40.0, -20.0, 25.0]])
+    distances = ranges(point, TRIANGLE) - 8
+    assert not np.isfinite(closed_form(distances, TRIANGLE)).any()
+
+    # By symmetry the best fit is on the plane, warm started or not
+    for initial in (None, (0, 0, 0), (40, -20, 25)):
+        position = multilaterate(distances, TRIANGLE, initial)
+        best = least_squares(distances, TRIANGLE, np.array([[40.0, -20.0, 0.0]]), 200)
+        assert_allclose(position, best, atol=0.05)
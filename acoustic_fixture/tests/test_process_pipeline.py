@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_process_pipeline.py: the capture and DSP stages offline on a
+    synthetic tone, in spawned processes like the fixture runs them
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import pytest
+
+pytest.importorskip("scipy")
+
+from multiprocessing import shared_memory
+from audio_capture import SyntheticSource
+from process_pipeline import ProcessPipeline
+import acoustic_fixture as af
+
+BLOCKS = 60
+
+class LimitedSource(SyntheticSource):
+    """ A synthetic tone that ends after BLOCKS blocks"""
+
+    def generate(this, n):
+        if this.position >= BLOCKS * n:
+            return None
+        return SyntheticSource.generate(this, n)
+
+## make_source
+# Source factory for the capture stage, a module level function pickles by name.
+# Not paced, the capture engine throttles it instead of dropping samples.
+def make_source():
+    return LimitedSource(af.BUFFER, af.RATE, len(af.DEFAULT_GEOMETRY), gains=[0.3, 0.1, 0.05], noise=1e-3, realtime=False, seed=1)
+
+def test_offline_pipeline_processes_every_block():
+    pipeline = ProcessPipeline(backend="trilateration", source_factory=make_source, slots=4, offline=True, verbose=False)
+    pipeline.start()
+    name = pipeline.ring.shm.name
+    try:
+        assert pipeline.wait(60)
+    finally:
+        pipeline.stop()
+
+    assert pipeline.processed.value == BLOCKS
+    assert pipeline.dropped.value == 0
+
+    # stop() unlinked the ring
+    assert pipeline.ring is None
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_rolling_stats.py: RollingWindow against the roll() + average() it replaces"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+from rolling_stats import RollingWindow
+
+PUSHES = 400
+
+## naive
+# The window the old smoothers kept, rolled and recomputed on every push
+# @return (value, max) of each push, (pushes x channels) each
+def naive(values, window, mode):
+    store = np.zeros((values.shape[1], window))
+    means, maxes = [], []
+    for column in values:
+        for channel, value in enumerate(column):
+            if mode == "peak" and value > np.average(store[channel]):
+                store[channel] = value
+            else:
+                store[channel] = np.roll(store[channel], -1)
+                store[channel, -1] = value
+        means.append(np.average(store, axis=1))
+        maxes.append(np.max(store, axis=1))
+    return np.array(means), np.array(maxes)
+
+## rolling
+# @return (value, max) of each push of a RollingWindow
+def rolling(values, window, mode):
+    stats = RollingWindow(values.shape[1], window, mode)
+    means, maxes = [], []
+    for column in values:
+        means.append(stats.push(column).copy())
+        maxes.append(stats.max.copy())
+    return np.array(means), np.array(maxes)
+
+@pytest.mark.parametrize("mode", ["mean", "peak"])
+@pytest.mark.parametrize("window", [1, 7, 32])
+def test_matches_the_naive_window(mode, window):
+    # Values at mixed scales make new - (new - old) round away from old
+    rng = np.random.default_rng(window)
+    values = rng.random((PUSHES, 3)) * np.array([1.0, 1e3, 1e-3]) + rng.normal(0, 1e-9, (PUSHES, 3))
+
+    expected_mean, expected_max = naive(values, window, mode)
+    mean, maximum = rolling(values, window, mode)
+    np.testing.assert_allclose(mean, expected_mean, rtol=1e-9, atol=1e-12)
+    np.testing.assert_array_equal(maximum, expected_max)
+
+def test_max_follows_the_window_down():
+    # A falling sequence evicts the max on every push after the first lap
+    values = np.linspace(10, 0, PUSHES)[:, None]
+    _, maximum = rolling(values, 5, "mean")
+    np.testing.assert_array_equal(maximum[5:, 0], values[1:-4, 0])
+
+def test_ema():
+    stats = RollingWindow(2, 3, "ema")
+    values = np.random.default_rng(1).random((PUSHES, 2))
+    expected = np.zeros(2)
+    for column in values:
+        expected = 0.5 * expected + 0.5 * column
+        np.testing.assert_allclose(stats.push(column), expected)
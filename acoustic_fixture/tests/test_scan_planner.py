@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_scan_planner.py: move timing, route order and the motion timeline
+    against testing/fake_marlin.py. The printer tests need pseudo terminals.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import time
+import numpy as np
+import pytest
+
+from scan_planner import ScanPlanner, MotionTimeline, grid_points, move_time, move_distance
+
+ACCEL = 1000
+
+# (distance, speed) that never reach the cruise speed and that do
+TRIANGLE = (10.0, 150.0)
+TRAPEZOID = (100.0, 50.0)
+
+@pytest.mark.parametrize("distance, speed", [TRIANGLE, TRAPEZOID])
+def test_move_distance_inverts_move_time(distance, speed):
+    total = float(move_time(distance, speed, ACCEL))
+
+    # Every distance along the move is reached at the time it takes to get there
+    t = np.linspace(0, total, 2001)
+    d = move_distance(t, distance, speed, ACCEL)
+    assert d[0] == 0 and d[-1] == pytest.approx(distance)
+    assert (np.diff(d) >= 0).all()
+    assert move_distance(total / 2, distance, speed, ACCEL) == pytest.approx(distance / 2)
+    assert move_distance(total + 1, distance, speed, ACCEL) == pytest.approx(distance)
+
+    # Speed and acceleration stay inside the limits and the move starts and ends at rest
+    v = np.gradient(d, t)
+    a = np.diff(d, 2) / (t[1] - t[0]) ** 2
+    assert v.max() <= speed * 1.001 and abs(v[0]) < 1 and abs(v[-1]) < 1
+    assert np.abs(a).max() <= ACCEL * 1.01
+
+    # A triangle peaks at sqrt(distance * accel), a trapezoid cruises
+    peak = min(speed, np.sqrt(distance * ACCEL))
+    assert v.max() == pytest.approx(peak, rel=0.01)
+    if distance < speed ** 2 / ACCEL:
+        assert peak < speed and total == pytest.approx(2 * np.sqrt(distance / ACCEL))
+    else:
+        assert total == pytest.approx(distance / speed + speed / ACCEL)
+
+def test_move_time_is_continuous_at_the_cruise_speed():
+    speed = 100.0
+    edge = speed ** 2 / ACCEL
+    below, above = move_time([edge * (1 - 1e-9), edge], speed, ACCEL)
+    assert below == pytest.approx(above)
+
+@pytest.mark.parametrize("seed", range(4))
+def test_two_opt_is_never_slower_than_serpentine(seed):
+    rng = np.random.default_rng(seed)
+    planner = ScanPlanner()
+    points = grid_points(60, 40, 40, 20)
+    points = points[rng.random(len(points)) < 0.7]
+    start = rng.uniform(-100, 100, 3)
+
+    serpentine = planner.serpentine(points)
+    order = planner.two_opt(points, serpentine, start)
+    assert sorted(order) == list(range(len(points)))
+    assert planner.duration(points[order], start) <= planner.duration(points[serpentine], start) + 1e-9
+
+    route = planner.plan(points, start)
+    assert planner.duration(route, start) <= planner.duration(points[serpentine], start) + 1e-9
+
+## query
+# @return (M114 position, monotonic time half way between the request and the reply)
+def query(port):
+    sent = time.monotonic()
+    port.write_line("M114", "\r\n")
+    line, arrived = port.read_until(b"\n", 1)
+    assert port.wait_for("ok\n", 1) is not None
+    position = [float(field[2:]) for field in line.decode("utf-8").split()[:3]]
+    return np.array(position), (sent + arrived) / 2, arrived - sent
+
+@pytest.mark.parametrize("target, feedrate", [((TRIANGLE[0], 0, 0), TRIANGLE[1]), ((60, 30, 0), 40)])
+def test_timeline_follows_fake_marlin(target, feedrate):
+    pytest.importorskip("tty")
+    serial = pytest.importorskip("serial")
+    from fake_marlin import FakeMarlin
+    from serial_comms import transport
+
+    planner = ScanPlanner()
+    printer = FakeMarlin(planner, boot_delay=0.1)
+    ser = serial.Serial(printer.start(), 115200)
+    port = transport(ser)
+    port.echo = False
+    assert port.wait_for("LCD status changed\n", 2) is not None
+
+    # Like continuous_scan, the move starts when the printer accepts it
+    timeline = MotionTimeline((0, 0, 0), planner)
+    accepted = port.send("G1 X%.2f Y%.2f Z%.2f F%d" % (target + (feedrate * 60,)), "ok\n", 1, "\r\n")
+    end_time = timeline.add(accepted, target, feedrate)
+
+    checked = 0
+    while True:
+        position, t, round_trip = query(port)
+        expected = timeline.at(t)
+        assert np.linalg.norm(position - expected) <= feedrate * (round_trip + 0.005) + 0.02
+        checked += 1
+        if t > end_time + 0.05:
+            break
+    ser.close()
+
+    assert checked > 3
+    np.testing.assert_allclose(position, target, atol=0.01)
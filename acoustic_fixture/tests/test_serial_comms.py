@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_serial_comms.py: SerialTransport buffering on an in-memory port"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import time
+from serial_comms import SerialTransport, split_frames
+from galvo_protocol import encode, FrameDecoder, FRAME_ACK
+
+class MemoryPort:
+    """ The part of serial.Serial the transport uses, replies are queued up front"""
+
+    def __init__(this, data=b""):
+        this.rx = bytearray(data)
+        this.tx = bytearray()
+        this.timeout = None
+
+    @property
+    def in_waiting(this):
+        return len(this.rx)
+
+    def read(this, n):
+        if not this.rx:
+            time.sleep(this.timeout or 0)
+        data = bytes(this.rx[:n])
+        del this.rx[:n]
+        return data
+
+    def write(this, data):
+        this.tx += data
+
+PROMPT = "\rsh$ "
+
+def test_timeout_is_restored_on_release():
+    port = MemoryPort()
+    port.timeout = 2
+    transport = SerialTransport(port, poll=0.01)
+    assert port.timeout == 0.01
+    transport.release()
+    assert port.timeout == 2
+
+def test_wait_for_times_out_and_keeps_the_buffer():
+    transport = SerialTransport(MemoryPort(b"partial"), poll=0.01, echo=False)
+    assert transport.wait_for(PROMPT, 0.05) is None
+    assert transport.buffer == b"partial"
+
+def test_anchored_match_ignores_the_middle_of_a_line():
+    transport = SerialTransport(MemoryPort(b"echo: book\nok\n"), poll=0.01, echo=False)
+    data, _ = transport.read_until("ok\n", 0.1, anchored=True)
+    assert data == b"echo: book\nok\n"
+    assert not transport.buffer
+
+def test_ack_wait_keeps_the_text():
+    ack = encode(FRAME_ACK, b"", 7)
+    transport = SerialTransport(MemoryPort(b"x: 1.0\r\n" + ack + PROMPT.encode()), poll=0.01, echo=False)
+    assert transport.wait_ack(FrameDecoder(), 7, 0.1)
+    assert transport.wait_for(PROMPT, 0.1) is not None
+
+def test_text_wait_keeps_the_frames():
+    ack = encode(FRAME_ACK, b"", 3)
+    transport = SerialTransport(MemoryPort(ack + b"Laser Enabled\r\n" + PROMPT.encode()), poll=0.01, echo=False)
+    assert transport.wait_for(PROMPT, 0.1) is not None
+    assert transport.buffer == ack
+    assert transport.wait_ack(FrameDecoder(), 3, 0.1)
+
+def test_ack_for_another_frame_is_passed_over():
+    data = encode(FRAME_ACK, b"", 1) + encode(FRAME_ACK, b"", 2)
+    transport = SerialTransport(MemoryPort(data), poll=0.01, echo=False)
+    assert transport.wait_ack(FrameDecoder(), 2, 0.1)
+
+def test_skip_drops_the_late_reply():
+    transport = SerialTransport(MemoryPort((PROMPT * 2).encode()), poll=0.01, echo=False)
+    transport.skip(PROMPT, 1.0)
+    assert transport.wait_for(PROMPT, 0.1) is not None
+    assert transport.wait_for(PROMPT, 0.05) is None
+
+def test_skip_expires():
+    transport = SerialTransport(MemoryPort(PROMPT.encode()), poll=0.01, echo=False)
+    transport.skip(PROMPT, 0.0)
+    time.sleep(0.01)
+    assert transport.wait_for(PROMPT, 0.1) is not None
+
+def test_flush_drops_late_replies_without_waiting():
+    port = MemoryPort()
+    transport = SerialTransport(port, poll=0.05, echo=False)
+    transport.skip(PROMPT, 1.0)
+    transport.skip(PROMPT, 1.0)
+
+    # One late prompt is there, the other one is still on its way
+    port.rx += PROMPT.encode()
+    start = time.monotonic()
+    transport.flush()
+    transport.flush()
+    assert time.monotonic() - start < 0.05
+    assert transport.dropped == 1
+
+    port.rx += (PROMPT * 2).encode()
+    assert transport.wait_for(PROMPT, 0.1) is not None
+    assert transport.dropped == 2
+
+def test_split_frames_holds_back_an_incomplete_frame():
+    ack = encode(FRAME_ACK, b"", 5)
+    text, frames, partial = split_frames(bytearray(b"a" + ack + b"b" + ack[:3]))
+    assert (text, frames, partial) == (b"ab", ack, ack[:3])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_session_recorder.py: a recorded session replays the same blocks and times"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+from audio_capture import CaptureEngine, SyntheticSource
+from session_recorder import SessionRecorder, ReplaySource, load_session
+
+BLOCK = 1000
+RATE = 44100
+BLOCKS = 12
+GAP = 5     # Block left out of the recording, like one dropped live
+
+## capture
+# Read every block a source delivers through a capture engine
+# @return ([blocks], [block times])
+def capture(source, channels, count=None):
+    engine = CaptureEngine(channels, BLOCK, RATE)
+    engine.start(source)
+    blocks, times = [], []
+    while count is None or len(blocks) < count:
+        block = engine.read_block(timeout=5)
+        if block is None:
+            break
+        blocks.append(block)
+        times.append(engine.block_time)
+    engine.stop()
+    return blocks, times
+
+def test_record_and_replay(tmp_path):
+    live_blocks, live_times = capture(SyntheticSource(BLOCK, RATE, 3, 617, delays=[0, 1e-4, 2e-4], noise=0.01, realtime=False, seed=1), 3, BLOCKS)
+
+    recorder = SessionRecorder(str(tmp_path), 3, BLOCK, RATE)
+    for k, (block, block_time) in enumerate(zip(live_blocks, live_times)):
+        if k != GAP:
+            recorder.write(block, block_time)
+    recorder.close()
+    recorded_blocks, recorded_times, rate = load_session(str(tmp_path))
+    assert rate == RATE and len(recorded_blocks) == BLOCKS - 1
+
+    for realtime in (False, True):
+        blocks, times = capture(ReplaySource(str(tmp_path), realtime=realtime), 3)
+        assert len(blocks) == BLOCKS - 1
+        for block, recorded in zip(blocks, recorded_blocks):
+            np.testing.assert_array_equal(block, recorded)
+
+        # One offset to the replay start, the spacing and the gap are kept
+        shift = np.asarray(times) - recorded_times
+        np.testing.assert_allclose(shift, shift[0], rtol=0, atol=1e-9)
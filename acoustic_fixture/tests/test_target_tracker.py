@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_target_tracker.py: tracking a simulated flight among clutter"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+from numpy.testing import assert_allclose
+from target_tracker import TargetTracker
+
+DT = 1000 / 44100
+START = np.array([-150.0, 300.0, 20.0])
+VELOCITY = np.array([300.0, -120.0, 60.0])  # mm/s
+NOISE = 3.0                                 # mm
+
+def path(t):
+    return START + VELOCITY * t
+
+def test_follows_a_constant_velocity_path():
+    rng = np.random.default_rng(2)
+    tracker = TargetTracker(measurement_noise=NOISE)
+    ids = []
+    for k in range(120):
+        t = 10 + k * DT
+
+        # The target with localization noise, and a clutter point somewhere else in the room
+        target = path(t - 10) + rng.normal(0, NOISE, 3)
+        clutter = rng.uniform([-500, 100, -300], [500, 800, 300])
+        confirmed = tracker.update([clutter, target], t)
+        if k >= 10:
+            assert len(confirmed) == 1
+            ids.append(tracker.predictions()[0][0])
+
+    # One track the whole way, on the path and moving with it
+    assert len(set(ids)) == 1
+    state = tracker.update(np.zeros((0, 3)), t + DT)[0]
+    assert_allclose(state[:3], path(t + DT - 10), atol=3 * NOISE)
+    assert_allclose(state[3:], VELOCITY, atol=40)
+
+    lead = 0.05
+    assert_allclose(tracker.target(lead), path(t + DT + lead - 10), atol=5 * NOISE)
+
+def test_clock_never_runs_backwards():
+    tracker = TargetTracker()
+    tracker.update([[0, 300, 0]], 1.0)
+    tracker.update([[10, 300, 0]], 1.1)
+    state = tracker.X.copy()
+
+    # A frame from before the last one doesn't rewind the clock
+    tracker.update(np.zeros((0, 3)), 1.05)
+    assert tracker.time == 1.1
+    assert_allclose(tracker.X, state)
+
+    # The next frame predicts only from the last frame's time
+    tracker.update(np.zeros((0, 3)), 1.2)
+    assert_allclose(tracker.X[0, :3], state[0, :3] + state[0, 3:] * 0.1)
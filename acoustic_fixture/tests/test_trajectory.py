@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_trajectory.py: path simplification and the host side DAC mapping"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import math, warnings
+import numpy as np
+import pytest
+from trajectory import segment_distance, rdp, coalesce_collinear, simplify, galvo_setpoints, H1, ANGLE_MAX, DAC_MAX
+
+## firmware_setpoint
+# LaserGalvo::setPos and mapf() from lasergalvo.cpp in 64 bit doubles. On the
+# AVR double is 32 bits like the host mapping, so the two can truncate to
+# codes one apart.
+def firmware_setpoint(x, y, z, x_inverted=False, z_inverted=True):
+    def mapf(val, in_min, in_max, out_min, out_max):
+        return (val - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+    z_axis = min(max(math.atan(z / y), -ANGLE_MAX), ANGLE_MAX)
+    x_axis = min(max(math.atan(x / (H1 + math.sqrt(y * y + z * z))), -ANGLE_MAX), ANGLE_MAX)
+    volt_x = mapf(x_axis, -ANGLE_MAX, ANGLE_MAX, DAC_MAX, 0) if x_inverted else mapf(x_axis, -ANGLE_MAX, ANGLE_MAX, 0, DAC_MAX)
+    volt_z = mapf(z_axis, -ANGLE_MAX, ANGLE_MAX, DAC_MAX, 0) if z_inverted else mapf(z_axis, -ANGLE_MAX, ANGLE_MAX, 0, DAC_MAX)
+    return int(volt_x), int(volt_z)
+
+def test_segment_distance_past_the_ends():
+    distance = segment_distance(np.array([[5.0, 1.0], [12.0, 0.0], [-3.0, 4.0]]), np.array([0.0, 0.0]), np.array([10.0, 0.0]))
+    assert distance.tolist() == pytest.approx([1.0, 2.0, 5.0])
+
+def test_rdp_drops_points_near_a_straight_line():
+    points = [[0, 0], [1, 0.01], [2, -0.01], [3, 0]]
+    assert rdp(points, 0.1).tolist() == [True, False, False, True]
+    assert rdp(points, 0.001).all()
+
+def test_doubling_back_keeps_the_tip():
+    assert simplify([[0, 0], [10, 0], [5, 0]], 0.1).all()
+
+def test_hatch_keeps_every_pass():
+    assert simplify([[0, 0], [10, 0.05], [0, 0.1], [10, 0.15]], 0.1).all()
+
+def test_coalesce_merges_collinear_and_repeated_points():
+    points = [[0, 0], [1, 0], [1, 0], [2, 0], [3, 0], [3, 1]]
+    assert coalesce_collinear(points).tolist() == [True, False, False, False, True, True]
+
+def test_coalesce_path_back_to_the_start():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert coalesce_collinear([[0, 0], [1, 0], [0, 0]]).all()
+        assert simplify([[0, 0], [1, 0], [0, 0], [1, 0]], 0.1).all()
+
+def test_simplified_path_stays_within_tolerance():
+    rng = np.random.default_rng(1)
+    points = np.cumsum(rng.normal(0, 1, (400, 2)), axis=0)
+    tolerance = 0.5
+    keep = simplify(points, tolerance)
+    assert keep[0] and keep[-1] and keep.sum() < len(points)
+
+    # Every dropped point is within the tolerance of the segment that replaced it
+    index = np.flatnonzero(keep)
+    for start, end in zip(index[:-1], index[1:]):
+        if end - start > 1:
+            assert segment_distance(points[start + 1:end], points[start], points[end]).max() <= tolerance + 1e-9
+
+def test_setpoints_match_the_firmware():
+    rng = np.random.default_rng(2)
+    targets = np.column_stack([rng.uniform(-150, 150, 500), rng.uniform(50, 500, 500), rng.uniform(-150, 150, 500)])
+    codes = galvo_setpoints(targets)
+    expected = np.array([firmware_setpoint(*t) for t in targets])
+
+    assert np.abs(codes.astype(int) - expected).max() <= 1
+    assert codes.dtype == np.uint16
+
+def test_setpoints_clip_at_the_angle_limit():
+    targets = [[1000, 1, 1000], [-1000, 1, -1000]]
+    expected = np.array([firmware_setpoint(*t) for t in targets])
+    assert np.abs(galvo_setpoints(targets).astype(int) - expected).max() <= 1
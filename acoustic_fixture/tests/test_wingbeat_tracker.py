@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" test_wingbeat_tracker.py: hold, hysteresis and the SNR gate of the
+    wingbeat tracker, and the fixture only retuning backends that allow it
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+import pytest
+
+from wingbeat_tracker import WingbeatTracker
+from localization_backends import TrilaterationBackend, BACKENDS
+import acoustic_fixture as af
+
+RATE = 44100
+N = 882
+BAND = (400, 480)
+HOLD = 5
+
+rng = np.random.default_rng(3)
+
+## tone
+# @return (channels x N) sine at freq in white noise
+def tone(freq, amplitude=1.0, noise=0.05, channels=4):
+    t = np.arange(N) / RATE
+    return amplitude * np.sin(2 * np.pi * freq * t + rng.uniform(0, 2 * np.pi, (channels, 1))) + rng.normal(0, noise, (channels, N))
+
+def make_tracker():
+    return WingbeatTracker(N, RATE, BAND, hysteresis=20, hold=HOLD, snr=4)
+
+def test_noise_is_not_a_tone():
+    tracker = make_tracker()
+    for i in range(20):
+        assert tracker.update(tone(600, amplitude=0, noise=1)) is None
+        assert tracker.frequency is None
+    assert tracker.retunes == 0
+
+def test_weak_tone_stays_below_snr():
+    tracker = make_tracker()
+    for i in range(20):
+        assert tracker.update(tone(600, amplitude=0.02, noise=1)) is None
+    assert tracker.frequency is None and tracker.retunes == 0
+
+def test_retunes_after_hold_blocks():
+    tracker = make_tracker()
+    for i in range(HOLD - 1):
+        assert tracker.update(tone(600)) is None
+        assert tracker.moved == i + 1
+    low, high = tracker.update(tone(600))
+    assert (low + high) / 2 == pytest.approx(600, abs=3)
+    assert high - low == pytest.approx(BAND[1] - BAND[0])
+    assert tracker.retunes == 1 and tracker.moved == 0
+
+    # Settled on the new tone
+    for i in range(3 * HOLD):
+        assert tracker.update(tone(600)) is None
+
+def test_tone_inside_hysteresis_keeps_band():
+    tracker = make_tracker()
+    for i in range(5 * HOLD):
+        assert tracker.update(tone(455)) is None
+        assert tracker.moved == 0
+    assert tracker.frequency == pytest.approx(455, abs=3)
+    assert tracker.band() == BAND
+
+def test_jumping_tone_restarts_hold():
+    tracker = make_tracker()
+    for i in range(5 * HOLD):
+        assert tracker.update(tone(600 if i % 2 else 750)) is None
+        assert tracker.moved == 1
+    assert tracker.retunes == 0
+
+## RetunableBackend
+# Trilateration that declares it doesn't depend on the band
+class RetunableBackend(TrilaterationBackend):
+    retunable = True
+
+@pytest.mark.parametrize("backend", ["trilateration", "retunable"])
+def test_fixture_only_retunes_band_independent_backends(backend, monkeypatch):
+    monkeypatch.setitem(BACKENDS, "retunable", "test_wingbeat_tracker:RetunableBackend")
+    fixture = af.create_fixture(backend=backend, offline=True, verbose=False, capture=False)
+    try:
+        for i in range(2 * HOLD):
+            fixture.feed(tone(600, channels=len(fixture.geometry)).astype(np.float32), i * N / RATE)
+    finally:
+        fixture.close()
+
+    if backend == "trilateration":
+        assert fixture.wingbeat is None
+        assert fixture.band == (af.LPF, af.HPF)
+    else:
+        assert fixture.wingbeat.retunes == 1
+        assert sum(fixture.band) / 2 == pytest.approx(600, abs=3)
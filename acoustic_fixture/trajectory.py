@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" trajectory.py: laser paths prepared on the host
+    Patterns are simplified before they go over the 115200 baud link, so the
+    link carries corners instead of every point along a straight line:
+    Ramer-Douglas-Peucker drops points within a tolerance of the path and
+    collinear points are merged into one segment. Where the path turns back
+    is kept, so hatching and retraced strokes survive.
+
+    The firmware turns every MOVE target into mirror angles and DAC codes
+    with float math and prints a debug line for it. galvo_setpoints() does
+    the same mapping as LaserGalvo::setPos in lasergalvo.cpp for a whole path
+    at once, so SETPOINT frames carry the DAC codes ready to write, 4 bytes
+    per point instead of 12.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+
+# Galvo geometry from lasergalvo.h
+H1 = 0.85
+ANGLE_MAX = np.pi / 9
+DAC_MAX = 4095
+
+# Axis inversion of the LaserGalvo in main.cpp
+X_INVERTED = False
+Z_INVERTED = True
+
+## segment_distance
+# Distance to the segment, not the line through it, so a path that doubles
+# back past an end point keeps its tip
+#
+# @param  points (N x D) points
+# @param  a      (D) start of the segment
+# @param  b      (D) end of the segment
+# @return (N) distance of each point to the segment from a to b
+def segment_distance(points, a, b):
+    offset = points - a
+    direction = b - a
+    length2 = direction @ direction
+    if length2 == 0:
+        return np.linalg.norm(offset, axis=1)
+
+    t = np.clip(offset @ direction / length2, 0, 1)
+    return np.linalg.norm(offset - np.outer(t, direction), axis=1)
+
+## rdp
+# Ramer-Douglas-Peucker, the distances of each section are computed at once
+#
+# @param  points    (N x D) path
+# @param  tolerance largest distance a dropped point may be from the simplified path
+# @return (N) mask of the points to keep
+def rdp(points, tolerance):
+    points = np.asarray(points, dtype=float)
+    keep = np.zeros(len(points), bool)
+    if len(points) < 3:
+        keep[:] = True
+        return keep
+
+    keep[[0, -1]] = True
+    sections = [(0, len(points) - 1)]
+    while sections:
+        start, end = sections.pop()
+        if end - start < 2:
+            continue
+
+        distance = segment_distance(points[start + 1:end], points[start], points[end])
+        worst = np.argmax(distance)
+        if distance[worst] > tolerance:
+            split = start + 1 + worst
+            keep[split] = True
+            sections.append((start, split))
+            sections.append((split, end))
+    return keep
+
+## coalesce_collinear
+# Merge segments that continue in the same direction, and drop repeated points
+#
+# @param  points    (N x D) path
+# @param  tolerance largest distance of a merged point from the merged segment
+# @return (N) mask of the points to keep
+def coalesce_collinear(points, tolerance=1e-6):
+    points = np.asarray(points, dtype=float)
+    keep = np.ones(len(points), bool)
+    if len(points) < 3:
+        return keep
+
+    # Repeated points first, they have no direction
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    index = np.flatnonzero(keep)
+    p = points[index]
+    if len(p) < 3:
+        return keep
+
+    before = p[1:-1] - p[:-2]
+    after = p[2:] - p[1:-1]
+    span = p[2:] - p[:-2]
+    length = np.linalg.norm(span, axis=1, keepdims=True)
+
+    # Distance of each point from the segment joining its neighbours, and no
+    # turning back. A path back to where it was (A, B, A) has no span and is never straight.
+    moving = length[:, 0] > 0
+    safe = np.where(moving, length[:, 0], 1)[:, None]
+    off_line = np.linalg.norm(before - span * np.sum(before * span, axis=1, keepdims=True) / safe ** 2, axis=1)
+    straight = moving & (off_line <= tolerance) & (np.sum(before * after, axis=1) > 0)
+
+    # A run of straight points is one segment, dropping the run still leaves its ends
+    keep[index[1:-1][straight]] = False
+    return keep
+
+## turns_back
+# @param  points (N x D) path without repeated points
+# @return (N) mask of the points where the path turns by more than 90 degrees, and the ends
+def turns_back(points):
+    turns = np.ones(len(points), bool)
+    if len(points) > 2:
+        turns[1:-1] = np.sum((points[1:-1] - points[:-2]) * (points[2:] - points[1:-1]), axis=1) < 0
+    return turns
+
+## simplify
+# The points where the path turns back are always kept and RDP runs between
+# them. RDP only looks at distance, a hatch fill or a retraced stroke lies
+# within the tolerance of a single pass and would be folded into one.
+#
+# @param  points    (N x D) path
+# @param  tolerance RDP tolerance in the path's units, 0 only merges collinear points
+# @return (N) mask of the points to keep
+def simplify(points, tolerance):
+    points = np.asarray(points, dtype=float)
+    keep = coalesce_collinear(points)
+    if tolerance > 0:
+        index = np.flatnonzero(keep)
+        corners = np.flatnonzero(turns_back(points[index]))
+        for start, end in zip(corners[:-1], corners[1:]):
+            section = index[start:end + 1]
+            keep[section[~rdp(points[section], tolerance)]] = False
+    return keep
+
+## galvo_angles
+# Same mapping as LaserGalvo::setPos, in the firmware's float precision
+#
+# @param  points (N x 3) (x, y, z) laser targets
+# @return (N x 2) (xAxis, zAxis) mirror angles in radians
+def galvo_angles(points):
+    x, y, z = np.asarray(points, dtype=np.float32).reshape(-1, 3).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_axis = np.arctan(z / y)
+        x_axis = np.arctan(x / (np.float32(H1) + np.sqrt(y * y + z * z)))
+
+    # atan(0/0) is NaN on the host, the firmware's min/max turn it into -ANGLE_MAX
+    angle_max = np.float32(ANGLE_MAX)
+    angles = np.stack([x_axis, z_axis], axis=1)
+    return np.clip(np.nan_to_num(angles, nan=-angle_max), -angle_max, angle_max)
+
+## mapf
+# mapf() from mapf.h in float32, the operations in the same order
+def mapf(val, in_min, in_max, out_min, out_max):
+    f = np.float32
+    return (val - f(in_min)) * (f(out_max) - f(out_min)) / (f(in_max) - f(in_min)) + f(out_min)
+
+## galvo_setpoints
+# @param  points     (N x 3) (x, y, z) laser targets
+# @param  x_inverted mirror the x axis, like the LaserGalvo constructor
+# @param  z_inverted mirror the z axis
+# @return (N x 2) uint16 (x, z) DAC codes for SETPOINT frames
+def galvo_setpoints(points, x_inverted=X_INVERTED, z_inverted=Z_INVERTED):
+    angles = galvo_angles(points)
+    a = np.float32(ANGLE_MAX)
+
+    # The conversion to uint16_t truncates
+    x = mapf(angles[:, 0], -a, a, DAC_MAX, 0) if x_inverted else mapf(angles[:, 0], -a, a, 0, DAC_MAX)
+    z = mapf(angles[:, 1], -a, a, DAC_MAX, 0) if z_inverted else mapf(angles[:, 1], -a, a, 0, DAC_MAX)
+    return np.clip(np.stack([x, z], axis=1), 0, DAC_MAX).astype(np.uint16)
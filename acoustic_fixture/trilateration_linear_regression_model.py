@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-""" trilateration_linear_regression_model.py: linear regression for multioutput regression"""
+""" trilateration_linear_regression_model.py: linear regression for multioutput regression
+    Importing this module doesn't load anything, the model is read the first
+    time it is used. Run it directly to train and export a new model.
+"""
 
 __version__ = "1.0"
 
@@ -12,7 +15,8 @@ __license__ = "Apache 2.0"
 from sklearn.linear_model import LinearRegression
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.tree import DecisionTreeRegressor
-from acoustic_trilateration import butter_bandpass_filter
+from numpy import atleast_2d
+from feature_extraction import extract_features
 import pickle
 
 RATE = 44100
@@ -22,38 +26,30 @@ HPF = 480
 
 LOAD_MODEL = 1
 
-model = LinearRegression()
-training_input = []
-training_output = []
+model = None
 
+def load_model(path="model.obj"):
+    return pickle.load(open(path, "rb"))
 
-if LOAD_MODEL:
-    model = pickle.load(open("model.obj", "rb"))
-    training_input = pickle.load(open("training_input.obj", "rb"))
-    training_output = pickle.load(open("training_output.obj", "rb"))
-else:
-    data = pickle.load(open("training_data.db", "rb"))
+## train
+# Fit a model to the calibration data and export it. The features are cached
+# next to the dataset, so only the first run filters the raw audio.
+#
+# @param  model     unfitted sklearn regressor
+# @param  data_path calibration dataset from acoustic_fixture_calibration.py
+# @return the fitted model
+def train(model, data_path="training_data"):
+    training_input, training_output = extract_features(data_path, LPF, HPF, RATE, 3)
 
-    n_samples = 0
-
-    for key in data:
-        for buf in data[key]:
-            training_input.append([max(butter_bandpass_filter(mic, LPF, HPF, RATE, 3)) for mic in buf])
-            training_output.append(list(key))
-            n_samples += 1
-
-    print("Loaded %d samples" % (n_samples))
-
-    #print(training_input)
-    #print(training_output)
+    print("Loaded %d samples" % (len(training_input)))
 
     # define and fit the model
     model.fit(training_input, training_output)
 
     # export the model
     pickle.dump(model, open("model.obj", "wb"))
-    pickle.dump(training_input, open("training_input.obj", "wb"))
-    pickle.dump(training_output, open("training_output.obj", "wb"))
+
+    return model
 
 # make a prediction
 #row = [0.50249434, 1.14472371, 0.90159072]
@@ -63,4 +59,26 @@ else:
 #print(yhat[0])
 
 def predict(arr):
-    return model.predict([arr])
\ No newline at end of file
+    global model
+    if model is None:
+        model = load_model()
+    return model.predict([arr])
+
+class RegressionBackend:
+    """ Localization backend for the fixture, see localization_backends.py"""
+
+    def __init__(this, config):
+        this.model = load_model(config.get("model_path", "model.obj"))
+
+    # The model is trained on raw peak amplitudes
+    def features(this, peaks):
+        return peaks
+
+    def locate(this, amplitudes, previous=None):
+        return this.model.predict(atleast_2d(amplitudes))
+
+if __name__ == "__main__":
+    if LOAD_MODEL:
+        model = load_model()
+    else:
+        model = train(LinearRegression())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" wingbeat_tracker.py: follow the wingbeat tone from block to block
+    The wingbeat frequency of a mosquito changes with species, sex and
+    temperature, so a fixed passband loses every target outside it. Each
+    block the tracker measures the power at a few dozen candidate frequencies
+    in a search range and finds the strongest tone. The bandpass is retuned
+    only after the tone has stayed further than the hysteresis from the band
+    center for a few blocks, so noise or a passing second tone doesn't drag
+    the filter around. The fixture only follows the tone for backends that
+    set retunable, amplitudes calibrated in one band don't hold in another.
+
+    The candidates are a Goertzel bank, one DFT bin at any frequency each.
+    Running the Goertzel recurrence sample by sample would be a Python loop,
+    so the bank evaluates the same sums as one product of the block with a
+    precomputed Hann windowed cosine and sine table.
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import numpy as np
+
+class WingbeatTracker:
+    ## __init__
+    # @param n          samples per block
+    # @param fs         sampling rate
+    # @param band       (lowcut, highcut) the bandpass starts at, its width is kept
+    # @param search     (low, high) Hz to look for the tone in, keep low above half the band width
+    # @param step       Hz between candidate frequencies
+    # @param hysteresis Hz the tone must be from the band center to move the band
+    # @param hold       blocks in a row the tone must stay that far and in one place
+    # @param snr        peak power over the median power of the bank that counts as a tone
+    # @param smoothing  weight of the newest block in the averaged power
+    def __init__(this, n, fs, band, search=(300, 900), step=10, hysteresis=20, hold=5, snr=4, smoothing=0.5):
+        this.freqs = np.arange(search[0], search[1] + step / 2, step, dtype=float)
+        this.step = step
+        this.hysteresis = hysteresis
+        this.hold = hold
+        this.snr = snr
+        this.smoothing = smoothing
+
+        # Windowed cosine and sine rows of every candidate, (2 * candidates x n)
+        phase = 2 * np.pi * this.freqs[:, None] * np.arange(n) / fs
+        window = np.hanning(n)
+        this.kernel = np.vstack([np.cos(phase) * window, np.sin(phase) * window]).astype(np.float32)
+
+        this.width = band[1] - band[0]
+        this.center = (band[0] + band[1]) / 2
+        this.power = None
+        this.frequency = None   # Last tone found in Hz, None without one
+        this.moved = 0
+        this.retunes = 0
+
+    ## band
+    # @return (lowcut, highcut) the bandpass should be at
+    def band(this):
+        return (float(this.center - this.width / 2), float(this.center + this.width / 2))
+
+    ## spectrum
+    # @param  block (channels x n) samples
+    # @return power at each candidate frequency, summed over the channels
+    def spectrum(this, block):
+        parts = this.kernel @ np.asarray(block, dtype=np.float32).T
+        k = len(this.freqs)
+        return (parts[:k] ** 2 + parts[k:] ** 2).sum(axis=1)
+
+    ## update
+    # @param  block (channels x n) raw samples, before the bandpass
+    # @return (lowcut, highcut) to retune the bandpass to, None to leave it
+    def update(this, block):
+        power = this.spectrum(block)
+        if this.power is None:
+            this.power = power
+        else:
+            this.power = this.smoothing * power + (1 - this.smoothing) * this.power
+
+        # Silence or noise has no peak to follow, partition finds the median faster than a sort
+        peak = int(np.argmax(this.power))
+        middle = len(this.power) // 2
+        if this.power[peak] <= this.snr * np.partition(this.power, middle)[middle]:
+            this.frequency = None
+            this.moved = 0
+            return None
+
+        # Parabola through the log power of the neighbours, between candidates
+        offset = 0
+        if 0 < peak < len(this.freqs) - 1:
+            y0, y1, y2 = np.log(np.maximum(this.power[peak - 1:peak + 2], 1e-30))
+            denom = y0 - 2 * y1 + y2
+            if denom < 0:
+                offset = 0.5 * (y0 - y2) / denom
+        previous = this.frequency
+        this.frequency = this.freqs[peak] + offset * this.step
+
+        if abs(this.frequency - this.center) <= this.hysteresis:
+            this.moved = 0
+            return None
+
+        # Count the blocks the tone stayed put, a jump starts the count again
+        if previous is not None and abs(this.frequency - previous) <= this.hysteresis:
+            this.moved += 1
+        else:
+            this.moved = 1
+        if this.moved < this.hold:
+            return None
+
+        this.moved = 0
+        this.center = this.frequency
+        this.retunes += 1
+        return this.band()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" gcode_compiler.py: compile G-code into galvo_protocol frames
+    A G-code file is parsed once into a structured array with one row per
+    frame the sender streams, a MOVE to (x, y) or a laser on or off. The
+    array is cached next to the source as <file>.npz and compiled again when
+    the source or the compiler changes, so replaying a drawing never touches
+    the text again.
+
+    The laser is turned on with the first G1 that extrudes and off with the
+    first G1 that doesn't, extrusion is where the drawing is.
+
+    Before streaming, each run of moves can be simplified and the moves sent
+    as SETPOINT frames with the DAC codes already mapped, see trajectory.py.
+    Consecutive moves share a frame, so the framing is paid once per batch.
+
+    python gcode_compiler.py file.gcode
+"""
+
+__version__ = "1.0"
+
+__author__ = "Andrew Miyaguchi"
+__copyright__ = "Copyright 2021, Andrew Miyaguchi"
+__license__ = "Apache 2.0"
+
+import hashlib, os, sys
+import numpy as np
+
+# The host side protocol lives with the acoustic fixture code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "acoustic_fixture"))
+from galvo_protocol import encode, encode_move, encode_setpoints, FRAME_MOVE, FRAME_LASER_ON, FRAME_LASER_OFF, FRAME_ACK, MAX_TARGETS, MAX_SETPOINTS, TARGET, SETPOINT
+from trajectory import simplify, galvo_setpoints
+
+# Bump when the parsing changes so old caches are compiled again
+COMPILER_VERSION = 1
+
+FRAME_DTYPE = np.dtype([("type", "u1"), ("x", "<f4"), ("y", "<f4")])
+
+# Bytes of a frame around the payload
+FRAME_OVERHEAD = len(encode(FRAME_ACK))
+
+## parse_gcode
+# @param  lines G-code text lines
+# @return FRAME_DTYPE array
+def parse_gcode(lines):
+    frames = []
+    laser = False
+
+    for line in lines:
+        # Drop comments
+        words = line.split(";", 1)[0].upper().split()
+        if not words or words[0] != "G1":
+            continue
+
+        args = {}
+        for word in words[1:]:
+            try:
+                args[word[0]] = float(word[1:])
+            except ValueError:
+                pass
+
+        # Enable the laser on the first extrusion event, disable it on the last
+        if "E" in args and not laser:
+            frames.append((FRAME_LASER_ON, 0, 0))
+            laser = True
+        elif "E" not in args and laser:
+            frames.append((FRAME_LASER_OFF, 0, 0))
+            laser = False
+
+        # Only moves in the drawing plane aim the galvo
+        if "X" in args and "Y" in args:
+            frames.append((FRAME_MOVE, args["X"], args["Y"]))
+
+    return np.array(frames, dtype=FRAME_DTYPE)
+
+def source_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+## load_frames
+# @param  path  G-code file
+# @param  cache keep the compiled frames in <path>.npz
+# @return FRAME_DTYPE array
+def load_frames(path, cache=True):
+    digest = "%d:%s" % (COMPILER_VERSION, source_hash(path))
+    cache_path = path + ".npz"
+
+    if cache and os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            if str(data["source"]) == digest:
+                return data["frames"]
+
+    with open(path, "r") as f:
+        frames = parse_gcode(f)
+
+    if cache:
+        # Write to a temporary name first so a reader never sees half a cache
+        temp = cache_path + ".tmp.npz"
+        np.savez(temp, frames=frames, source=digest)
+        os.replace(temp, cache_path)
+    return frames
+
+## simplify_frames
+# Simplify every run of moves between laser switches on its own, so the
+# points where the laser turns on and off are kept
+#
+# @param  frames    FRAME_DTYPE array
+# @param  tolerance largest distance in mm a dropped point may be from the drawing
+# @return FRAME_DTYPE array
+def simplify_frames(frames, tolerance):
+    keep = np.ones(len(frames), bool)
+    moves = frames["type"] == FRAME_MOVE
+
+    # Start and end of each run of moves
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], moves.astype(np.int8), [0]])))
+    for start, end in zip(edges[::2], edges[1::2]):
+        points = np.column_stack([frames["x"][start:end], frames["y"][start:end]])
+        keep[start:end] = simplify(points, tolerance)
+    return frames[keep]
+
+## encode_frames
+# Encode every frame once, numbered in order so the acknowledgements can be
+# matched. Runs of moves are batched, as many as fit in a frame, but never
+# across a laser switch. Sequence numbers wrap at 256, which is far more
+# than can be in flight at once.
+#
+# @param  frames        FRAME_DTYPE array
+# @param  wall_distance distance to the wall in mm, G-code y is height on the wall
+# @param  setpoints     send moves as SETPOINT frames mapped on the host
+# @param  max_frame     largest encoded frame in bytes, the protocol's limit if None
+# @return (frame bytes back to back, offsets of each encoded frame and the end)
+def encode_frames(frames, wall_distance, setpoints=False, max_frame=None):
+    targets = np.column_stack([frames["x"], np.full(len(frames), wall_distance), frames["y"]])
+    points = galvo_setpoints(targets).tolist() if setpoints else targets.tolist()
+
+    batch = MAX_SETPOINTS if setpoints else MAX_TARGETS
+    if max_frame is not None:
+        batch = max(1, min(batch, (max_frame - FRAME_OVERHEAD - 1) // (SETPOINT.size if setpoints else TARGET.size)))
+
+    types = frames["type"].tolist()
+    encoded = []
+    i = 0
+    while i < len(types):
+        seq = len(encoded)
+        if types[i] != FRAME_MOVE:
+            encoded.append(encode(types[i], b"", seq))
+            i += 1
+            continue
+
+        end = i + 1
+        while end < len(types) and end - i < batch and types[end] == FRAME_MOVE:
+            end += 1
+        encoded.append(encode_setpoints(points[i:end], seq) if setpoints else encode_move(points[i:end], seq))
+        i = end
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(frame) for frame in encoded])
+    return b"".join(encoded), offsets
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: %s file.gcode" % (sys.argv[0]))
+        sys.exit(1)
+
+    frames = load_frames(sys.argv[1])
+    counts = {name: int((frames["type"] == type).sum()) for name, type in (("move", FRAME_MOVE), ("laser on", FRAME_LASER_ON), ("laser off", FRAME_LASER_OFF))}
+    print("%s: %d frames, %s" % (sys.argv[1] + ".npz", len(frames), ", ".join("%d %s" % (n, name) for name, n in counts.items())))
@@ -3,6 +3,16 @@
 
 """ gcode_sender.py
     Send gcode to the laser galvo module
+    The file is compiled into binary frames once, see gcode_compiler.py, and
+    replayed forever. Frames are sent as long as the firmware has room for
+    them: every unacknowledged byte uses up a credit of the firmware's
+    receive buffer and comes back with its ACK, so the galvo runs as fast as
+    it can take frames without the buffer ever overflowing.
+
+    Moves are simplified to TOLERANCE and sent as ready to write DAC codes
+    when SETPOINTS is set, see trajectory.py.
+
+    python gcode_sender.py file.gcode [port]
 """
 
 __version__ = "1.0"
@@ -11,90 +21,129 @@ __author__ = "Andrew Miyaguchi"
 __copyright__ = "Copyright 2021, Andrew Miyaguchi"
 __license__ = "Apache 2.0"
 
+import os
 import sys
 import time
 import serial
-from struct import *
-from serial.serialutil import Timeout
-from serial.win32 import ERROR_OPERATION_ABORTED
-
-G1 = 1
-M3 = 3
-M5 = 5
+from collections import deque
 
-if len(sys.argv) == 1:
-    print("Please point to a file.\n")
-    sys.exit(1)
+from gcode_compiler import load_frames, simplify_frames, encode_frames
 
-ser = serial.Serial("COM4", 115200, timeout=1)
-print(ser.name)
+# The host side protocol lives with the acoustic fixture code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "acoustic_fixture"))
+from galvo_protocol import FrameDecoder, FRAME_ACK, FRAME_NAK
+from serial_comms import transport
 
+COM_PORT = "COM4"
 WALL_DISTANCE = 200
-
-def millis():
-    return time.time_ns()/1000000
-
-with open(sys.argv[1], 'r') as f:
-    laserEnable = False
-    serialReady = False
-    serialWatchdog = millis()
+RX_BUFFER = 64      # Serial receive buffer of the firmware, bytes in flight
+ACK_TIMEOUT = 0.5   # Seconds without an ACK before the frames in flight are written off
+TOLERANCE = 0.1     # mm the simplified drawing may be off the original, 0 only merges straight lines
+SETPOINTS = True    # Map the moves to DAC codes here instead of on the microcontroller
+
+class FrameStreamer:
+    ## __init__
+    # @param ser     open serial port to the laser galvo
+    # @param window  bytes that may be unacknowledged
+    # @param timeout seconds to wait for an ACK
+    def __init__(this, ser, window=RX_BUFFER, timeout=ACK_TIMEOUT):
+        this.ser = transport(ser)
+        this.window = window
+        this.timeout = timeout
+        this.decoder = FrameDecoder()
+
+        # (seq, size) of every frame in flight, oldest first
+        this.inflight = deque()
+        this.credit = window
+        this.last_ack = time.monotonic()
+
+        # Statistics
+        this.sent = 0
+        this.acked = 0
+        this.naks = 0
+        this.lost = 0
+        this.stray = 0  # Replies to frames no longer in flight
+
+    ## receive
+    # Wait for replies and return the credits of the acknowledged frames
+    def receive(this):
+        for frame in this.decoder.feed(this.ser.read()):
+            if frame.type not in (FRAME_ACK, FRAME_NAK):
+                continue
+
+            # A late reply to a frame given up on returns no credit, it was
+            # returned when the frame was dropped from the queue
+            if not any(seq == frame.seq for seq, size in this.inflight):
+                this.stray += 1
+                continue
+
+            # Replies come back in order, frames before the reply were lost
+            while this.inflight:
+                seq, size = this.inflight.popleft()
+                this.credit += size
+                if seq == frame.seq:
+                    break
+                this.lost += 1
+
+            if frame.type == FRAME_ACK:
+                this.acked += 1
+            else:
+                this.naks += 1
+            this.last_ack = time.monotonic()
+
+        # Don't wait forever on a reply that will never come
+        if this.inflight and time.monotonic() - this.last_ack > this.timeout:
+            this.lost += len(this.inflight)
+            this.inflight.clear()
+            this.credit = this.window
+            this.last_ack = time.monotonic()
+
+    ## stream
+    # @param data    frame bytes back to back, see gcode_compiler.encode_frames
+    # @param offsets (N + 1) offsets of the frames in data
+    def stream(this, data, offsets):
+        i = 0
+        n = len(offsets) - 1
+        this.last_ack = time.monotonic()
+
+        while i < n or this.inflight:
+            # Send every frame that fits in one write, a frame larger than the
+            # window goes alone once nothing else is in flight
+            j = i
+            while j < n and (offsets[j + 1] - offsets[i] <= this.credit or (j == i and not this.inflight)):
+                this.inflight.append((data[offsets[j] + 2], offsets[j + 1] - offsets[j]))
+                j += 1
+
+            if j > i:
+                this.ser.write(data[offsets[i]:offsets[j]])
+                this.credit -= offsets[j] - offsets[i]
+                this.sent += j - i
+                i = j
+
+            this.receive()
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        print("Please point to a file.\n")
+        sys.exit(1)
+
+    compiled = load_frames(sys.argv[1])
+    frames = simplify_frames(compiled, TOLERANCE)
+    data, offsets = encode_frames(frames, WALL_DISTANCE, SETPOINTS, RX_BUFFER)
+    print("%d frames simplified to %d, %d bytes in %d frames" % (len(compiled), len(frames), len(data), len(offsets) - 1))
+
+    ser = serial.Serial(sys.argv[2] if len(sys.argv) > 2 else COM_PORT, 115200, timeout=ACK_TIMEOUT / 10)
+    print(ser.name)
 
     # Wait until the system is ready
     print("> Waiting for system ready...\n")
-    while(True):
-        if ser.in_waiting:
-            line = ser.readline().decode("utf-8")
-            print(line, end = '')
-            if "sh$" in line:
-                break
+    transport(ser).wait_for("sh$")
 
     print("\n> System ready. Sending commands")
+    streamer = FrameStreamer(ser)
+
     # Keep looping through the file
     while(True):
-        for line in f:
-            # Parse G1 commands
-            if "G1" in line:
-                x = None
-                y = None
-                z = None
-                e = None
-
-                # Extract x, y, and z coordinates0
-                for token in line.split():
-                    if "X" in token:
-                        x = float(token[1:])
-                    if "Y" in token:
-                        y = float(token[1:])
-                    if "Z" in token:
-                        z = float(token[1:])
-                    if "E" in token:
-                        e = float(token[1:])
-
-                # Enable the laser on the first extrusion event
-                if e is not None and laserEnable == False:
-                    ser.write(pack('c', M3))
-                    laserEnable = True
-                
-                # Disable the laser on the last extrusion event
-                elif e == None and laserEnable == True:
-                    ser.write(pack('c', M5))
-                    laserEnable = False
-
-                # Queue movement command if we have x and y coordinates.
-                # y == actually the z axis when projecting on a wall.
-                # y becomes the distance to the wall.
-                if x is not None and y is not None:
-                    ser.write(pack('cfff', x, WALL_DISTANCE, y))
-
-                # Wait until it's time to send another line
-                while millis() - serialWatchdog < 10:
-                    if ser.inWaiting():
-                        print((ser.read()).decode("utf-8"), end='')
-                
-                serialWatchdog = millis()
-            else:
-                pass
-
-        else:
-            # reset the file loop
-            f.seek(0)
\ No newline at end of file
+        start = time.time()
+        streamer.stream(data, offsets)
+        print("> %d frames in %.2f s, %d lost, %d NAK, %d stray replies" % (len(offsets) - 1, time.time() - start, streamer.lost, streamer.naks, streamer.stray))
@@ -62,9 +62,15 @@ public:
                bool zinverted);
 
     /**
-     * Set the laser target via cartesian coordinates
+     * Set the laser target via cartesian coordinates. The debug line is only
+     * printed for the text shell, binary frames are answered with just an ACK
      */
-    void setPos(double x, double y, double z);
+    void setPos(double x, double y, double z, bool verbose = true);
+
+    /**
+     * Write DAC codes mapped on the host, axis inversion already applied
+     */
+    void setVoltage(uint16_t x, uint16_t z);
 
 };
 
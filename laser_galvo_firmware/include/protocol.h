@@ -0,0 +1,145 @@
+/**
+ * protocol.h - Laser Galvo Firmware
+ * Copyright (c) 2021 Andrew Miyaguchi [https://github.com/XDleader555/acoustic_laser]
+ *
+ * Binary aim frames, see acoustic_fixture/galvo_protocol.py for the host side.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ */
+
+/**
+ * Frame layout, little endian:
+ * SYNC  uint8    0xA5
+ * LEN   uint8    payload length
+ * SEQ   uint8    sequence number, echoed back in the ACK
+ * TYPE  uint8    FRAME_* type
+ * DATA  LEN bytes
+ * SUM   uint16   Fletcher-16 of LEN, SEQ, TYPE and DATA
+ *
+ * SETPOINT payloads are a uint8 count followed by count x (x, z) uint16 DAC
+ * codes the host already mapped, see acoustic_fixture/trajectory.py
+ */
+
+#pragma once
+
+#include <stdint.h>
+#include <stdbool.h>
+#include <Arduino.h>
+
+#define FRAME_SYNC          0xA5
+#define FRAME_MOVE          0x01
+#define FRAME_SETPOINT      0x02
+#define FRAME_LASER_ON      0x03
+#define FRAME_LASER_OFF     0x05
+#define FRAME_ACK           0x06
+#define FRAME_NAK           0x15
+#define FRAME_MAX_PAYLOAD   61
+
+class FrameReader {
+private:
+    enum State { WAIT_SYNC, READ_LEN, READ_SEQ, READ_TYPE, READ_DATA, READ_SUM_LO, READ_SUM_HI };
+    State state = WAIT_SYNC;
+    uint8_t idx;
+    uint8_t sum1;
+    uint8_t sum2;
+    uint16_t check;
+
+    void add(uint8_t c) {
+        sum1 = (sum1 + c) % 255;
+        sum2 = (sum2 + sum1) % 255;
+    }
+
+public:
+    uint8_t len;
+    uint8_t seq;
+    uint8_t type;
+    uint8_t data[FRAME_MAX_PAYLOAD];
+    bool valid;
+
+    /**
+     * True while a frame is partially received
+     */
+    bool busy() {
+        return state != WAIT_SYNC;
+    }
+
+    /**
+     * Feed one received byte
+     *
+     * @param c received byte
+     * @return true when a frame is complete, check valid for the checksum
+     */
+    bool feed(uint8_t c) {
+        switch(state) {
+            case WAIT_SYNC:
+                if(c == FRAME_SYNC) {
+                    sum1 = 0;
+                    sum2 = 0;
+                    state = READ_LEN;
+                }
+                return false;
+            case READ_LEN:
+                add(c);
+                len = c;
+                state = len > FRAME_MAX_PAYLOAD ? WAIT_SYNC : READ_SEQ;
+                return false;
+            case READ_SEQ:
+                add(c);
+                seq = c;
+                state = READ_TYPE;
+                return false;
+            case READ_TYPE:
+                add(c);
+                type = c;
+                idx = 0;
+                state = len ? READ_DATA : READ_SUM_LO;
+                return false;
+            case READ_DATA:
+                add(c);
+                data[idx++] = c;
+                if(idx == len) {
+                    state = READ_SUM_LO;
+                }
+                return false;
+            case READ_SUM_LO:
+                check = c;
+                state = READ_SUM_HI;
+                return false;
+            case READ_SUM_HI:
+                check |= ((uint16_t) c) << 8;
+                state = WAIT_SYNC;
+                valid = check == (((uint16_t) sum2 << 8) | sum1);
+                return true;
+        }
+        return false;
+    }
+};
+
+/**
+ * Reply to a frame with an empty ACK or NAK frame
+ */
+inline void sendReply(uint8_t type, uint8_t seq) {
+    uint8_t frame[6] = {FRAME_SYNC, 0, seq, type, 0, 0};
+    uint8_t sum1 = 0;
+    uint8_t sum2 = 0;
+
+    for(int i = 1; i < 4; i ++) {
+        sum1 = (sum1 + frame[i]) % 255;
+        sum2 = (sum2 + sum1) % 255;
+    }
+
+    frame[4] = sum1;
+    frame[5] = sum2;
+    Serial.write(frame, sizeof(frame));
+}
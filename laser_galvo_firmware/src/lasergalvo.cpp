@@ -33,7 +33,7 @@ LaserGalvo::LaserGalvo(void (*setVoltageXCallback)(uint16_t output),
 
 extern char linebuf[64];
 
-void LaserGalvo::setPos(double x, double y, double z) {
+void LaserGalvo::setPos(double x, double y, double z, bool verbose) {
     double voltZ;
     double voltX;
     // Z is up and down, X is left and right. All calculations are in radians
@@ -44,8 +44,10 @@ void LaserGalvo::setPos(double x, double y, double z) {
     zAxis = min(max(zAxis, -ANGLE_MAX), ANGLE_MAX);
     xAxis = min(max(xAxis, -ANGLE_MAX), ANGLE_MAX);
 
-    sprintf(linebuf, "x: %.2f, y: %.2f, z: %.2f, xAxis: %.2frad, zAxis: %.2frad\n", x, y, z, xAxis, zAxis);
-    Serial.println(linebuf);
+    if(verbose) {
+        snprintf(linebuf, sizeof(linebuf), "x: %.2f, y: %.2f, z: %.2f, xAxis: %.2frad, zAxis: %.2frad\n", x, y, z, xAxis, zAxis);
+        Serial.println(linebuf);
+    }
 
     // PI/9 is 20 degrees
     if(zinverted) {
@@ -62,4 +64,9 @@ void LaserGalvo::setPos(double x, double y, double z) {
 
     (*setVoltageZ)(voltZ);
     (*setVoltageX)(voltX);
+}
+
+void LaserGalvo::setVoltage(uint16_t x, uint16_t z) {
+    (*setVoltageZ)(z);
+    (*setVoltageX)(x);
 }
\ No newline at end of file
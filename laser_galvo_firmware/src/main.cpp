@@ -26,9 +26,11 @@
 
 #include "lasergalvo.h"
 #include "configuration.h"
+#include "protocol.h"
 //#include "avr8-stub.h"
 
 MiyaSh sh;
+FrameReader frame;
 
 Adafruit_MCP4725 dacx;
 Adafruit_MCP4725 dacz;
@@ -99,6 +101,54 @@ void setup() {
   sh.begin();
 }
 
+// Run a complete binary frame from the host
+void handleFrame() {
+  int i;
+  float target[3];
+  uint16_t setpoint[2];
+
+  if(!frame.valid) {
+    sendReply(FRAME_NAK, frame.seq);
+    return;
+  }
+
+  switch(frame.type) {
+    case FRAME_MOVE:
+      for(i = 0; i < frame.data[0] && 1 + (i + 1) * (int) sizeof(target) <= frame.len; i ++) {
+        memcpy(target, &frame.data[1 + i * sizeof(target)], sizeof(target));
+        galvo.setPos(target[0], target[1], target[2], false);
+      }
+      break;
+    case FRAME_SETPOINT:
+      for(i = 0; i < frame.data[0] && 1 + (i + 1) * (int) sizeof(setpoint) <= frame.len; i ++) {
+        memcpy(setpoint, &frame.data[1 + i * sizeof(setpoint)], sizeof(setpoint));
+        galvo.setVoltage(setpoint[0], setpoint[1]);
+      }
+      break;
+    case FRAME_LASER_ON:
+      digitalWrite(LASER_PIN, HIGH);
+      break;
+    case FRAME_LASER_OFF:
+      digitalWrite(LASER_PIN, LOW);
+      break;
+    default:
+      sendReply(FRAME_NAK, frame.seq);
+      return;
+  }
+
+  sendReply(FRAME_ACK, frame.seq);
+}
+
 void loop() {
-  sh.run();
+  // Binary frames start with a sync byte that never appears in text commands
+  while(Serial.available() && (frame.busy() || Serial.peek() == FRAME_SYNC)) {
+    if(frame.feed(Serial.read())) {
+      handleFrame();
+    }
+  }
+
+  // The rest of a frame can still be on its way, the shell must not read it as a command
+  if(!frame.busy()) {
+    sh.run();
+  }
 }